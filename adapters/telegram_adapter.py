@@ -4,7 +4,8 @@ import logging
 from typing import Callable, Awaitable
 
 from telegram import Update
-from telegram.constants import ChatAction
+from telegram.constants import ChatAction, ParseMode
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     ApplicationBuilder,
@@ -14,9 +15,13 @@ from telegram.ext import (
 )
 
 from adapters.base import BotAdapter, IncomingMessage, OutgoingMessage
+from adapters.telegram_render import RenderedChunk, render_markdown
 
 logger = logging.getLogger(__name__)
 
+# 分段序号前缀 "[12/34]\n" 预留的长度
+CHUNK_PREFIX_RESERVE = 12
+
 
 class TelegramAdapter(BotAdapter):
     def __init__(self, config: dict, message_handler: Callable[[IncomingMessage, "TelegramAdapter"], Awaitable[None]]):
@@ -78,30 +83,37 @@ class TelegramAdapter(BotAdapter):
         logger.info("Telegram Bot 已停止")
 
     async def send_message(self, msg: OutgoingMessage):
-        """发送消息，长消息自动分段"""
-        text = msg.text
+        """发送消息，长消息自动分段
+
+        parse_mode 为 Markdown/HTML 时渲染为 Telegram HTML（按渲染后长度分段），否则按纯文本发送。
+        """
         max_len = self.config.get("max_message_length", 4000)
-        chunks = _split_message(text, max_len)
+        if msg.parse_mode:
+            chunks = render_markdown(msg.text, max_len - CHUNK_PREFIX_RESERVE)
+        else:
+            chunks = [RenderedChunk(html="", plain=c) for c in _split_message(msg.text, max_len - CHUNK_PREFIX_RESERVE)]
 
         for i, chunk in enumerate(chunks):
-            if len(chunks) > 1:
-                chunk = f"[{i + 1}/{len(chunks)}]\n{chunk}"
+            prefix = f"[{i + 1}/{len(chunks)}]\n" if len(chunks) > 1 else ""
+            await self._send_chunk(msg.chat_id, prefix, chunk)
+
+    async def _send_chunk(self, chat_id: str, prefix: str, chunk: RenderedChunk):
+        """发送单段：HTML 解析失败只降级重发一次纯文本，其他错误不重发（避免重试风暴）"""
+        if chunk.html:
             try:
                 await self.app.bot.send_message(
-                    chat_id=msg.chat_id,
-                    text=chunk,
-                    parse_mode=None,  # 先用纯文本，避免 Markdown 解析出错
+                    chat_id=chat_id, text=prefix + chunk.html, parse_mode=ParseMode.HTML,
                 )
+                return
+            except BadRequest as e:
+                logger.warning(f"HTML 消息被拒绝，降级为纯文本: {e}")
             except Exception as e:
                 logger.error(f"发送消息失败: {e}")
-                # parse_mode 出错时降级为纯文本重试
-                try:
-                    await self.app.bot.send_message(
-                        chat_id=msg.chat_id,
-                        text=chunk,
-                    )
-                except Exception as e2:
-                    logger.error(f"降级发送也失败: {e2}")
+                return
+        try:
+            await self.app.bot.send_message(chat_id=chat_id, text=prefix + chunk.plain)
+        except Exception as e:
+            logger.error(f"纯文本发送失败: {e}")
 
     async def send_typing_action(self, chat_id: str):
         """发送"正在输入"状态"""
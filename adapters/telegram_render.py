@@ -0,0 +1,191 @@
+"""Markdown → Telegram HTML 渲染
+
+Claude Code 输出的是 Markdown，直接用 Telegram 的 Markdown 模式发送时，
+未配对的 * _ ` 等字符会导致整条消息解析失败。这里改为渲染成 Telegram 支持的 HTML 子集：
+  - 正文全部做 HTML 转义，行内格式（`code`、**粗体**、*斜体*、~~删除线~~、链接、标题）
+    只在单行内匹配，标签必然成对
+  - ``` 代码块渲染为 <pre><code>，跨分段时在段尾闭合、下一段重新打开
+  - 按渲染后的长度分段，每段都是独立合法的 HTML，同时保留对应的纯文本用于降级发送
+渲染结果按内容哈希缓存，/detail 翻页和重发不会重复渲染。
+"""
+
+import hashlib
+import html
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+
+# 渲染缓存条数
+RENDER_CACHE_SIZE = 256
+
+_FENCE_RE = re.compile(r"^\s*(```|~~~)\s*([\w+#.-]*)")
+_HEADING_RE = re.compile(r"^#{1,6}\s+(.+)$")
+_INLINE_RE = re.compile(
+    r"`(?P<code>[^`\n]+)`"
+    r"|\*\*(?P<bold>[^*\n]+?)\*\*"
+    r"|~~(?P<strike>[^~\n]+?)~~"
+    r"|\[(?P<label>[^\]\n]+)\]\((?P<url>https?://[^\s)]+)\)"
+    r"|(?<![\w*])\*(?P<italic>[^*\s](?:[^*\n]*?[^*\s])?)\*(?![\w*])"
+)
+
+
+@dataclass(frozen=True)
+class RenderedChunk:
+    """一段可直接发送的消息：html 用于 parse_mode=HTML，plain 为解析失败时的纯文本降级"""
+    html: str
+    plain: str
+
+
+_cache: OrderedDict[tuple[bytes, int], list[RenderedChunk]] = OrderedDict()
+
+
+def render_markdown(text: str, max_len: int = 4000) -> list[RenderedChunk]:
+    """渲染并按 max_len（渲染后的字符数）分段，结果按内容哈希缓存"""
+    key = (hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest(), max_len)
+    chunks = _cache.get(key)
+    if chunks is not None:
+        _cache.move_to_end(key)
+        return chunks
+    chunks = _render(text, max_len)
+    _cache[key] = chunks
+    if len(_cache) > RENDER_CACHE_SIZE:
+        _cache.popitem(last=False)
+    return chunks
+
+
+def render_inline(line: str) -> str:
+    """渲染单行的行内格式，其余字符全部转义"""
+    heading = _HEADING_RE.match(line)
+    if heading:
+        return f"<b>{render_inline(heading.group(1))}</b>"
+    out = []
+    pos = 0
+    for m in _INLINE_RE.finditer(line):
+        out.append(html.escape(line[pos:m.start()], quote=False))
+        if m.group("code") is not None:
+            out.append(f"<code>{html.escape(m.group('code'), quote=False)}</code>")
+        elif m.group("bold") is not None:
+            out.append(f"<b>{html.escape(m.group('bold'), quote=False)}</b>")
+        elif m.group("strike") is not None:
+            out.append(f"<s>{html.escape(m.group('strike'), quote=False)}</s>")
+        elif m.group("url") is not None:
+            out.append(f'<a href="{html.escape(m.group("url"))}">{html.escape(m.group("label"), quote=False)}</a>')
+        else:
+            out.append(f"<i>{html.escape(m.group('italic'), quote=False)}</i>")
+        pos = m.end()
+    out.append(html.escape(line[pos:], quote=False))
+    return "".join(out)
+
+
+class _ChunkBuilder:
+    """逐行累积，超出长度时闭合当前段（含未结束的代码块）并开启新段"""
+
+    CODE_CLOSE = "</code></pre>"
+
+    def __init__(self, max_len: int):
+        self.max_len = max_len
+        self.chunks: list[RenderedChunk] = []
+        self.html: list[str] = []
+        self.plain: list[str] = []
+        self.size = 0
+        self.code_tag = ""   # 当前打开的代码块起始标签，空表示不在代码块内
+
+    def _append(self, html_part: str, plain_line: str = None):
+        reserve = len(self.CODE_CLOSE) if self.code_tag else 0
+        if self.size + len(html_part) + reserve > self.max_len and self.size > len(self.code_tag):
+            self.flush()
+        self.html.append(html_part)
+        self.size += len(html_part)
+        if plain_line is not None:
+            self.plain.append(plain_line)
+
+    def add(self, html_line: str, plain_line: str):
+        self._append(html_line + "\n", plain_line)
+
+    def add_code(self, line: str):
+        self._append(html.escape(line, quote=False) + "\n", line)
+
+    def open_code(self, lang: str, fence_line: str):
+        tag = f'<pre><code class="language-{lang}">' if lang else "<pre><code>"
+        # 开标签后至少要放得下一行，否则直接换段
+        if self.size + len(tag) + len(self.CODE_CLOSE) + 40 > self.max_len:
+            self.flush()
+        self.html.append(tag)
+        self.size += len(tag)
+        self.plain.append(fence_line)
+        self.code_tag = tag
+
+    def close_code(self, fence_line: str = None):
+        if not self.code_tag:
+            return
+        self._close_tag()
+        self.code_tag = ""
+        if fence_line is not None:
+            self.plain.append(fence_line)
+
+    def _close_tag(self):
+        if self.html[-1].endswith("\n"):
+            self.html[-1] = self.html[-1][:-1]
+            self.size -= 1
+        self.html.append(self.CODE_CLOSE + "\n")
+        self.size += len(self.CODE_CLOSE) + 1
+
+    def flush(self):
+        """结束当前段；处于代码块中时段尾闭合、新段开头重新打开"""
+        if not self.html:
+            return
+        if self.code_tag:
+            self._close_tag()
+        body = "".join(self.html).rstrip("\n")
+        if self.plain or body.strip():
+            self.chunks.append(RenderedChunk(html=body, plain="\n".join(self.plain).strip("\n")))
+        self.html, self.plain, self.size = [], [], 0
+        if self.code_tag:
+            self.html.append(self.code_tag)
+            self.size = len(self.code_tag)
+
+
+def _split_long(line: str, limit: int) -> list[str]:
+    """超长单行按转义后的长度切开（不会切断 HTML 实体）"""
+    pieces, current, size = [], [], 0
+    for ch in line:
+        n = len(html.escape(ch, quote=False))
+        if size + n > limit and current:
+            pieces.append("".join(current))
+            current, size = [], 0
+        current.append(ch)
+        size += n
+    if current:
+        pieces.append("".join(current))
+    return pieces
+
+
+def _render(text: str, max_len: int) -> list[RenderedChunk]:
+    builder = _ChunkBuilder(max_len)
+    # 单行上限：给代码块标签和换行留余量
+    line_limit = max(max_len - 80, 20)
+    fence = ""
+    for line in text.split("\n"):
+        m = _FENCE_RE.match(line)
+        if fence:
+            if m and m.group(1) == fence and not m.group(2):
+                builder.close_code(line)
+                fence = ""
+                continue
+            for piece in _split_long(line, line_limit) or [""]:
+                builder.add_code(piece)
+            continue
+        if m:
+            fence = m.group(1)
+            builder.open_code(m.group(2), line)
+            continue
+        rendered = render_inline(line)
+        if len(rendered) <= line_limit:
+            builder.add(rendered, line)
+        else:
+            # 超长行放弃行内格式，按纯文本切分
+            for piece in _split_long(line, line_limit):
+                builder.add(html.escape(piece, quote=False), piece)
+    builder.close_code()  # 未闭合的代码块（被截断的输出）在末尾补上
+    builder.flush()
+    return builder.chunks
@@ -0,0 +1,97 @@
+"""git 只读查询基准 — 对比进程内 GitReader 与 git 子进程
+
+对每个仓库分别测：
+  - /log：git log -30 --oneline --graph --decorate
+  - /branch：git branch -a
+  - 当前分支：git branch --show-current
+子进程一侧与 GitOps._run_git 一样带 -c user.name / user.email 参数。
+读取器一侧分冷启动（新建 GitReader，首次加载 pack 索引）和热路径两种。
+同时校验两边输出是否一致。
+
+用法:
+  python bench_git.py [仓库路径 ...]
+  python bench_git.py --synthetic 50000    # 用 fast-import 生成 5 万个提交的仓库（gc 打包）再测
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from core.git_reader import GitReader, GitReadError
+
+ROUNDS = 20
+GIT = ["git", "-c", "user.name=bench", "-c", "user.email=bench@example.com"]
+
+QUERIES = [
+    ("log -30", ["log", "-30", "--oneline", "--graph", "--decorate"], lambda r: r.log_oneline(30)),
+    ("branch -a", ["branch", "-a"], lambda r: r.branch_list()),
+    ("当前分支", ["branch", "--show-current"], lambda r: r.current_branch() + "\n"),
+]
+
+
+def make_synthetic(commits: int) -> str:
+    """生成一个线性历史、每个提交改一个文件的仓库，并 gc 成单个 pack
+
+    fast-import 对同一分支的连续 commit 自动以上一个为父提交。
+    """
+    path = tempfile.mkdtemp(prefix="724code_bench_git_")
+    subprocess.run(["git", "init", "-q", "-b", "main", path], check=True)
+    lines = []
+    for i in range(commits):
+        content = f"line {i}\n".encode()
+        message = f"commit {i}: update file_{i % 500}".encode()
+        lines.append(b"commit refs/heads/main\n")
+        lines.append(f"committer bench <bench@example.com> {1700000000 + i} +0000\n".encode())
+        lines.append(f"data {len(message)}\n".encode() + message + b"\n")
+        lines.append(f"M 644 inline src/file_{i % 500}.txt\ndata {len(content)}\n".encode() + content + b"\n")
+    subprocess.run(GIT + ["fast-import", "--quiet"], input=b"".join(lines), cwd=path, check=True)
+    for name in ("dev", "release"):
+        subprocess.run(["git", "branch", name, f"main~{min(commits - 1, 10)}"], cwd=path, check=True)
+    subprocess.run(["git", "tag", "v1", "main~3"], cwd=path, check=True)
+    subprocess.run(["git", "gc", "-q"], cwd=path, check=True)
+    subprocess.run(["git", "checkout", "-q", "main"], cwd=path, check=True)
+    return path
+
+
+def timed(fn, rounds: int = ROUNDS) -> tuple[float, object]:
+    result = None
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = fn()
+    return (time.perf_counter() - start) * 1000 / rounds, result
+
+
+def run(path: str):
+    git_dir = os.path.join(path, ".git")
+    count = subprocess.run(["git", "rev-list", "--count", "HEAD"], cwd=path,
+                           capture_output=True, text=True).stdout.strip()
+    print(f"仓库: {path}（{count} 个提交）")
+    for label, args, query in QUERIES:
+        git_ms, expected = timed(lambda: subprocess.run(GIT + args, cwd=path, capture_output=True).stdout.decode())
+        try:
+            cold_ms, _ = timed(lambda: query(GitReader(git_dir)), rounds=5)
+            reader = GitReader(git_dir)
+            warm_ms, produced = timed(lambda: query(reader))
+            reader.close()
+        except GitReadError as e:
+            print(f"  {label:10s} git {git_ms:7.2f}ms | 读取器不支持，回退 git: {e}")
+            continue
+        same = "一致" if produced == expected else "不一致"
+        print(f"  {label:10s} git {git_ms:7.2f}ms | 读取器 冷 {cold_ms:6.2f}ms 热 {warm_ms:6.2f}ms"
+              f" | {git_ms / max(warm_ms, 1e-6):5.0f}x | 输出{same}")
+    print()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    paths = []
+    if args[:1] == ["--synthetic"]:
+        n = int(args[1]) if len(args) > 1 else 50000
+        print(f"生成 {n} 个提交的合成仓库...")
+        paths.append(make_synthetic(n))
+        args = args[2:]
+    paths.extend(args or ["."])
+    for p in paths:
+        run(p)
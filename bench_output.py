@@ -0,0 +1,131 @@
+"""输出压缩基准 — 对比结构化压缩与旧的「60% 头 + 30% 尾」截断
+
+语料：
+  - 指定的记忆库（.724code/memories.db）中归档的真实完整输出（blobs 表）
+  - 内置的几类典型长输出（代码块、diff、错误堆栈、文件列表混排）
+
+指标：
+  - 速度：每条输出的平均 / 最大压缩耗时
+  - 信息保留：关键行（错误信息、提到的文件名、最后一段结论）保留比例，
+    以及代码围栏是否成对（半截代码块在 Telegram 里会整段错乱）
+
+用法: python bench_output.py [项目路径或 memories.db ...]
+"""
+
+import os
+import re
+import sqlite3
+import sys
+import time
+import zlib
+
+from core.output_processor import compress_output, strip_ansi
+
+MAX_LENGTH = 3500
+
+_ERROR_RE = re.compile(r"^\s*\w*(Error|Exception)\b.*:|^(error|FAILED|panic)\b", re.I)
+_FILE_RE = re.compile(r"[\w./-]+\.(py|js|ts|go|rs|java|md|json|yaml|yml|toml|sh|sql|html|css)\b")
+
+
+def legacy_compress(text: str, max_length: int = MAX_LENGTH) -> str:
+    """旧算法：按字符数保留 60% 开头 + 30% 结尾（仅用于对比）"""
+    budget = max_length - 60
+    if len(text) <= budget:
+        return text
+    head = text[:int(budget * 0.6)]
+    tail = text[-int(budget * 0.3):]
+    cut = head.rfind("\n")
+    if cut > len(head) * 0.5:
+        head = head[:cut]
+    return f"{head}\n... 省略 ...\n{tail}"
+
+
+def load_corpus(paths: list[str]) -> list[str]:
+    corpus = []
+    for path in paths:
+        if os.path.isdir(path):
+            path = os.path.join(path, ".724code", "memories.db")
+        if not os.path.exists(path):
+            print(f"跳过（不存在）: {path}")
+            continue
+        conn = sqlite3.connect(path)
+        try:
+            rows = conn.execute("SELECT codec, data FROM blobs").fetchall()
+        except sqlite3.OperationalError:
+            rows = []
+        conn.close()
+        for codec, data in rows:
+            raw = zlib.decompress(data) if codec == "zlib" else bytes(data)
+            corpus.append(raw.decode("utf-8", errors="replace"))
+    return corpus + builtin_samples()
+
+
+def builtin_samples() -> list[str]:
+    prose = "已完成登录模块的重构，主要调整了 token 校验逻辑与会话过期处理。\n" * 6
+    code = "```python\n" + "\n".join(f"def handler_{i}(request):\n    return validate(request, level={i})" for i in range(80)) + "\n```\n"
+    diff = "diff --git a/auth/views.py b/auth/views.py\n--- a/auth/views.py\n+++ b/auth/views.py\n" + "".join(
+        f"@@ -{i * 10},6 +{i * 10},7 @@ def view_{i}():\n     ctx = load()\n-    old_call({i})\n+    new_call({i})\n+    audit({i})\n     return ctx\n"
+        for i in range(40)
+    )
+    trace = "Traceback (most recent call last):\n" + "".join(
+        f'  File "/srv/app/module_{i}.py", line {i * 3}, in func_{i}\n    call_{i}()\n' for i in range(30)
+    ) + "KeyError: 'session_token'\n"
+    files = "修改的文件：\n" + "".join(f"- `src/components/widget_{i}.tsx` — 调整 props 类型\n" for i in range(25))
+    noisy = "\x1b[32mPASS\x1b[0m tests/test_ok.py\n" * 120 + "\x1b[31mFAILED\x1b[0m tests/test_auth.py::test_expiry\n"
+    conclusion = "\n总结：全部测试通过，下一步建议补充 auth/views.py 的集成测试。\n"
+    return [
+        prose + code + files + conclusion,
+        prose + diff + conclusion,
+        prose + code + trace + conclusion,
+        noisy + trace + files + conclusion,
+        prose + code + diff + trace + files + code + conclusion,
+    ]
+
+
+def key_lines(text: str) -> set[str]:
+    """关键信息：错误行、文件名、最后一个非空段落"""
+    text = strip_ansi(text)
+    keys = {f"file:{m.group(0)}" for m in _FILE_RE.finditer(text)}
+    keys.update(f"err:{line.strip()}" for line in text.splitlines() if _ERROR_RE.search(line))
+    paragraphs = [p.strip() for p in text.strip().split("\n\n") if p.strip()]
+    if paragraphs:
+        keys.add(f"end:{paragraphs[-1].splitlines()[-1]}")
+    return keys
+
+
+def retained(keys: set[str], output: str) -> float:
+    if not keys:
+        return 1.0
+    hit = sum(1 for k in keys if k.split(":", 1)[1] in output)
+    return hit / len(keys)
+
+
+def fences_balanced(output: str) -> bool:
+    return sum(1 for line in output.splitlines() if line.lstrip().startswith("```")) % 2 == 0
+
+
+def run(corpus: list[str]):
+    long_outputs = [t for t in corpus if len(t) > MAX_LENGTH]
+    print(f"语料 {len(corpus)} 条，其中需要压缩的长输出 {len(long_outputs)} 条\n")
+    if not long_outputs:
+        return
+
+    for name, fn in (("结构化", lambda t: compress_output(t, max_length=MAX_LENGTH)),
+                     ("旧算法", legacy_compress)):
+        times, scores, balanced, sizes = [], [], 0, []
+        for text in long_outputs:
+            start = time.perf_counter()
+            out = fn(text)
+            times.append((time.perf_counter() - start) * 1000)
+            scores.append(retained(key_lines(text), out))
+            balanced += fences_balanced(out)
+            sizes.append(len(out))
+        print(f"[{name}]")
+        print(f"  耗时: 平均 {sum(times) / len(times):.2f}ms, 最大 {max(times):.2f}ms")
+        print(f"  关键信息保留: 平均 {sum(scores) / len(scores):.0%}, 最低 {min(scores):.0%}")
+        print(f"  代码围栏成对: {balanced}/{len(long_outputs)}")
+        print(f"  输出长度: 最大 {max(sizes)} 字符（上限 {MAX_LENGTH}）\n")
+
+
+if __name__ == "__main__":
+    run(load_corpus(sys.argv[1:]))
@@ -26,6 +26,7 @@ class ExecutionResult:
     files_changed: list[str] = field(default_factory=list)
     cost_usd: float = 0.0
     duration_ms: int = 0
+    input_tokens: int = 0     # 本次输入 token 总数（含缓存读写，来自 CLI usage）
     error: str = ""
 
 
@@ -163,6 +164,11 @@ class ClaudeExecutor:
             cost = data.get("cost_usd", 0) or data.get("total_cost_usd", 0)
             duration = data.get("duration_ms", 0)
             is_error = data.get("is_error", False)
+            usage = data.get("usage") or {}
+            input_tokens = sum(
+                usage.get(k, 0) or 0
+                for k in ("input_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")
+            )
 
             formatted = compress_output(
                 result_text, cost=cost, duration_ms=duration, is_error=is_error
@@ -176,6 +182,7 @@ class ClaudeExecutor:
                 formatted_output=formatted,
                 cost_usd=cost,
                 duration_ms=duration,
+                input_tokens=input_tokens,
                 error="" if not is_error else result_text[:200],
             )
         except json.JSONDecodeError:
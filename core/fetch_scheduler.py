@@ -0,0 +1,84 @@
+"""后台 fetch 调度 — 定期为所有已注册项目执行 git fetch
+
+/pull 时远端对象多半已在本地，只剩快进合并；/status、/gs all 的领先 / 落后数也保持新鲜。
+  - 每轮间隔 fetch_interval_minutes，加 ±fetch_jitter 的随机抖动，避免与其他定时任务撞车
+  - 并发数受 fetch_concurrency 限制（NAS 带宽 / 代理连接数有限）
+  - 失败的项目指数退避：间隔按 2^失败次数 放大，上限 fetch_max_backoff_hours
+只处理配置了 remote 的仓库；/clone 时用了浅克隆的项目沿用注册表里记录的 depth（部分克隆的 filter 由 git 自己记录）。
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+
+from core.git_ops import GitOps
+from core.project_manager import CloneOptions
+
+logger = logging.getLogger(__name__)
+
+
+class FetchScheduler:
+    def __init__(self, git_ops: GitOps, project_mgr, config: dict):
+        self.git = git_ops
+        self.project_mgr = project_mgr
+        self.interval = config.get("fetch_interval_minutes", 15) * 60
+        self.jitter = config.get("fetch_jitter", 0.2)
+        self.concurrency = config.get("fetch_concurrency", 4)
+        self.max_backoff = config.get("fetch_max_backoff_hours", 6) * 3600
+        # 项目路径 -> (连续失败次数, 下次可 fetch 的时间)
+        self._failures: dict[str, tuple[int, float]] = {}
+
+    async def run_forever(self):
+        """后台循环：每轮随机抖动后 fetch 到期的项目"""
+        while True:
+            await asyncio.sleep(self.interval * random.uniform(1 - self.jitter, 1 + self.jitter))
+            try:
+                await self.fetch_due()
+            except Exception as e:
+                logger.error(f"后台 fetch 任务异常: {e}", exc_info=True)
+
+    async def fetch_due(self) -> dict[str, str]:
+        """fetch 所有到期且有 remote 的项目，返回 {项目名: 错误信息（成功为空）}"""
+        now = time.monotonic()
+        due = {
+            name: info for name, info in self.project_mgr.list_projects().items()
+            if info.get("path") and _has_remote(info["path"])
+            and self._failures.get(info["path"], (0, 0))[1] <= now
+        }
+        if not due:
+            return {}
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def one(name: str, info: dict):
+            extra = CloneOptions.from_dict(info.get("clone")).fetch_args()
+            async with semaphore:
+                return name, await self.git.fetch(info["path"], extra)
+
+        start = time.monotonic()
+        results = dict(await asyncio.gather(*(one(name, info) for name, info in due.items())))
+        for name, error in results.items():
+            self._record(due[name]["path"], name, error)
+        failed = sum(1 for e in results.values() if e)
+        logger.info(f"后台 fetch 完成: {len(results)} 个项目，失败 {failed}，耗时 {time.monotonic() - start:.1f}s")
+        return results
+
+    def _record(self, path: str, name: str, error: str):
+        if not error:
+            self._failures.pop(path, None)
+            return
+        count = self._failures.get(path, (0, 0))[0] + 1
+        delay = min(self.interval * 2 ** count, self.max_backoff)
+        self._failures[path] = (count, time.monotonic() + delay)
+        logger.warning(f"fetch 失败 [{name}]（连续 {count} 次），{delay / 60:.0f} 分钟后重试: {error}")
+
+
+def _has_remote(path: str) -> bool:
+    """仓库配置里有 [remote "..."] 段（不启动 git）"""
+    config = os.path.join(GitOps._git_dir(path), "config")
+    try:
+        with open(config, encoding="utf-8", errors="replace") as f:
+            return any(line.lstrip().startswith("[remote ") for line in f)
+    except OSError:
+        return False
@@ -1,18 +1,68 @@
-"""文件管理器 — /cat 查看文件, /tree 查看目录结构"""
+"""文件管理器 — /cat 查看文件, /tree 查看目录结构, /grep 搜索代码
 
+/cat 不整文件读入：每个文件建一次行偏移索引（mmap 扫描换行符，按 mtime + size 缓存），
+之后按请求的行范围直接 seek 读取，/cat 文件 -200 从末尾读。
+
+/tree 在线程中用 os.scandir 遍历（复用 DirEntry 的类型信息），跳过 IGNORE_DIRS 和
+.gitignore 忽略的路径，可选统计各目录文件数与大小；结果按项目缓存，遍历过的目录
+（及 .gitignore）mtime 都不变时直接复用。
+
+/grep 边遍历（同样跳过忽略路径）边把文件交给线程池，整文件一次正则预检，
+命中才按行定位并带上下文；达到结果上限即停止。
+"""
+
+import asyncio
 import logging
+import mmap
 import os
+import re
+import shlex
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from itertools import accumulate
+
+from core.gitignore import IgnoreRules, ancestors
 
 logger = logging.getLogger(__name__)
 
 # tree 时忽略的目录
 IGNORE_DIRS = {".git", "node_modules", "__pycache__", ".next", "venv", ".venv", "dist", ".mypy_cache", ".pytest_cache"}
 
+# 缓存行偏移索引的文件数
+LINE_INDEX_CACHE_SIZE = 64
+
+# /grep：判断二进制文件时检查的字节数、单行最多显示的字符数
+BINARY_SNIFF_BYTES = 8192
+GREP_LINE_CHARS = 200
+# /grep 每个线程任务处理的文件数
+GREP_BATCH_FILES = 64
+# 含这些字符的模式按正则处理，否则视为纯字面量
+_REGEX_META = re.compile(r"[.^$*+?{}\[\]\\|()]")
+
+# /tree 最多输出的行数、缓存的快照数
+TREE_MAX_LINES = 80
+TREE_CACHE_SIZE = 32
+
 
 class FileManager:
     def __init__(self, config: dict):
         self.max_cat_lines = config.get("max_cat_lines", 200)
         self.max_file_size = config.get("max_file_size_mb", 10) * 1024 * 1024
+        # 行偏移索引：文件真实路径 -> ((mtime_ns, size), offsets)，LRU
+        self._line_index: OrderedDict[str, tuple[tuple[int, int], array]] = OrderedDict()
+        self._index_lock = threading.Lock()  # 索引在线程池中构建
+        # /tree 快照：(项目, 子目录, 深度) -> _TreeSnapshot，LRU（统计模式不缓存）
+        self._tree_cache: OrderedDict[tuple, _TreeSnapshot] = OrderedDict()
+        self.tree_cache_hits = 0
+        # /grep
+        self.grep_max_results = config.get("grep_max_results", 50)
+        self.grep_context = config.get("grep_context", 1)
+        self.grep_workers = config.get("grep_workers", 8)
+        self.grep_max_file_size = config.get("grep_max_file_kb", 1024) * 1024
 
     async def cat_file(self, project_path: str, file_arg: str) -> str:
         """
@@ -22,9 +72,10 @@ class FileManager:
           /cat src/main.py          → 完整文件（限制行数）
           /cat src/main.py 20-50    → 第 20-50 行
           /cat src/main.py 100      → 从第 100 行开始
+          /cat src/main.py -200     → 最后 200 行
         """
         if not file_arg.strip():
-            return "用法: /cat <文件路径> [行范围]\n示例: /cat main.py 10-30"
+            return "用法: /cat <文件路径> [行范围]\n示例: /cat main.py 10-30 或 /cat main.py -50（末尾 50 行）"
 
         parts = file_arg.strip().split()
         filepath = parts[0]
@@ -43,40 +94,69 @@ class FileManager:
             return f"文件过大: {size_mb:.1f}MB (上限 {self.max_file_size // 1024 // 1024}MB)"
 
         try:
-            with open(full_path, "r", encoding="utf-8", errors="replace") as f:
-                lines = f.readlines()
+            offsets = await asyncio.to_thread(self._line_offsets, full_path)
         except Exception as e:
             return f"读取失败: {e}"
 
-        total_lines = len(lines)
+        total_lines = len(offsets) - 1
 
-        # 解析行范围
+        # 解析行范围（显式范围也最多显示 max_cat_lines 行）
         start, end = 1, min(total_lines, self.max_cat_lines)
         if line_range:
             try:
-                if "-" in line_range:
+                if line_range.startswith("-"):
+                    start = max(1, total_lines - int(line_range[1:]) + 1)
+                    end = total_lines
+                elif "-" in line_range:
                     s, e = line_range.split("-", 1)
                     start = max(1, int(s))
                     end = min(total_lines, int(e))
                 else:
                     start = max(1, int(line_range))
-                    end = min(total_lines, start + self.max_cat_lines - 1)
+                    end = total_lines
             except ValueError:
-                return f"行范围格式错误: {line_range}\n示例: 10-30 或 50"
+                return f"行范围格式错误: {line_range}\n示例: 10-30、50 或 -100"
+            end = min(end, start + self.max_cat_lines - 1)
 
-        selected = lines[start - 1:end]
+        try:
+            selected = await asyncio.to_thread(_read_lines, full_path, offsets, start, end)
+        except Exception as e:
+            return f"读取失败: {e}"
 
         # 带行号输出
         header = f"{filepath} ({total_lines} 行, 显示 {start}-{end})\n"
-        content = ""
-        for i, line in enumerate(selected, start=start):
-            content += f"{i:4d} | {line}"
+        content = "\n".join(f"{i:4d} | {line}" for i, line in enumerate(selected, start=start))
 
         if end < total_lines:
-            content += f"\n... 还有 {total_lines - end} 行 (/cat {filepath} {end + 1})"
+            content += f"\n\n... 还有 {total_lines - end} 行 (/cat {filepath} {end + 1})"
 
         return header + content
 
+    def _line_offsets(self, path: str) -> array:
+        """文件的行偏移索引（第 i 行从 offsets[i-1] 开始，末尾为文件大小），按 (mtime, size) 缓存
+
+        mmap 后逐行取长度，不把整个文件读进内存；文件未变时直接复用。
+        """
+        st = os.stat(path)
+        key = os.path.realpath(path)
+        with self._index_lock:
+            cached = self._line_index.get(key)
+            if cached and cached[0] == (st.st_mtime_ns, st.st_size):
+                self._line_index.move_to_end(key)
+                return cached[1]
+
+        # 各行结束位置的累加和即下一行起点；最后一项恰为文件大小（无论末尾有无换行符）
+        offsets = array("q", [0])
+        if st.st_size:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                offsets.extend(accumulate(map(len, iter(mm.readline, b""))))
+
+        with self._index_lock:
+            self._line_index[key] = ((st.st_mtime_ns, st.st_size), offsets)
+            while len(self._line_index) > LINE_INDEX_CACHE_SIZE:
+                self._line_index.popitem(last=False)
+        return offsets
+
     async def tree(self, project_path: str, arg: str) -> str:
         """
         查看目录结构（纯 Python 实现，跨平台）。
@@ -85,8 +165,11 @@ class FileManager:
           /tree              → 项目根目录，深度 2
           /tree src          → 指定子目录
           /tree src 4        → 指定深度
+          /tree src -s       → 附带每个目录的文件数和总大小
         """
         parts = arg.strip().split() if arg.strip() else []
+        stats = any(p in ("-s", "--stats") for p in parts)
+        parts = [p for p in parts if p not in ("-s", "--stats")]
         subpath = parts[0] if parts else "."
         try:
             depth = int(parts[1]) if len(parts) > 1 else 2
@@ -101,13 +184,144 @@ class FileManager:
         if not os.path.isdir(target):
             return f"目录不存在: {subpath}"
 
-        lines = [f"{subpath}/"]
-        _build_tree(target, lines, prefix="", depth=depth, max_lines=80)
+        root = os.path.realpath(project_path)
+        rel = os.path.relpath(os.path.realpath(target), root).replace(os.sep, "/")
+        rel = "" if rel == "." else rel
+        if stats:
+            # 文件大小变化不改目录 mtime，快照无法判断新旧；统计本就要 stat 每个文件，直接重新遍历
+            snapshot = await asyncio.to_thread(_walk_tree, root, rel, subpath, depth, stats)
+            return snapshot.text
+        key = (root, rel, depth)
+        snapshot = self._tree_cache.get(key)
+        if snapshot is not None and await asyncio.to_thread(snapshot.fresh):
+            self._tree_cache.move_to_end(key)
+            self.tree_cache_hits += 1
+        else:
+            snapshot = await asyncio.to_thread(_walk_tree, root, rel, subpath, depth, stats)
+            self._tree_cache[key] = snapshot
+            while len(self._tree_cache) > TREE_CACHE_SIZE:
+                self._tree_cache.popitem(last=False)
+        return snapshot.text
+
+    async def grep(self, project_path: str, arg: str) -> str:
+        """
+        在项目中搜索（正则，非法正则按字面量）。
+
+        用法:
+          /grep TODO              → 整个项目
+          /grep -i "def main" src → 忽略大小写，只搜 src
+        跳过 IGNORE_DIRS、.gitignore 忽略的路径、二进制文件和超过 grep_max_file_kb 的文件；
+        找到第 grep_max_results + 1 处后立即停止（恰好 grep_max_results 处时不提示截断）。
+        """
+        # 非 POSIX 模式保留正则里的反斜杠，引号自行去掉
+        try:
+            tokens = [_unquote(t) for t in shlex.split(arg, posix=False)]
+        except ValueError:
+            tokens = arg.split()
+        ignore_case = "-i" in tokens
+        tokens = [t for t in tokens if t != "-i"]
+        if not tokens:
+            return "用法: /grep [-i] <模式> [路径]\n示例: /grep TODO src 或 /grep -i \"def main\""
+
+        # 最后一个参数是项目内存在的路径时视为搜索范围，否则整串都是模式
+        subpath = "."
+        if len(tokens) > 1 and os.path.exists(os.path.join(project_path, tokens[-1])):
+            subpath = tokens.pop()
+        pattern = " ".join(tokens)
 
-        if len(lines) >= 80:
-            lines.append("... 目录过大，已截断")
+        target = os.path.join(project_path, subpath)
+        if not _is_within_project(project_path, target):
+            return "禁止访问项目目录外的路径"
 
-        return "\n".join(lines)
+        flags = re.MULTILINE | (re.IGNORECASE if ignore_case else 0)
+        # bytes 正则的 IGNORECASE 只认 ASCII；-i 且模式含非 ASCII 字符时改用 str 正则，按 UTF-8 解码后搜索
+        source = pattern if ignore_case and not pattern.isascii() else pattern.encode()
+        try:
+            regex = re.compile(source, flags)
+            literal = not _REGEX_META.search(pattern)
+        except re.error:
+            regex = re.compile(re.escape(source), flags)
+            literal = True
+        # 忽略大小写的正则没有字面量快速路径，纯字面量模式先用 lower() + in 预筛
+        prefilter = None
+        if literal and ignore_case:
+            needle = source.lower()
+            prefilter = lambda data: needle in data.lower()  # noqa: E731
+
+        start = time.monotonic()
+        root = os.path.realpath(project_path)
+        rel = os.path.relpath(os.path.realpath(target), root).replace(os.sep, "/")
+        results, scanned, capped = await asyncio.to_thread(
+            self._grep_sync, root, "" if rel == "." else rel, regex, prefilter,
+        )
+        elapsed = time.monotonic() - start
+
+        matches = sum(len(hits) for _, hits, _ in results)
+        if not matches:
+            return f"未找到 '{pattern}'（扫描 {scanned} 个文件，{elapsed:.2f}s）"
+        header = f"搜索 '{pattern}': {matches} 处匹配，{len(results)} 个文件（扫描 {scanned} 个文件，{elapsed:.2f}s）"
+        if capped:
+            header += f"\n已达上限 {self.grep_max_results} 处，结果不完整，可缩小路径或换更具体的模式"
+        return header + "\n\n" + "\n\n".join(_format_hits(path, hits, lines) for path, hits, lines in results)
+
+    def _grep_sync(self, root: str, rel: str, regex: re.Pattern, prefilter=None) -> tuple[list, int, bool]:
+        """线程池并发搜索，边遍历边提交；命中数超过上限后停止遍历，未开始的任务直接返回
+
+        多找一处来确认确实有结果被丢弃：恰好 limit 处时会搜完全部文件，不算截断。
+        返回 ([(相对路径, 命中行号, {行号: 内容})]（按遍历顺序）, 扫描文件数, 是否截断)。
+        """
+        limit = self.grep_max_results
+        stop = threading.Event()
+        lock = threading.Lock()
+        found: list[tuple[int, str, list[int], dict[int, str]]] = []
+        count = 0
+        # 限制排队的批次数，遍历不会远远跑在搜索前面
+        slots = threading.BoundedSemaphore(self.grep_workers * 2)
+
+        def search(batch: list[tuple[int, str, str]]):
+            nonlocal count
+            try:
+                for order, abs_path, rel_path in batch:
+                    if stop.is_set():
+                        return
+                    hit = _search_file(abs_path, regex, self.grep_context, self.grep_max_file_size, limit + 1,
+                                       prefilter)
+                    if hit:
+                        with lock:
+                            found.append((order, rel_path, *hit))
+                            count += len(hit[0])
+                            if count > limit:
+                                stop.set()
+            finally:
+                slots.release()
+
+        # 小文件的读取 + 搜索只要几微秒，按批提交摊薄线程调度开销
+        scanned = 0
+        batch = []
+        with ThreadPoolExecutor(max_workers=self.grep_workers) as pool:
+            for abs_path, rel_path in _iter_files(root, rel):
+                batch.append((scanned, abs_path, rel_path))
+                scanned += 1
+                if len(batch) >= GREP_BATCH_FILES:
+                    if stop.is_set():
+                        break
+                    slots.acquire()
+                    pool.submit(search, batch)
+                    batch = []
+            else:
+                if batch:
+                    slots.acquire()
+                    pool.submit(search, batch)
+
+        found.sort()
+        results, remaining = [], limit
+        for _, rel_path, hits, lines in found:
+            if remaining <= 0:
+                break
+            hits = hits[:remaining]
+            remaining -= len(hits)
+            results.append((rel_path, hits, lines))
+        return results, scanned, count > limit
 
 
 def _is_within_project(project_path: str, target: str) -> bool:
@@ -117,34 +331,257 @@ def _is_within_project(project_path: str, target: str) -> bool:
     return real_target.startswith(real_project)
 
 
-def _build_tree(path: str, lines: list, prefix: str, depth: int, max_lines: int):
-    """递归构建目录树"""
-    if depth <= 0 or len(lines) >= max_lines:
-        return
+def _read_lines(path: str, offsets: array, start: int, end: int) -> list[str]:
+    """按行偏移直接 seek 读取第 start-end 行（1 起，含两端），去掉换行符"""
+    if end < start:
+        return []
+    with open(path, "rb") as f:
+        f.seek(offsets[start - 1])
+        data = f.read(offsets[end] - offsets[start - 1])
+    lines = data.split(b"\n")
+    if data.endswith(b"\n"):
+        lines.pop()
+    return [line.rstrip(b"\r").decode("utf-8", errors="replace") for line in lines]
+
+
+@dataclass(slots=True)
+class _TreeSnapshot:
+    """一次 /tree 的结果及其依赖的目录 / .gitignore 的 mtime"""
+    text: str
+    stamps: list[tuple[str, int]]
+
+    def fresh(self) -> bool:
+        """遍历过的目录都没有增删条目、相关 .gitignore 都未改动（文件内容改动不影响目录树）"""
+        return all(_mtime(path) == mtime for path, mtime in self.stamps)
 
-    try:
-        entries = sorted(os.listdir(path))
-    except PermissionError:
-        return
 
-    # 过滤忽略目录
-    entries = [e for e in entries if e not in IGNORE_DIRS]
+class _TreeWalk:
+    """遍历状态：输出行、mtime 记录"""
 
-    dirs = [e for e in entries if os.path.isdir(os.path.join(path, e))]
-    files = [e for e in entries if os.path.isfile(os.path.join(path, e))]
+    def __init__(self, stats: bool):
+        self.stats = stats
+        self.lines: list[str] = []
+        self.stamps: list[tuple[str, int]] = []
 
-    all_items = dirs + files
-    for i, name in enumerate(all_items):
-        if len(lines) >= max_lines:
-            return
+    def stamp(self, path: str):
+        self.stamps.append((path, _mtime(path)))
 
-        is_last = (i == len(all_items) - 1)
+    @property
+    def full(self) -> bool:
+        return len(self.lines) >= TREE_MAX_LINES
+
+
+def _mtime(path: str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def _human_size(n: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+
+
+def _walk_tree(root: str, rel: str, label: str, depth: int, stats: bool) -> _TreeSnapshot:
+    """遍历 root/rel 生成目录树（在线程中执行）"""
+    walk = _TreeWalk(stats)
+    walk.stamp(os.path.join(root, ".git", "info", "exclude"))
+    # 目标目录之上各级的 .gitignore 也生效（目标自身的由 _scan_dir 叠加）
+    parents = ancestors(rel)[:-1]
+    if rel:
+        for d in ["", *parents]:
+            walk.stamp(os.path.join(root, d, ".gitignore"))
+        rules = IgnoreRules.for_path(root, parents[-1] if parents else "")
+    else:
+        rules = IgnoreRules.for_repo(root)
+    walk.lines.append(f"{label}/")
+    files, size = _scan_dir(os.path.join(root, rel), rel, rules, depth, "", walk)
+    if stats:
+        walk.lines[0] += f"  ({files} 个文件, {_human_size(size)})"
+    if walk.full:
+        del walk.lines[TREE_MAX_LINES:]
+        walk.lines.append("... 目录过大，已截断")
+    return _TreeSnapshot("\n".join(walk.lines), walk.stamps)
+
+
+def _scan_dir(path: str, rel: str, rules: IgnoreRules, depth: int, prefix: str, walk: _TreeWalk) -> tuple[int, int]:
+    """输出 path 下 depth 层的条目，返回整个子树（未忽略部分）的 (文件数, 字节数)
+
+    用 scandir 的 DirEntry 判断类型，不再逐个 stat；只有统计模式才取文件大小，
+    并且会遍历到显示深度以下以汇总。非统计模式输出满 TREE_MAX_LINES 行即停止。
+    """
+    walk.stamp(path)
+    walk.stamp(os.path.join(path, ".gitignore"))
+    rules = rules.child(path, rel)
+    try:
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except OSError:
+        return 0, 0
+
+    dirs, files = [], []
+    for entry in entries:
+        if entry.name in IGNORE_DIRS:
+            continue
+        child_rel = f"{rel}/{entry.name}" if rel else entry.name
+        try:
+            is_dir = entry.is_dir()
+            if not is_dir and not entry.is_file():
+                continue
+        except OSError:
+            continue
+        if rules.ignored(child_rel, is_dir):
+            continue
+        (dirs if is_dir else files).append((entry, child_rel, is_dir))
+
+    total_files = total_bytes = 0
+    items = dirs + files
+    for i, (entry, child_rel, is_dir) in enumerate(items):
+        if walk.full and not walk.stats:
+            break
+        visible = depth > 0 and not walk.full
+        is_last = (i == len(items) - 1)
         connector = "└── " if is_last else "├── "
         child_prefix = "    " if is_last else "│   "
 
-        full = os.path.join(path, name)
-        if os.path.isdir(full):
-            lines.append(f"{prefix}{connector}{name}/")
-            _build_tree(full, lines, prefix + child_prefix, depth - 1, max_lines)
+        if is_dir:
+            index = len(walk.lines)
+            if visible:
+                walk.lines.append(f"{prefix}{connector}{entry.name}/")
+            files_, bytes_ = 0, 0
+            # 统计模式继续向下汇总，但不进入符号链接目录（防止循环）
+            if depth > 1 or (walk.stats and not entry.is_symlink()):
+                files_, bytes_ = _scan_dir(entry.path, child_rel, rules, depth - 1, prefix + child_prefix, walk)
+            if visible and walk.stats:
+                walk.lines[index] += f"  ({files_} 个文件, {_human_size(bytes_)})"
+            total_files += files_
+            total_bytes += bytes_
         else:
-            lines.append(f"{prefix}{connector}{name}")
+            size = 0
+            if walk.stats:
+                try:
+                    size = entry.stat().st_size
+                except OSError:
+                    pass
+            if visible:
+                walk.lines.append(f"{prefix}{connector}{entry.name}"
+                                  + (f"  ({_human_size(size)})" if walk.stats else ""))
+            total_files += 1
+            total_bytes += size
+    return total_files, total_bytes
+
+
+def _iter_files(root: str, rel: str):
+    """按目录顺序遍历 root/rel 下未被忽略的普通文件，产出 (绝对路径, 相对根的路径)
+
+    跳过 IGNORE_DIRS、.gitignore 忽略的路径，不进入符号链接目录。rel 为文件时只产出它本身。
+    """
+    start = os.path.join(root, rel)
+    if os.path.isfile(start):
+        yield start, rel
+        return
+    parents = ancestors(rel)[:-1]
+    rules = IgnoreRules.for_path(root, parents[-1] if parents else "") if rel else IgnoreRules.for_repo(root)
+    stack = [(start, rel, rules)]
+    while stack:
+        path, rel_dir, rules = stack.pop()
+        rules = rules.child(path, rel_dir)
+        try:
+            with os.scandir(path) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            if entry.name in IGNORE_DIRS:
+                continue
+            child_rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if not rules.ignored(child_rel, True):
+                        subdirs.append((entry.path, child_rel, rules))
+                elif entry.is_file() and not rules.ignored(child_rel, False):
+                    yield entry.path, child_rel
+            except OSError:
+                continue
+        stack.extend(reversed(subdirs))
+
+
+def _unquote(token: str) -> str:
+    if len(token) >= 2 and token[0] == token[-1] and token[0] in "'\"":
+        return token[1:-1]
+    return token
+
+
+def _search_file(path: str, regex: re.Pattern, context: int, max_size: int, limit: int, prefilter=None):
+    """搜索单个文件，无命中 / 二进制 / 过大时返回 None
+
+    先对整个文件内容做一次预检（prefilter 或 regex.search），命中后才按行定位；每行只计一次。
+    regex 为 str 正则时先按 UTF-8 解码再搜索（非 ASCII 的忽略大小写匹配）。
+    返回 (命中行号列表, {行号: 内容}（含上下文行）)。
+    """
+    # 直接用 os.open / os.read：小文件上比 open() 的缓冲文件对象快一倍
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        size = os.fstat(fd).st_size
+        if size > max_size:
+            return None
+        data = os.read(fd, size + 1)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+    if b"\0" in data[:BINARY_SNIFF_BYTES]:
+        return None
+    text = isinstance(regex.pattern, str)
+    if text:
+        data = data.decode("utf-8", errors="replace")
+    if not (prefilter or regex.search)(data):
+        return None
+
+    nl = "\n" if text else b"\n"
+    hits = []
+    line_no, pos, search_from = 1, 0, 0
+    while len(hits) < limit:
+        m = regex.search(data, search_from)
+        if not m:
+            break
+        line_no += data.count(nl, pos, m.start())
+        line_start = data.rfind(nl, 0, m.start()) + 1
+        line_end = data.find(nl, m.start())
+        line_end = len(data) if line_end == -1 else line_end
+        hits.append(line_no)
+        pos = line_start
+        search_from = line_end + 1  # 同一行只记一次
+        if search_from > len(data):
+            break
+
+    all_lines = data.split(nl)
+    if data.endswith(nl):
+        all_lines.pop()
+    wanted = {n for hit in hits for n in range(max(1, hit - context), min(len(all_lines), hit + context) + 1)}
+    lines = {}
+    for n in sorted(wanted):
+        line = all_lines[n - 1]
+        line = line.rstrip("\r") if text else line.rstrip(b"\r").decode("utf-8", errors="replace")
+        lines[n] = line[:GREP_LINE_CHARS]
+    return hits, lines
+
+
+def _format_hits(path: str, hits: list[int], lines: dict[int, str]) -> str:
+    """grep 风格：命中行「行号:」，上下文行「行号-」，不相邻的片段之间用 ... 隔开"""
+    hit_set = set(hits)
+    out = [path]
+    previous = None
+    for n, text in lines.items():
+        if previous is not None and n > previous + 1:
+            out.append("   ...")
+        out.append(f"{n:4d}{':' if n in hit_set else '-'} {text}")
+        previous = n
+    return "\n".join(out)
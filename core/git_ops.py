@@ -1,7 +1,44 @@
-"""Git 操作封装 — /diff, /commit, /push, /pull, /branch, /log"""
+"""Git 操作封装 — /diff, /commit, /push, /pull, /branch, /log, /undo
+
+只读查询（status、branch 列表、log、分支概要）按仓库缓存结果，缓存以
+.git/HEAD、.git/index、packed-refs 和 refs/ 下各文件的 (mtime, size) 为指纹：
+指纹不变就直接返回缓存，不启动 git 进程。工作区文件的改动不会反映到这些文件上，
+所以 status 的指纹额外包含工作区根目录的 mtime（新增 / 删除文件），另有 status_ttl 秒的
+有效期，且 bot 自己执行过可能改动工作区的操作（Claude 任务、commit、pull、切分支）后主动 invalidate。
+
+缓存未命中时，log / 分支列表 / 当前分支优先用进程内的 GitReader 直接读 .git，
+不支持的情况（见 core/git_reader.py）再回退到 git 命令行。
+
+/diff 只启动一次 git diff --patch-with-stat，边读边写入临时文件（超过 diff_max_bytes
+即终止子进程），同时记录每个文件在其中的偏移；/diff <文件>、/diff next 直接在
+这份快照里分页，不再重新运行 git。
+
+每个仓库一把读写锁（core/repo_lock.py）：改 index / 引用的操作独占，只读查询共享。
+git 子进程在独立进程组中运行，超过按子命令配置的超时后整组 SIGKILL（连同卡在
+凭据输入上的 ssh / credential helper）；遇到残留的 index.lock 时等待重试。
+锁文件超过 stale_lock_seconds 仍未释放、本服务没有该仓库的 git 子进程在运行、
+/proc 中也没有其他 git 进程在使用该仓库时，才视为上次崩溃遗留并删除；
+否则不动它，把锁的位置和原因返回给用户。
+
+每次 Claude 任务前把工作区快照到 refs/724code/checkpoints/<run>（临时 index 上
+add -A + write-tree + commit-tree，不碰真正的 index 和 HEAD），/undo 一步恢复；
+旧检查点按数量和天数清理。
+"""
 
 import asyncio
+import codecs
 import logging
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import zlib
+from dataclasses import dataclass, field
+
+from core.git_reader import GitReader, GitReadError
+from core.repo_lock import RepoLock
 
 logger = logging.getLogger(__name__)
 
@@ -9,12 +46,314 @@ logger = logging.getLogger(__name__)
 IGNORE_DIRS = {".git", "node_modules", "__pycache__", ".next", "venv", ".venv", "dist", ".mypy_cache"}
 
 
+# 统计区最多显示的文件行数
+DIFF_STAT_LINES = 30
+
+# 各子命令默认超时（秒），可被 config 中的 timeouts 覆盖
+DEFAULT_TIMEOUTS = {"default": 60, "push": 180, "pull": 180, "fetch": 180, "clone": 900, "gc": 300}
+
+# index.lock 冲突时的重试次数与间隔（秒，逐次翻倍）
+INDEX_LOCK_RETRIES = 3
+INDEX_LOCK_BACKOFF = 0.5
+
+# 超时返回码（同 timeout(1)）
+TIMEOUT_RETURNCODE = 124
+
+# diff 头部里带路径的行：(前缀, 路径前要去掉的 a/ 或 b/)；后出现的覆盖先出现的
+DIFF_PATH_HEADERS = ((b"rename to ", ""), (b"--- ", "a/"), (b"+++ ", "b/"))
+
+# 检查点引用前缀：refs/724code/checkpoints/<run>
+CHECKPOINT_REFS = "refs/724code/checkpoints/"
+
+# 本服务在项目里的数据目录（记忆库、向量索引）：检查点不快照、/undo 不还原
+BOT_DATA_DIR = ".724code"
+
+# 同一秒内创建检查点时最多尝试的后缀数
+CHECKPOINT_ID_ATTEMPTS = 100
+
+
+def _unquote_path(raw: bytes) -> str:
+    """git 输出中的路径：带双引号的按 C 转义还原（\\t、\\"、\\ooo 等）
+
+    含空格的路径在 ---/+++ 行末尾带一个制表符（兼容 GNU patch）；
+    真正含制表符的路径一定带引号，所以不带引号时可以放心去掉。
+    """
+    raw = raw.rstrip(b"\n")
+    if len(raw) >= 2 and raw.startswith(b'"') and raw.endswith(b'"'):
+        return codecs.escape_decode(raw[1:-1])[0].decode("utf-8", errors="replace")
+    return raw.rstrip(b"\t").decode("utf-8", errors="replace")
+
+
+def _diff_git_path(rest: bytes) -> str:
+    """diff --git 行 "a/<路径> b/<路径>" 中的路径；两侧不同（改名）时先取 b/ 之后，由头部行校正"""
+    rest = rest.rstrip(b"\n")
+    if rest.endswith(b'"'):
+        start = rest.rfind(b' "b/')
+        if start >= 0:
+            return _unquote_path(rest[start + 1:])[2:]
+    text = rest.decode("utf-8", errors="replace")
+    half = (len(text) - 5) // 2
+    if text.startswith("a/") and text[2:2 + half] == text[half + 5:] and text[half + 2:half + 5] == " b/":
+        return text[half + 5:]
+    return text.rsplit(" b/", 1)[-1]
+
+
+def _git_processes_in(roots: tuple[str, ...]) -> list[int] | None:
+    """/proc 中工作目录位于 roots 之内的 git 进程 pid；没有 /proc（非 Linux）时返回 None
+
+    无权查看工作目录的 git 进程保守地算作在使用。
+    """
+    if not os.path.isdir("/proc/self"):
+        return None
+    pids = []
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/comm", encoding="utf-8", errors="replace") as f:
+                if not f.read().startswith("git"):
+                    continue
+            proc_cwd = os.readlink(f"/proc/{name}/cwd")
+        except FileNotFoundError:
+            continue  # 进程已退出
+        except OSError:
+            pids.append(int(name))
+            continue
+        if any(proc_cwd == root or proc_cwd.startswith(root + os.sep) for root in roots):
+            pids.append(int(name))
+    return pids
+
+
+@dataclass(slots=True)
+class BranchState:
+    """git status --branch 的解析结果"""
+    branch: str
+    ahead: int = 0
+    behind: int = 0
+    staged: int = 0
+    modified: int = 0
+    untracked: int = 0
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self.staged or self.modified or self.untracked)
+
+
+@dataclass
+class DiffSpool:
+    """一次 git diff 的输出快照：统计区 + 写入临时文件的 patch，及各文件的字节偏移"""
+    ref: str
+    stat: list[str] = field(default_factory=list)
+    files: list[tuple[str, int]] = field(default_factory=list)   # (路径, patch 内起始偏移)
+    buffer: tempfile.SpooledTemporaryFile = None
+    size: int = 0
+    truncated: bool = False
+    cursor: int = 0
+
+    def close(self):
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
+
+    def file_index(self, offset: int) -> int:
+        """offset 所在文件的序号"""
+        index = 0
+        for i, (_, start) in enumerate(self.files):
+            if start <= offset:
+                index = i
+        return index
+
+    def find(self, name: str) -> int | None:
+        """按完整路径、后缀或子串查找文件序号"""
+        name = name.strip().lstrip("./")
+        for match in (lambda p: p == name, lambda p: p.endswith("/" + name), lambda p: name in p):
+            for i, (path, _) in enumerate(self.files):
+                if match(path):
+                    return i
+        return None
+
+    def read_page(self, start: int, page_bytes: int) -> tuple[str, int]:
+        """从 start 读一页（在换行处截断），返回 (文本, 下一页起点)"""
+        self.buffer.seek(start)
+        data = self.buffer.read(page_bytes)
+        if start + len(data) < self.size:
+            cut = data.rfind(b"\n")
+            if cut > 0:
+                data = data[:cut + 1]
+        return data.decode("utf-8", errors="replace"), start + len(data)
+
+
+@dataclass(slots=True)
+class Checkpoint:
+    """Claude 任务执行前的工作区快照"""
+    run: str            # 检查点 ID（引用名最后一段）
+    commit: str         # 快照 commit（tree = 当时的工作区，父提交 = 当时的 HEAD）
+    created: int        # 创建时间（unix 秒）
+    label: str = ""     # 触发本轮的用户消息（截断）
+
+
 class GitOps:
     def __init__(self, config: dict):
         self.commit_prefix = config.get("commit_prefix", "[bot]")
         self.protected_branches = config.get("protected_branches", ["main", "production"])
         self.user_name = config.get("user_name", "")
         self.user_email = config.get("user_email", "")
+        # 只读结果缓存：cwd -> {查询: (指纹, 时间, 结果)}
+        self.status_ttl = config.get("status_ttl", 10)
+        self._cache: dict[str, dict[str, tuple[tuple, float, str]]] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # 进程内读取器：git 目录 -> (GitReader, 锁)，不可用的仓库记为 None
+        self.use_reader = config.get("use_git_reader", True)
+        self._readers: dict[str, tuple[GitReader, threading.Lock] | None] = {}
+        self.reader_fallbacks = 0
+        # /diff 分页：cwd -> 最近一次 diff 快照
+        self.diff_page_chars = config.get("diff_page_chars", 3000)
+        self.diff_max_bytes = config.get("diff_max_bytes", 4 * 1024 * 1024)
+        self._diffs: dict[str, DiffSpool] = {}
+        # 仓库锁与超时
+        self.timeouts = {**DEFAULT_TIMEOUTS, **config.get("timeouts", {})}
+        self.stale_lock_seconds = config.get("stale_lock_seconds", 120)
+        self._locks: dict[str, RepoLock] = {}
+        self._children: dict[str, set] = {}  # git 目录 -> 本服务启动的 git 子进程
+        # /gs all：并发数与单个仓库超时
+        self.dashboard_concurrency = config.get("dashboard_concurrency", 8)
+        self.dashboard_timeout = config.get("dashboard_timeout", 5)
+        # 检查点：每次 Claude 任务前快照工作区，按数量和天数清理
+        self.checkpoint_enabled = config.get("checkpoints", True)
+        self.checkpoint_keep = config.get("checkpoint_keep", 20)
+        self.checkpoint_max_age = config.get("checkpoint_max_age_days", 7) * 86400
+
+    # ========== 只读结果缓存 ==========
+
+    @staticmethod
+    def _git_dir(cwd: str) -> str:
+        """定位 git 目录（兼容 worktree / submodule 的 .git 文件）"""
+        git_path = os.path.join(cwd, ".git")
+        if os.path.isfile(git_path):
+            try:
+                with open(git_path, encoding="utf-8") as f:
+                    line = f.readline().strip()
+            except OSError:
+                return git_path
+            if line.startswith("gitdir:"):
+                return os.path.normpath(os.path.join(cwd, line[len("gitdir:"):].strip()))
+        return git_path
+
+    @classmethod
+    def state_fingerprint(cls, cwd: str) -> tuple:
+        """仓库状态指纹：HEAD / index / packed-refs 及 refs/ 下所有引用文件的 (mtime_ns, size)"""
+        git_dir = cls._git_dir(cwd)
+        stamps = []
+        for name in ("HEAD", "index", "packed-refs"):
+            try:
+                st = os.stat(os.path.join(git_dir, name))
+                stamps.append((name, st.st_mtime_ns, st.st_size))
+            except OSError:
+                stamps.append((name, 0, -1))
+        stack = [os.path.join(git_dir, "refs")]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    stamps.append((entry.path, st.st_mtime_ns, st.st_size))
+        stamps.sort()
+        return tuple(stamps)
+
+    def _fingerprint(self, cwd: str, worktree: bool) -> tuple:
+        fingerprint = self.state_fingerprint(cwd)
+        if worktree:
+            try:
+                fingerprint += (os.stat(cwd).st_mtime_ns,)
+            except OSError:
+                pass
+        return fingerprint
+
+    async def _cached(self, cwd: str, key: str, producer, ttl: float = 0) -> str:
+        """指纹未变（且未超过 ttl）时返回缓存结果，否则调用 producer 重新生成
+
+        ttl 非 0 的查询（依赖工作区）指纹额外包含工作区根目录 mtime。
+        """
+        entry = self._cache.get(cwd, {}).get(key)
+        if entry and entry[0] == self._fingerprint(cwd, bool(ttl)) \
+                and (not ttl or time.monotonic() - entry[1] < ttl):
+            self.cache_hits += 1
+            return entry[2]
+        self.cache_misses += 1
+        value = await producer()
+        # 指纹在命令执行后再取：git status 会顺带刷新 index，先取的话下次必然不命中
+        self._cache.setdefault(cwd, {})[key] = (self._fingerprint(cwd, bool(ttl)), time.monotonic(), value)
+        return value
+
+    async def _read(self, cwd: str, method: str, *args):
+        """用进程内读取器执行只读查询（在线程中运行）；不支持时返回 None，由调用方回退到 git"""
+        if not self.use_reader:
+            return None
+        git_dir = self._git_dir(cwd)
+        if git_dir not in self._readers:
+            try:
+                self._readers[git_dir] = (GitReader(git_dir), threading.Lock())
+            except (GitReadError, OSError) as e:
+                logger.debug(f"git 读取器不可用 {git_dir}: {e}")
+                self._readers[git_dir] = None
+        entry = self._readers[git_dir]
+        if entry is None:
+            self.reader_fallbacks += 1
+            return None
+        reader, lock = entry
+
+        def call():
+            with lock:
+                return getattr(reader, method)(*args)
+
+        try:
+            return await asyncio.to_thread(call)
+        except (GitReadError, OSError, ValueError, IndexError, KeyError, zlib.error) as e:
+            logger.debug(f"git 读取器回退到命令行 ({method}): {e}")
+            self.reader_fallbacks += 1
+            return None
+
+    async def _log_output(self, cwd: str, n: int) -> str:
+        out = await self._read(cwd, "log_oneline", n)
+        if out is None:
+            out = await self._git_stdout(cwd, "log", f"-{n}", "--oneline", "--graph", "--decorate")
+        return out
+
+    async def _branch_output(self, cwd: str) -> str:
+        out = await self._read(cwd, "branch_list")
+        if out is None:
+            out = await self._git_stdout(cwd, "branch", "-a")
+        return out
+
+    async def current_branch(self, cwd: str) -> str:
+        """当前分支名（分离头指针时为空）"""
+        branch = await self._read(cwd, "current_branch")
+        if branch is None:
+            out, _, _ = await self._run_git(cwd, "branch", "--show-current")
+            branch = out.strip()
+        return branch
+
+    def invalidate(self, cwd: str):
+        """丢弃该仓库的缓存（工作区可能已被修改时调用）"""
+        self._cache.pop(cwd, None)
+
+    def cache_stats(self) -> dict:
+        """缓存命中统计 {"hits", "misses", "hit_rate"}"""
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "hit_rate": round(self.cache_hits / lookups, 3) if lookups else 0.0,
+        }
 
     def _git_cmd(self, *args) -> list[str]:
         """构建 git 命令，注入 user 配置"""
@@ -26,60 +365,248 @@ class GitOps:
         cmd.extend(args)
         return cmd
 
-    async def _run_git(self, cwd: str, *args) -> tuple[str, str, int]:
-        """执行 git 命令，返回 (stdout, stderr, returncode)"""
-        cmd = self._git_cmd(*args)
+    def repo_lock(self, cwd: str) -> RepoLock:
+        """该仓库的读写锁（按 git 目录区分）"""
+        key = os.path.realpath(self._git_dir(cwd))
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = RepoLock(os.path.basename(os.path.realpath(cwd)))
+        return lock
+
+    def _timeout(self, args) -> float:
+        # 跳过 -c <配置> / -C <目录> 这类带值的全局选项，取真正的子命令
+        sub, it = "", iter(args)
+        for a in it:
+            if a in ("-c", "-C"):
+                next(it, None)
+            elif not a.startswith("-"):
+                sub = a
+                break
+        return self.timeouts.get(sub, self.timeouts["default"])
+
+    async def _spawn(self, cwd: str, args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                     env: dict = None):
+        """在独立进程组中启动 git；禁用终端交互，凭据缺失时直接失败而不是挂起"""
         proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
+            *self._git_cmd(*args),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=stdout,
+            stderr=stderr,
             cwd=cwd,
+            env={**os.environ, "GIT_TERMINAL_PROMPT": "0", **(env or {})},
+            start_new_session=True,
         )
-        stdout, stderr = await proc.communicate()
-        return (
-            stdout.decode("utf-8", errors="replace"),
-            stderr.decode("utf-8", errors="replace"),
-            proc.returncode,
-        )
+        # 记录子进程，判断 index.lock 是否残留时用；已退出的在查看时剔除
+        self._children.setdefault(os.path.realpath(self._git_dir(cwd)), set()).add(proc)
+        return proc
+
+    @staticmethod
+    async def _kill(proc):
+        """SIGKILL 整个进程组（含 ssh、credential helper 等子进程）"""
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        await proc.wait()
+
+    async def _run_git(self, cwd: str, *args, timeout: float = None, env: dict = None) -> tuple[str, str, int]:
+        """执行 git 命令，返回 (stdout, stderr, returncode)
+
+        超时后杀掉进程组，返回码为 TIMEOUT_RETURNCODE；index.lock 冲突时自动重试。
+        env 为额外的环境变量（如 GIT_INDEX_FILE）。
+        """
+        timeout = timeout or self._timeout(args)
+        blocker = ""
+        for attempt in range(INDEX_LOCK_RETRIES + 1):
+            proc = await self._spawn(cwd, args, env=env)
+            try:
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+            except asyncio.TimeoutError:
+                await self._kill(proc)
+                logger.warning(f"git {' '.join(args[:2])} 超时（{timeout}s），已终止 [{cwd}]")
+                return "", f"git {args[0]} 超时（{timeout}s），已终止", TIMEOUT_RETURNCODE
+            out = stdout.decode("utf-8", errors="replace")
+            err = stderr.decode("utf-8", errors="replace")
+            if proc.returncode == 0 or "index.lock" not in err:
+                return out, err, proc.returncode
+            if attempt == INDEX_LOCK_RETRIES:
+                break
+            blocker = await self._handle_index_lock(cwd, attempt)
+        lock_path = os.path.join(self._git_dir(cwd), "index.lock")
+        logger.warning(f"index.lock 未释放（{blocker or '仍被占用'}）: {lock_path}")
+        err = (err.rstrip("\n") + f"\nindex.lock 未释放（{blocker or '仍被占用'}）: {lock_path}\n"
+               "确认没有 git 进程在使用该仓库后可手动删除")
+        return out, err, proc.returncode
+
+    async def _handle_index_lock(self, cwd: str, attempt: int) -> str:
+        """index.lock 已存在：确认是崩溃遗留才删除，否则退避等待；返回未删除的原因（已释放 / 已删除为空串）"""
+        lock_path = os.path.join(self._git_dir(cwd), "index.lock")
+        try:
+            age = time.time() - os.stat(lock_path).st_mtime
+        except FileNotFoundError:
+            return ""  # 已被释放，直接重试
+        if age >= self.stale_lock_seconds:
+            blocker = await self._lock_holder(cwd)
+            if not blocker:
+                logger.warning(f"删除残留的 index.lock（{age:.0f}s 未更新，无 git 进程使用）: {lock_path}")
+                try:
+                    os.remove(lock_path)
+                except FileNotFoundError:
+                    pass
+                return ""
+        else:
+            blocker = f"{age:.0f}s 前创建"
+        delay = INDEX_LOCK_BACKOFF * 2 ** attempt
+        logger.info(f"index.lock 被占用（{blocker}），{delay:.1f}s 后重试: {lock_path}")
+        await asyncio.sleep(delay)
+        return blocker
+
+    async def _lock_holder(self, cwd: str) -> str:
+        """可能持有 index.lock 的进程描述；确认没有任何 git 进程在使用该仓库时返回空串"""
+        git_dir = os.path.realpath(self._git_dir(cwd))
+        children = self._children.get(git_dir, set())
+        children -= {p for p in children if p.returncode is not None}
+        if children:
+            return f"本服务的 git 命令仍在运行: pid {', '.join(str(p.pid) for p in children)}"
+        pids = await asyncio.to_thread(_git_processes_in, (os.path.realpath(cwd), git_dir))
+        if pids is None:
+            return "无法检查其他 git 进程"
+        if pids:
+            return f"git 进程正在使用该仓库: pid {', '.join(map(str, pids))}"
+        return ""
 
     async def diff(self, cwd: str, ref: str = "") -> str:
-        """git diff：先 stat 概览，再详细 diff"""
-        args_stat = ["diff", "--stat"]
-        args_full = ["diff"]
-        if ref:
-            args_stat.append(ref)
-            args_full.append(ref)
-
-        stat_out, _, _ = await self._run_git(cwd, *args_stat)
-        diff_out, _, _ = await self._run_git(cwd, *args_full)
-
-        if not stat_out.strip() and not diff_out.strip():
-            return "没有未提交的变更"
-
-        result = f"变更统计:\n{stat_out}"
-
-        if diff_out:
-            if len(diff_out) > 3000:
-                diff_out = diff_out[:3000] + "\n... diff 过长，已截断"
-            result += f"\n{diff_out}"
-
-        return result
+        """/diff [ref]：统计 + 第一页；/diff <文件>：跳到该文件；/diff next：下一页"""
+        spool = self._diffs.get(cwd)
+        if ref == "next":
+            if spool is None:
+                return "没有可翻页的 diff，先发 /diff"
+            if spool.cursor >= spool.size:
+                return "diff 已到末尾，/diff 重新生成"
+            return self._diff_page(spool, spool.cursor)
+        if ref and spool is not None:
+            index = spool.find(ref)
+            if index is not None:
+                return self._diff_page(spool, spool.files[index][1])
+
+        # 参数是工作区里的文件（且不在当前快照中）：只对该文件生成 diff
+        target = ref if ref and os.path.exists(os.path.join(cwd, ref)) else ""
+        async with self.repo_lock(cwd).shared("diff"):
+            spool = await self._spool_diff(cwd, "" if target else ref, path=target)
+        if spool is None:
+            return f"无法获取 diff: {ref}" if ref and not target else "无法获取 diff"
+        old = self._diffs.pop(cwd, None)
+        if old is not None:
+            old.close()
+        if not spool.files:
+            spool.close()
+            if target:
+                return f"{target} 没有变更"
+            return "\n".join(["变更统计:"] + spool.stat) if spool.stat else "没有未提交的变更"
+        self._diffs[cwd] = spool
+
+        if target:
+            return self._diff_page(spool, 0)
+
+        stat = spool.stat
+        if len(stat) > DIFF_STAT_LINES + 1:
+            stat = stat[:DIFF_STAT_LINES] + [f" … 另有 {len(stat) - DIFF_STAT_LINES - 1} 个文件", stat[-1]]
+        header = "变更统计:\n" + "\n".join(stat)
+        return header + "\n\n" + self._diff_page(spool, 0, self.diff_page_chars - len(header))
+
+    def _diff_page(self, spool: DiffSpool, start: int, page_chars: int = 0) -> str:
+        # 按字节分页：含中文时一页的字符数会少一些，但不会超出消息长度
+        page_chars = max(page_chars or self.diff_page_chars, 500)
+        text, end = spool.read_page(start, page_chars)
+        spool.cursor = end
+        index = spool.file_index(start)
+        path, file_start = spool.files[index]
+        lines = []
+        if start > file_start:
+            lines.append(f"（续）{path}")
+        lines.append(text.rstrip("\n"))
+        footer = f"\n— 第 {spool.file_index(max(end - 1, 0)) + 1}/{len(spool.files)} 个文件"
+        if end < spool.size:
+            footer += "，/diff next 下一页，/diff <文件> 跳转"
+        elif spool.truncated:
+            footer += f"，diff 超过 {spool.size // 1024}KB 已截断"
+        return "\n".join(lines) + footer
+
+    async def _spool_diff(self, cwd: str, ref: str, path: str = "") -> DiffSpool | None:
+        """单次运行 git diff --patch-with-stat，流式解析并写入临时文件；超过字节上限时终止子进程
+
+        文件路径先按 diff --git 行两侧相同来取，再用头部的 rename to / --- a/ / +++ b/ 行校正
+        （改名、路径里含 " b/" 等情况）。core.quotePath=false 让非 ASCII 路径原样输出。
+        """
+        args = ["-c", "core.quotePath=false", "diff", "--patch-with-stat"] \
+            + ([ref] if ref else []) + (["--", path] if path else [])
+        proc = await self._spawn(cwd, args, stderr=asyncio.subprocess.DEVNULL)
+        spool = DiffSpool(ref=ref, buffer=tempfile.SpooledTemporaryFile(max_size=256 * 1024))
+        deadline = time.monotonic() + self._timeout(args)
+        in_patch = in_header = False
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(proc.stdout.readline(), deadline - time.monotonic())
+                except asyncio.TimeoutError:
+                    logger.warning(f"git diff 超时，已终止 [{cwd}]")
+                    spool.truncated = True
+                    break
+                if not line:
+                    break
+                if line.startswith(b"diff --git "):
+                    in_patch = in_header = True
+                    spool.files.append((_diff_git_path(line[len(b"diff --git "):]), spool.size))
+                elif in_header:
+                    if line.startswith(b"@@"):
+                        in_header = False
+                    else:
+                        for prefix, strip in DIFF_PATH_HEADERS:
+                            if line.startswith(prefix):
+                                name = _unquote_path(line[len(prefix):])
+                                if name.startswith(strip):
+                                    spool.files[-1] = (name[len(strip):], spool.files[-1][1])
+                                break
+                if not in_patch:
+                    text = line.decode("utf-8", errors="replace").rstrip("\n")
+                    if text:
+                        spool.stat.append(text)
+                    continue
+                if spool.size + len(line) > self.diff_max_bytes:
+                    spool.truncated = True
+                    break
+                spool.buffer.write(line)
+                spool.size += len(line)
+        finally:
+            if spool.truncated:
+                await self._kill(proc)
+            else:
+                try:
+                    await asyncio.wait_for(proc.wait(), max(deadline - time.monotonic(), 1))
+                except asyncio.TimeoutError:
+                    await self._kill(proc)
+        if proc.returncode not in (0, None) and not spool.truncated:
+            spool.close()
+            return None
+        return spool
 
     async def commit(self, cwd: str, message: str = "") -> str:
         """git add -A + commit"""
-        await self._run_git(cwd, "add", "-A")
+        self.invalidate(cwd)
+        async with self.repo_lock(cwd).exclusive("commit"):
+            await self._run_git(cwd, "add", "-A")
 
-        status_out, _, _ = await self._run_git(cwd, "status", "--porcelain")
-        if not status_out.strip():
-            return "没有需要提交的变更"
+            status_out, _, _ = await self._run_git(cwd, "status", "--porcelain")
+            if not status_out.strip():
+                return "没有需要提交的变更"
 
-        if not message:
-            stat_out, _, _ = await self._run_git(cwd, "diff", "--cached", "--stat")
-            lines = stat_out.strip().split("\n")
-            message = f"Update: {lines[-1].strip()}" if lines else "Update"
+            if not message:
+                stat_out, _, _ = await self._run_git(cwd, "diff", "--cached", "--stat")
+                lines = stat_out.strip().split("\n")
+                message = f"Update: {lines[-1].strip()}" if lines else "Update"
 
-        full_message = f"{self.commit_prefix} {message}"
-        out, err, code = await self._run_git(cwd, "commit", "-m", full_message)
+            full_message = f"{self.commit_prefix} {message}"
+            out, err, code = await self._run_git(cwd, "commit", "-m", full_message)
         if code != 0:
             return f"Commit 失败:\n{err}"
 
@@ -88,8 +615,7 @@ class GitOps:
     async def push(self, cwd: str, branch: str = "") -> str:
         """git push"""
         if not branch:
-            out, _, _ = await self._run_git(cwd, "branch", "--show-current")
-            branch = out.strip()
+            branch = await self.current_branch(cwd)
 
         if not branch:
             return "无法确定当前分支"
@@ -100,7 +626,8 @@ class GitOps:
                 f"请先切换到开发分支: /branch <分支名>"
             )
 
-        out, err, code = await self._run_git(cwd, "push", "-u", "origin", branch)
+        async with self.repo_lock(cwd).exclusive("push"):
+            out, err, code = await self._run_git(cwd, "push", "-u", "origin", branch)
         if code != 0:
             return f"Push 失败:\n{err}"
 
@@ -108,24 +635,38 @@ class GitOps:
 
     async def pull(self, cwd: str) -> str:
         """git pull"""
-        out, err, code = await self._run_git(cwd, "pull")
+        self.invalidate(cwd)
+        async with self.repo_lock(cwd).exclusive("pull"):
+            out, err, code = await self._run_git(cwd, "pull")
         if code != 0:
             return f"Pull 失败:\n{err}"
 
         return f"Pull 完成\n{out}"
 
+    async def fetch(self, cwd: str, extra_args: list[str] = ()) -> str:
+        """git fetch --all --prune（后台调度用），成功返回空字符串，失败返回错误信息
+
+        只更新远端跟踪引用，不碰 index 和工作区，取共享锁，不阻塞 /gs 等查询。
+        extra_args 用于浅克隆的项目沿用克隆时的 --depth。
+        """
+        async with self.repo_lock(cwd).shared("fetch"):
+            _, err, code = await self._run_git(cwd, "fetch", "--all", "--prune", "--quiet", *extra_args)
+        return (err.strip() or f"exit {code}") if code != 0 else ""
+
     async def branch(self, cwd: str, name: str = "") -> str:
         """查看/切换/创建分支"""
         if not name:
-            out, _, _ = await self._run_git(cwd, "branch", "-a")
+            out = await self._cached(cwd, "branch", lambda: self._branch_output(cwd))
             return f"分支列表:\n{out}" if out.strip() else "暂无分支"
 
-        out, err, code = await self._run_git(cwd, "checkout", name)
-        if code != 0:
-            out, err, code = await self._run_git(cwd, "checkout", "-b", name)
+        self.invalidate(cwd)
+        async with self.repo_lock(cwd).exclusive("checkout"):
+            out, err, code = await self._run_git(cwd, "checkout", name)
             if code != 0:
-                return f"切换分支失败:\n{err}"
-            return f"已创建并切换到新分支: {name}"
+                out, err, code = await self._run_git(cwd, "checkout", "-b", name)
+                if code != 0:
+                    return f"切换分支失败:\n{err}"
+                return f"已创建并切换到新分支: {name}"
 
         return f"已切换到分支: {name}"
 
@@ -133,21 +674,259 @@ class GitOps:
         """查看最近 commit 记录"""
         n = int(count) if count.strip().isdigit() else 10
         n = min(n, 30)
-        out, _, code = await self._run_git(
-            cwd, "log", f"-{n}", "--oneline", "--graph", "--decorate"
-        )
-        if code != 0 or not out.strip():
+        out = await self._cached(cwd, f"log:{n}", lambda: self._log_output(cwd, n))
+        if not out.strip():
             return "暂无 commit 记录"
 
         return f"最近 {n} 条 commit:\n{out}"
 
     async def status(self, cwd: str) -> str:
         """git status 简洁版"""
-        out, _, code = await self._run_git(cwd, "status", "--short")
-        if code != 0:
+        out = await self._status_branch(cwd)
+        if out is None:
             return "无法获取 git status"
 
-        if not out.strip():
+        changes = out.split("\n", 1)[1] if "\n" in out else ""
+        if not changes.strip():
             return "工作区干净，没有变更"
 
-        return f"Git 状态:\n{out}"
+        return f"Git 状态:\n{changes}"
+
+    async def summary(self, cwd: str) -> str:
+        """一行分支概要，如「main ↑1 ↓2，3 个变更」；非 git 仓库返回空字符串"""
+        state = await self.branch_state(cwd)
+        if state is None:
+            return ""
+        parts = [state.branch]
+        if state.ahead:
+            parts.append(f"↑{state.ahead}")
+        if state.behind:
+            parts.append(f"↓{state.behind}")
+        n_changes = state.staged + state.modified + state.untracked
+        return " ".join(parts) + (f"，{n_changes} 个变更" if n_changes else "，工作区干净")
+
+    async def branch_state(self, cwd: str) -> BranchState | None:
+        """解析缓存的 git status --short --branch；非 git 仓库返回 None"""
+        out = await self._status_branch(cwd)
+        if not out:
+            return None
+        header, _, changes = out.partition("\n")
+        # ## main...origin/main [ahead 1, behind 2]
+        branch, _, track = header[3:].partition(" [")
+        state = BranchState(branch.split("...")[0].replace("No commits yet on ", ""))
+        for item in track.rstrip("]").split(", "):
+            word, _, n = item.partition(" ")
+            if word in ("ahead", "behind") and n.isdigit():
+                setattr(state, word, int(n))
+        for line in changes.split("\n"):
+            if len(line) < 2:
+                continue
+            if line[:2] == "??":
+                state.untracked += 1
+                continue
+            if line[0] != " ":
+                state.staged += 1
+            if line[1] != " ":
+                state.modified += 1
+        return state
+
+    async def dashboard(self, projects: dict[str, str]) -> list[tuple[str, BranchState | None, str]]:
+        """并发查询多个项目的分支状态 [(项目名, 状态, 错误)]；并发数受 dashboard_concurrency 限制"""
+        semaphore = asyncio.Semaphore(self.dashboard_concurrency)
+
+        async def one(name: str, path: str):
+            if not os.path.isdir(path):
+                return name, None, "路径不存在"
+            async with semaphore:
+                try:
+                    state = await asyncio.wait_for(self.branch_state(path), self.dashboard_timeout)
+                except asyncio.TimeoutError:
+                    return name, None, "超时"
+            return name, state, "" if state else "非 git 仓库"
+
+        return await asyncio.gather(*(one(name, path) for name, path in projects.items()))
+
+    async def _status_branch(self, cwd: str):
+        """git status --short --branch（缓存，含 ## 分支行）；失败返回 None"""
+        return await self._cached(
+            cwd, "status", lambda: self._git_stdout(cwd, "status", "--short", "--branch", default=None),
+            ttl=self.status_ttl,
+        )
+
+    async def _git_stdout(self, cwd: str, *args, default=""):
+        """执行 git 只读命令（取共享锁），成功返回 stdout，失败返回 default"""
+        async with self.repo_lock(cwd).shared(args[0]):
+            out, _, code = await self._run_git(cwd, *args)
+        return out if code == 0 else default
+
+    # ========== 检查点（/undo） ==========
+
+    async def _snapshot_tree(self, cwd: str, index_path: str) -> str:
+        """把工作区（已跟踪 + 未忽略的未跟踪文件）写成 tree 对象，返回 tree id
+
+        在 index 的临时副本上 add -A（沿用其中的 stat 信息，只重新哈希改动过的文件），
+        真正的 index、HEAD 都不动。BOT_DATA_DIR 不进快照：记忆库和向量矩阵随每次任务变化，
+        快照它们会让每个检查点都往对象库里写一份几十上百 MB 的新 blob。
+        """
+        real_index = os.path.join(self._git_dir(cwd), "index")
+        if os.path.exists(real_index):
+            shutil.copyfile(real_index, index_path)
+        env = {"GIT_INDEX_FILE": index_path}
+        _, err, code = await self._run_git(cwd, "add", "-A", "--", ".", f":(exclude){BOT_DATA_DIR}", env=env)
+        if code != 0:
+            raise RuntimeError(err.strip())
+        await self._drop_bot_data(cwd, env)
+        tree, err, code = await self._run_git(cwd, "write-tree", env=env)
+        if code != 0:
+            raise RuntimeError(err.strip())
+        return tree.strip()
+
+    async def _drop_bot_data(self, cwd: str, env: dict):
+        """从临时 index 中去掉 BOT_DATA_DIR（被误提交进真正的 index、或旧检查点里有时）"""
+        _, err, code = await self._run_git(
+            cwd, "rm", "-r", "-q", "-f", "--cached", "--ignore-unmatch", "--", BOT_DATA_DIR, env=env,
+        )
+        if code != 0:
+            raise RuntimeError(err.strip())
+
+    async def _restorable_tree(self, cwd: str, commit: str, index_path: str) -> str:
+        """检查点的 tree 去掉 BOT_DATA_DIR 后的 tree id（旧版本创建的检查点里可能含有）"""
+        env = {"GIT_INDEX_FILE": index_path}
+        _, err, code = await self._run_git(cwd, "read-tree", f"{commit}^{{tree}}", env=env)
+        if code != 0:
+            raise RuntimeError(err.strip())
+        await self._drop_bot_data(cwd, env)
+        tree, err, code = await self._run_git(cwd, "write-tree", env=env)
+        if code != 0:
+            raise RuntimeError(err.strip())
+        return tree.strip()
+
+    async def _write_checkpoint(self, cwd: str, label: str, index_path: str) -> str:
+        """快照工作区并写入 refs/724code/checkpoints/<run>，返回 run
+
+        run 为秒级时间戳，同一秒内已有检查点时加 -2、-3 … 后缀。引用只新建不覆盖
+        （update-ref 的旧值为空），共享锁下并发创建的检查点撞名时换下一个后缀重试。
+        """
+        tree = await self._snapshot_tree(cwd, index_path)
+        head, _, code = await self._run_git(cwd, "rev-parse", "--verify", "-q", "HEAD")
+        parent = ["-p", head.strip()] if code == 0 else []
+        base = time.strftime("%Y%m%d-%H%M%S")
+        message = f"checkpoint {base}\n\n{label.strip()[:200]}"
+        commit, err, code = await self._run_git(cwd, "commit-tree", tree, *parent, "-m", message)
+        if code != 0:
+            raise RuntimeError(err.strip())
+        for n in range(1, CHECKPOINT_ID_ATTEMPTS + 1):
+            run = base if n == 1 else f"{base}-{n}"
+            _, err, code = await self._run_git(cwd, "update-ref", CHECKPOINT_REFS + run, commit.strip(), "")
+            if code == 0:
+                return run
+            if "exists" not in err:
+                break
+        raise RuntimeError(err.strip())
+
+    async def checkpoint(self, cwd: str, label: str = "") -> str:
+        """Claude 任务前快照工作区，返回检查点 ID；未启用 / 非 git 仓库 / 失败时返回空字符串
+
+        只写对象和一个隐藏引用，不改 index / HEAD / 工作区，取共享锁。
+        """
+        if not self.checkpoint_enabled or not os.path.isdir(self._git_dir(cwd)):
+            return ""
+        start = time.monotonic()
+        try:
+            with tempfile.TemporaryDirectory(prefix="724code_ckpt_") as tmp:
+                async with self.repo_lock(cwd).shared("checkpoint"):
+                    run = await self._write_checkpoint(cwd, label, os.path.join(tmp, "index"))
+                    await self._prune_checkpoints(cwd)
+        except (RuntimeError, OSError) as e:
+            logger.warning(f"创建检查点失败 [{cwd}]: {e}")
+            return ""
+        logger.debug(f"检查点 {run} 创建完成，耗时 {(time.monotonic() - start) * 1000:.0f}ms [{cwd}]")
+        return run
+
+    async def _list_checkpoints(self, cwd: str) -> list[Checkpoint]:
+        """全部检查点，最新的在前"""
+        out, _, code = await self._run_git(
+            cwd, "for-each-ref", "--sort=-refname", "--sort=-creatordate",
+            "--format=%(refname)%00%(objectname)%00%(creatordate:unix)%00%(contents:body)%01",
+            CHECKPOINT_REFS,
+        )
+        if code != 0:
+            return []
+        checkpoints = []
+        for record in out.split("\x01"):
+            fields = record.strip("\n").split("\x00")
+            if len(fields) == 4:
+                ref, commit, created, body = fields
+                checkpoints.append(Checkpoint(ref[len(CHECKPOINT_REFS):], commit, int(created or 0),
+                                              body.strip().split("\n", 1)[0]))
+        return checkpoints
+
+    async def _prune_checkpoints(self, cwd: str):
+        """只保留最近 checkpoint_keep 个且不超过 checkpoint_max_age 的检查点
+
+        只删引用；快照对象随之不可达，由 git gc 正常清理。
+        """
+        checkpoints = await self._list_checkpoints(cwd)
+        cutoff = time.time() - self.checkpoint_max_age
+        stale = [c for i, c in enumerate(checkpoints) if i >= self.checkpoint_keep or c.created < cutoff]
+        if not stale:
+            return
+        # 每次创建后都清理，通常只有一个要删
+        for c in stale:
+            await self._run_git(cwd, "update-ref", "-d", CHECKPOINT_REFS + c.run, c.commit)
+        logger.info(f"清理 {len(stale)} 个旧检查点 [{cwd}]")
+
+    async def list_checkpoints(self, cwd: str) -> str:
+        """/undo list：检查点列表"""
+        checkpoints = await self._list_checkpoints(cwd)
+        if not checkpoints:
+            return "暂无检查点（每次交给 Claude 执行前自动创建）"
+        lines = [f"检查点（{len(checkpoints)} 个，最新在前）:"]
+        for c in checkpoints:
+            when = time.strftime("%m-%d %H:%M", time.localtime(c.created))
+            lines.append(f"  {c.run}  {when}  {c.label[:40]}")
+        lines.append("\n/undo <ID> 回滚到该次执行之前")
+        return "\n".join(lines)
+
+    async def undo(self, cwd: str, run: str = "") -> str:
+        """把工作区恢复到检查点（默认最近一个）
+
+        先给当前工作区再做一个检查点（undo 本身也可撤销），然后在临时 index 上
+        read-tree --reset -u：检查点里有的文件写回，之后新增的（未忽略）文件删除。
+        被 .gitignore 忽略的文件不动；真正的 index 和 HEAD 不动。
+        BOT_DATA_DIR 两边的 index 里都没有，不会被还原或删除（记忆库的连接一直开着，
+        把旧的 db / -wal / -shm 写回去会损坏数据库）。
+        """
+        checkpoints = await self._list_checkpoints(cwd)
+        if not checkpoints:
+            return "暂无检查点，无法回滚"
+        target = next((c for c in checkpoints if c.run == run), None) if run else checkpoints[0]
+        if target is None:
+            return f"检查点不存在: {run}\n查看: /undo list"
+
+        self.invalidate(cwd)
+        try:
+            with tempfile.TemporaryDirectory(prefix="724code_undo_") as tmp:
+                index_path = os.path.join(tmp, "index")
+                async with self.repo_lock(cwd).exclusive("undo"):
+                    backup = await self._write_checkpoint(cwd, f"/undo {target.run} 之前", index_path)
+                    tree = await self._restorable_tree(cwd, target.commit, os.path.join(tmp, "target"))
+                    _, err, code = await self._run_git(
+                        cwd, "read-tree", "--reset", "-u", tree, env={"GIT_INDEX_FILE": index_path},
+                    )
+                    head, _, _ = await self._run_git(cwd, "rev-parse", "-q", "--verify", "HEAD")
+                    parent, _, _ = await self._run_git(cwd, "rev-parse", "-q", "--verify", f"{target.commit}^")
+        except (RuntimeError, OSError) as e:
+            return f"回滚失败: {e}"
+        finally:
+            # 等锁期间可能有读取重新填了缓存，工作区改完后再作废一次
+            self.invalidate(cwd)
+        if code != 0:
+            return f"回滚失败:\n{err}"
+
+        lines = [f"已回滚到检查点 {target.run}（{target.label[:40]}）之前的工作区",
+                 f"回滚前的状态已另存为检查点 {backup}，可 /undo {backup} 恢复"]
+        if head.strip() != parent.strip():
+            lines.append(f"注意: 之后 HEAD 已移动（{parent.strip()[:7] or '无'} → {head.strip()[:7]}），"
+                         "提交记录未回退，/gs 可查看差异")
+        return "\n".join(lines)
@@ -0,0 +1,496 @@
+"""进程内只读 git 读取器 — /log、/branch、当前分支等高频查询不再 fork git
+
+直接读取 .git 目录：
+  - 引用：HEAD（含符号引用）、refs/ 下的松散引用、packed-refs（含 ^ 剥离行）
+  - 对象：松散对象（zlib），以及 pack 文件（通过 v2 .idx 二分查找定位，
+    支持 OFS_DELTA / REF_DELTA 增量链）
+  - 历史：沿父提交遍历输出与 `git log --oneline --graph --decorate` 相同格式的结果
+
+只覆盖最常见的仓库形态。遇到不支持的情况（SHA-256 仓库、reftable、replace 引用、
+grafts、浅克隆边界、窗口内有合并提交需要画图、对象缺失等）抛出 GitReadError，
+由 GitOps 回退到 git 命令行。
+"""
+
+import bisect
+import mmap
+import os
+import struct
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+# pack 对象类型
+OBJ_COMMIT, OBJ_TREE, OBJ_BLOB, OBJ_TAG, OBJ_OFS_DELTA, OBJ_REF_DELTA = 1, 2, 3, 4, 6, 7
+_TYPE_NAMES = {OBJ_COMMIT: "commit", OBJ_TREE: "tree", OBJ_BLOB: "blob", OBJ_TAG: "tag"}
+
+# 增量链解析时缓存的基对象数
+BASE_CACHE_SIZE = 64
+# 已解析的 commit 缓存条数（commit 不可变，重复 /log 直接命中）
+COMMIT_CACHE_SIZE = 2048
+
+_IDX_MAGIC = b"\377tOc"
+
+
+class GitReadError(Exception):
+    """读取器不支持或读取失败，调用方应回退到 git 命令行"""
+
+
+@dataclass(slots=True)
+class Commit:
+    sha: str
+    parents: list[str] = field(default_factory=list)
+    subject: str = ""
+    committer_time: int = 0
+
+
+class _PackIndex:
+    """一个 pack 文件及其 v2 索引（均 mmap，按需读取）"""
+
+    def __init__(self, idx_path: str):
+        self.idx_path = idx_path
+        self.pack_path = idx_path[:-4] + ".pack"
+        with open(idx_path, "rb") as f:
+            self._idx = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._idx[:4] != _IDX_MAGIC or struct.unpack(">I", self._idx[4:8])[0] != 2:
+            self.close()
+            raise GitReadError(f"不支持的 pack 索引版本: {idx_path}")
+        self.fanout = struct.unpack(">256I", self._idx[8:8 + 1024])
+        self.count = self.fanout[255]
+        self._names = 8 + 1024
+        self._offsets = self._names + self.count * 20 + self.count * 4
+        self._large = self._offsets + self.count * 4
+        with open(self.pack_path, "rb") as f:
+            self.pack = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        for m in (getattr(self, "_idx", None), getattr(self, "pack", None)):
+            if m is not None:
+                m.close()
+
+    def find(self, sha: bytes) -> int | None:
+        """在索引中二分查找对象，返回 pack 内偏移"""
+        lo = self.fanout[sha[0] - 1] if sha[0] else 0
+        hi = self.fanout[sha[0]]
+        names = _NameView(self._idx, self._names)
+        i = bisect.bisect_left(names, sha, lo, hi)
+        if i >= hi or names[i] != sha:
+            return None
+        pos = self._offsets + i * 4
+        offset = struct.unpack(">I", self._idx[pos:pos + 4])[0]
+        if offset & 0x80000000:
+            pos = self._large + (offset & 0x7FFFFFFF) * 8
+            offset = struct.unpack(">Q", self._idx[pos:pos + 8])[0]
+        return offset
+
+
+class _NameView:
+    """把索引中的 20 字节对象名数组包装成可 bisect 的序列（不复制）"""
+
+    def __init__(self, buf, start: int):
+        self.buf = buf
+        self.start = start
+
+    def __getitem__(self, i: int) -> bytes:
+        pos = self.start + i * 20
+        return self.buf[pos:pos + 20]
+
+    def __len__(self):
+        return (len(self.buf) - self.start) // 20
+
+
+class GitReader:
+    """单个仓库的只读访问；pack 索引在 objects/pack 变化时重新加载"""
+
+    def __init__(self, git_dir: str):
+        self.git_dir = git_dir
+        self.common_dir = git_dir
+        commondir = os.path.join(git_dir, "commondir")
+        if os.path.isfile(commondir):
+            with open(commondir, encoding="utf-8") as f:
+                self.common_dir = os.path.normpath(os.path.join(git_dir, f.read().strip()))
+        self._check_supported()
+        self._packs: list[_PackIndex] = []
+        self._packs_mtime = None
+        self._bases: OrderedDict[tuple[str, int], tuple[int, bytes]] = OrderedDict()
+        self._commits: OrderedDict[str, Commit] = OrderedDict()
+
+    def _check_supported(self):
+        config = os.path.join(self.common_dir, "config")
+        try:
+            with open(config, encoding="utf-8", errors="replace") as f:
+                text = f.read().lower()
+        except OSError:
+            text = ""
+        if "objectformat" in text or "refstorage" in text:
+            raise GitReadError("不支持的仓库格式（SHA-256 / reftable）")
+        if os.path.exists(os.path.join(self.common_dir, "info", "grafts")) or \
+                os.path.isdir(os.path.join(self.common_dir, "refs", "replace")):
+            raise GitReadError("仓库使用了 grafts / replace 引用")
+
+    def close(self):
+        for pack in self._packs:
+            pack.close()
+        self._packs = []
+        self._bases.clear()
+
+    # ========== 引用 ==========
+
+    def read_ref(self, name: str, depth: int = 0) -> str | None:
+        """解析引用为对象 ID（跟随符号引用）；不存在返回 None"""
+        if depth > 5:
+            raise GitReadError(f"符号引用层级过深: {name}")
+        base = self.git_dir if name == "HEAD" else self.common_dir
+        try:
+            with open(os.path.join(base, name), encoding="utf-8") as f:
+                value = f.read().strip()
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            return self._packed_refs()[0].get(name)
+        except OSError as e:
+            raise GitReadError(str(e)) from e
+        if value.startswith("ref:"):
+            return self.read_ref(value[4:].strip(), depth + 1)
+        return value
+
+    def head_target(self) -> str:
+        """HEAD 指向的分支引用名（如 refs/heads/main）；分离头指针时返回空字符串"""
+        try:
+            with open(os.path.join(self.git_dir, "HEAD"), encoding="utf-8") as f:
+                value = f.read().strip()
+        except OSError as e:
+            raise GitReadError(str(e)) from e
+        return value[4:].strip() if value.startswith("ref:") else ""
+
+    def current_branch(self) -> str:
+        """等同 git branch --show-current"""
+        target = self.head_target()
+        return target.removeprefix("refs/heads/") if target.startswith("refs/heads/") else ""
+
+    def list_refs(self, prefix: str = "refs/") -> dict[str, str]:
+        """所有以 prefix 开头的引用 {引用名: 对象 ID}，按名称排序（符号引用已解析）"""
+        refs = {k: v for k, v in self._packed_refs()[0].items() if k.startswith(prefix)}
+        root = os.path.join(self.common_dir, "refs")
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, self.common_dir).replace(os.sep, "/")
+                if not name.startswith(prefix) or filename.endswith(".lock"):
+                    continue
+                sha = self.read_ref(name)
+                if sha:
+                    refs[name] = sha
+        return dict(sorted(refs.items()))
+
+    def symbolic_refs(self, prefix: str = "refs/") -> dict[str, str]:
+        """松散引用中的符号引用 {引用名: 目标引用名}（如 refs/remotes/origin/HEAD）"""
+        result = {}
+        root = os.path.join(self.common_dir, "refs")
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, self.common_dir).replace(os.sep, "/")
+                if not name.startswith(prefix):
+                    continue
+                try:
+                    with open(path, encoding="utf-8") as f:
+                        value = f.read().strip()
+                except OSError:
+                    continue
+                if value.startswith("ref:"):
+                    result[name] = value[4:].strip()
+        return result
+
+    def _packed_refs(self) -> tuple[dict[str, str], dict[str, str]]:
+        """packed-refs 中的 ({引用名: 对象 ID}, {引用名: 剥离后的对象 ID})"""
+        refs, peeled = {}, {}
+        try:
+            with open(os.path.join(self.common_dir, "packed-refs"), encoding="utf-8") as f:
+                last = ""
+                for line in f:
+                    line = line.rstrip("\n")
+                    if not line or line.startswith("#"):
+                        continue
+                    if line.startswith("^"):
+                        peeled[last] = line[1:]
+                        continue
+                    sha, _, name = line.partition(" ")
+                    refs[name] = sha
+                    last = name
+        except FileNotFoundError:
+            pass
+        return refs, peeled
+
+    def peel(self, sha: str) -> str:
+        """附注标签剥离到其指向的对象"""
+        for _ in range(10):
+            obj_type, data = self.read_object(sha)
+            if obj_type != "tag":
+                return sha
+            sha = data.split(b"\n", 1)[0].split(b" ", 1)[1].decode()
+        raise GitReadError("标签嵌套过深")
+
+    # ========== 对象 ==========
+
+    def read_object(self, sha: str) -> tuple[str, bytes]:
+        """读取对象，返回 (类型, 内容)"""
+        path = os.path.join(self.common_dir, "objects", sha[:2], sha[2:])
+        try:
+            with open(path, "rb") as f:
+                raw = zlib.decompress(f.read())
+        except FileNotFoundError:
+            raw = None
+        except (OSError, zlib.error) as e:
+            raise GitReadError(f"松散对象损坏 {sha}: {e}") from e
+        if raw is not None:
+            header, _, body = raw.partition(b"\0")
+            return header.split(b" ", 1)[0].decode(), body
+
+        key = bytes.fromhex(sha)
+        for pack in self._load_packs():
+            offset = pack.find(key)
+            if offset is not None:
+                obj_type, data = self._read_packed(pack, offset)
+                return _TYPE_NAMES[obj_type], data
+        raise GitReadError(f"对象不存在: {sha}")
+
+    def _load_packs(self) -> list[_PackIndex]:
+        pack_dir = os.path.join(self.common_dir, "objects", "pack")
+        try:
+            mtime = os.stat(pack_dir).st_mtime_ns
+        except OSError:
+            return []
+        if mtime != self._packs_mtime:
+            self.close()
+            packs = []
+            for name in sorted(os.listdir(pack_dir)):
+                if name.endswith(".idx") and os.path.exists(os.path.join(pack_dir, name[:-4] + ".pack")):
+                    packs.append(_PackIndex(os.path.join(pack_dir, name)))
+            self._packs = packs
+            self._packs_mtime = mtime
+        return self._packs
+
+    def _read_packed(self, pack: _PackIndex, offset: int) -> tuple[int, bytes]:
+        """读取 pack 中的对象（解析增量链），返回 (基础类型, 内容)"""
+        chain = []
+        while True:
+            cached = self._bases.get((pack.pack_path, offset))
+            if cached is not None:
+                self._bases.move_to_end((pack.pack_path, offset))
+                obj_type, data = cached
+                break
+            obj_type, pos = _read_header(pack.pack, offset)
+            if obj_type == OBJ_OFS_DELTA:
+                base_offset, pos = _read_ofs(pack.pack, pos, offset)
+                chain.append((offset, pos))
+                offset = base_offset
+            elif obj_type == OBJ_REF_DELTA:
+                base_sha = pack.pack[pos:pos + 20].hex()
+                chain.append((offset, pos + 20))
+                base_type, data = self.read_object(base_sha)
+                obj_type = {v: k for k, v in _TYPE_NAMES.items()}[base_type]
+                break
+            elif obj_type in _TYPE_NAMES:
+                data = _inflate(pack.pack, pos)
+                break
+            else:
+                raise GitReadError(f"未知的 pack 对象类型 {obj_type}")
+            if len(chain) > 1000:
+                raise GitReadError("增量链过长")
+
+        for delta_offset, pos in reversed(chain):
+            data = _apply_delta(data, _inflate(pack.pack, pos))
+            self._bases[(pack.pack_path, delta_offset)] = (obj_type, data)
+            if len(self._bases) > BASE_CACHE_SIZE:
+                self._bases.popitem(last=False)
+        return obj_type, data
+
+    def read_commit(self, sha: str) -> Commit:
+        commit = self._commits.get(sha)
+        if commit is not None:
+            self._commits.move_to_end(sha)
+            return commit
+        commit = self._parse_commit(sha)
+        self._commits[sha] = commit
+        if len(self._commits) > COMMIT_CACHE_SIZE:
+            self._commits.popitem(last=False)
+        return commit
+
+    def _parse_commit(self, sha: str) -> Commit:
+        obj_type, data = self.read_object(sha)
+        if obj_type != "commit":
+            raise GitReadError(f"{sha} 不是 commit")
+        header, _, message = data.partition(b"\n\n")
+        commit = Commit(sha)
+        encoding = "utf-8"
+        for line in header.split(b"\n"):
+            if line.startswith(b"parent "):
+                commit.parents.append(line[7:].decode())
+            elif line.startswith(b"committer "):
+                commit.committer_time = int(line.rsplit(b" ", 2)[-2])
+            elif line.startswith(b"encoding "):
+                encoding = line[9:].decode().strip()
+        try:
+            text = message.decode(encoding, errors="replace")
+        except LookupError:
+            text = message.decode("utf-8", errors="replace")
+        # --oneline 的标题：第一段，段内换行合并为空格
+        paragraph = text.lstrip("\n").split("\n\n", 1)[0]
+        commit.subject = " ".join(line.strip() for line in paragraph.strip().split("\n"))
+        return commit
+
+    def abbrev_len(self) -> int:
+        """与 git 默认 core.abbrev=auto 相同的缩写长度估算"""
+        count = sum(p.count for p in self._load_packs())
+        if count < 1 << 14:
+            return 7
+        return max(7, (count.bit_length() + 1) // 2)
+
+    # ========== 高层查询 ==========
+
+    def log_oneline(self, n: int) -> str:
+        """等同 git log -n --oneline --graph --decorate（仅线性历史；遇到合并提交抛 GitReadError）"""
+        head = self.read_ref("HEAD")
+        if not head:
+            return ""
+        decorations = self._decorations()
+        abbrev = self.abbrev_len()
+        lines = []
+        sha = head
+        while sha and len(lines) < n:
+            commit = self.read_commit(sha)
+            if len(commit.parents) > 1:
+                raise GitReadError("历史中有合并提交，需要 git 绘制分支图")
+            deco = decorations.get(sha)
+            label = f" ({', '.join(deco)})" if deco else ""
+            lines.append(f"* {sha[:abbrev]}{label} {commit.subject}")
+            # 浅克隆边界处父提交不存在，下一轮 read_commit 抛 GitReadError 回退
+            sha = commit.parents[0] if commit.parents else ""
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def _decorations(self) -> dict[str, list[str]]:
+        """{对象 ID: ["HEAD -> main", "tag: v1", "origin/main", ...]}
+
+        顺序与 git log --decorate 一致：按引用全名倒序，HEAD 指向的分支排在最前。
+        """
+        head_target = self.head_target()
+        peeled = self._packed_refs()[1]
+        deco: dict[str, list[str]] = {}
+        head_label = {}
+        for name, sha in reversed(self.list_refs().items()):
+            if name.startswith("refs/heads/"):
+                short = name[11:]
+            elif name.startswith("refs/remotes/"):
+                short = name[13:]
+            elif name.startswith("refs/tags/"):
+                short = "tag: " + name[10:]
+                sha = peeled.get(name) or self.peel(sha)
+            else:
+                continue
+            if name == head_target:
+                head_label[sha] = f"HEAD -> {short}"
+            else:
+                deco.setdefault(sha, []).append(short)
+        if not head_target:
+            head = self.read_ref("HEAD")
+            if head:
+                head_label[head] = "HEAD"
+        for sha, label in head_label.items():
+            deco.setdefault(sha, []).insert(0, label)
+        return deco
+
+    def branch_list(self) -> str:
+        """等同 git branch -a（分离头指针时抛 GitReadError）"""
+        current = self.current_branch()
+        if not current:
+            raise GitReadError("分离头指针")
+        lines = []
+        for name in self.list_refs("refs/heads/"):
+            short = name[11:]
+            lines.append(f"* {short}" if short == current else f"  {short}")
+        symbolic = self.symbolic_refs("refs/remotes/")
+        remotes = set(self.list_refs("refs/remotes/")) | set(symbolic)
+        for name in sorted(remotes):
+            if name in symbolic:
+                lines.append(f"  remotes/{name[13:]} -> {symbolic[name].removeprefix('refs/remotes/')}")
+            else:
+                lines.append(f"  remotes/{name[13:]}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+def _read_header(buf, offset: int) -> tuple[int, int]:
+    """pack 对象头：返回 (类型, 数据起始位置)；大小字段不需要"""
+    c = buf[offset]
+    obj_type = (c >> 4) & 7
+    pos = offset + 1
+    while c & 0x80:
+        c = buf[pos]
+        pos += 1
+    return obj_type, pos
+
+
+def _read_ofs(buf, pos: int, offset: int) -> tuple[int, int]:
+    """OFS_DELTA 的负偏移编码，返回 (基对象偏移, 数据起始位置)"""
+    c = buf[pos]
+    pos += 1
+    rel = c & 0x7F
+    while c & 0x80:
+        c = buf[pos]
+        pos += 1
+        rel = ((rel + 1) << 7) | (c & 0x7F)
+    return offset - rel, pos
+
+
+def _inflate(buf, pos: int) -> bytes:
+    """从 pos 开始解压一个 zlib 流（长度未知，分块喂入直到流结束）"""
+    d = zlib.decompressobj()
+    out = []
+    chunk = 16384
+    while not d.eof:
+        if pos >= len(buf):
+            raise GitReadError("pack 数据被截断")
+        out.append(d.decompress(buf[pos:pos + chunk]))
+        pos += chunk
+        chunk = min(chunk * 4, 1 << 22)
+    return b"".join(out)
+
+
+def _varint(data: bytes, pos: int) -> tuple[int, int]:
+    value = shift = 0
+    while True:
+        c = data[pos]
+        pos += 1
+        value |= (c & 0x7F) << shift
+        shift += 7
+        if not c & 0x80:
+            return value, pos
+
+
+def _apply_delta(base: bytes, delta: bytes) -> bytes:
+    """应用 git 增量：copy（从基对象复制）/ insert（插入字面量）指令序列"""
+    src_size, pos = _varint(delta, 0)
+    dst_size, pos = _varint(delta, pos)
+    if src_size != len(base):
+        raise GitReadError("增量基对象大小不符")
+    out = bytearray()
+    n = len(delta)
+    while pos < n:
+        op = delta[pos]
+        pos += 1
+        if op & 0x80:
+            copy_off = copy_len = 0
+            for i in range(4):
+                if op & (1 << i):
+                    copy_off |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if op & (0x10 << i):
+                    copy_len |= delta[pos] << (8 * i)
+                    pos += 1
+            out += base[copy_off:copy_off + (copy_len or 0x10000)]
+        elif op:
+            out += delta[pos:pos + op]
+            pos += op
+        else:
+            raise GitReadError("非法的增量指令")
+    if len(out) != dst_size:
+        raise GitReadError("增量结果大小不符")
+    return bytes(out)
@@ -0,0 +1,149 @@
+""".gitignore 匹配 — /tree、/grep 遍历项目时跳过被忽略的路径（纯 Python，不启动 git）
+
+支持 gitignore 的常用语法：
+  - 空行、# 注释；行首 ! 取反（重新包含）；行尾 / 只匹配目录
+  - 不含 / 的模式匹配任意层级的文件名；含 / 的模式相对 .gitignore 所在目录锚定
+  - *、?、[...]、**（**/ 任意层目录前缀，/** 目录下的一切，此时目录本身整体跳过）
+规则按「上层目录在前、子目录在后」的顺序排列，最后一条匹配的规则生效；
+被忽略的目录整体跳过，目录内的 ! 规则不会把其中文件重新包含（与 git 一致）。
+另外读取仓库根目录的 .git/info/exclude。
+"""
+
+import os
+import re
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True, slots=True)
+class _Rule:
+    base: str               # .gitignore 所在目录（相对项目根，"" 为根）
+    regex: re.Pattern
+    negate: bool
+    dir_only: bool
+    anchored: bool          # 含 /：匹配相对 base 的完整路径；否则只匹配文件名
+
+
+def _translate(pattern: str) -> str:
+    """glob → 正则（/ 不被 * 和 ? 匹配）"""
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("/**", i) and i + 3 == n:
+            out.append("(?:/.*)?")  # 目录本身也视为忽略（其中一切都被忽略）
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+            continue
+        if c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            end = pattern.find("]", i + 2 if pattern[i + 1:i + 2] in ("!", "]") else i + 1)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append(f"[{body.replace(chr(92), chr(92) * 2)}]")
+                i = end
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+def parse_rules(lines, base: str = "") -> list[_Rule]:
+    rules = []
+    for line in lines:
+        line = line.rstrip("\n").rstrip("\r")
+        if not line.endswith("\\ "):
+            line = line.rstrip(" ")
+        if not line or line.startswith("#"):
+            continue
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        elif line.startswith("\\!") or line.startswith("\\#"):
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            continue
+        anchored = "/" in line
+        line = line.lstrip("/")
+        rules.append(_Rule(base, re.compile(_translate(line) + r"\Z", re.DOTALL), negate, dir_only, anchored))
+    return rules
+
+
+class IgnoreRules:
+    """一组生效中的忽略规则；进入子目录时用 child() 叠加该目录的 .gitignore"""
+
+    __slots__ = ("rules",)
+
+    def __init__(self, rules: tuple[_Rule, ...] = ()):
+        self.rules = rules
+
+    @classmethod
+    def for_repo(cls, root: str) -> "IgnoreRules":
+        """只含 .git/info/exclude 的规则（遍历时再逐个目录 child() 叠加 .gitignore）"""
+        return cls(tuple(parse_rules(_read_lines(os.path.join(root, ".git", "info", "exclude")))))
+
+    @classmethod
+    def for_path(cls, root: str, rel_dir: str) -> "IgnoreRules":
+        """从根目录逐级叠加到 rel_dir（含 rel_dir 自身的 .gitignore）"""
+        rules = cls.for_repo(root).child(root, "")
+        for rel in ancestors(rel_dir):
+            rules = rules.child(os.path.join(root, rel), rel)
+        return rules
+
+    def child(self, abs_dir: str, rel_dir: str) -> "IgnoreRules":
+        """叠加 abs_dir/.gitignore（没有则返回自身）"""
+        lines = _read_lines(os.path.join(abs_dir, ".gitignore"))
+        if not lines:
+            return self
+        return IgnoreRules(self.rules + tuple(parse_rules(lines, rel_dir)))
+
+    def ignored(self, rel_path: str, is_dir: bool) -> bool:
+        """rel_path 为相对项目根的 / 分隔路径"""
+        result = False
+        name = rel_path.rsplit("/", 1)[-1]
+        for rule in self.rules:
+            if rule.negate != result:
+                continue  # 只有可能改变结果的规则才需要匹配
+            if rule.dir_only and not is_dir:
+                continue
+            if rule.base:
+                if not rel_path.startswith(rule.base + "/"):
+                    continue
+                relative = rel_path[len(rule.base) + 1:]
+            else:
+                relative = rel_path
+            if rule.regex.match(relative if rule.anchored else name):
+                result = not rule.negate
+        return result
+
+
+def ancestors(rel_dir: str) -> list[str]:
+    """"a/b/c" → ["a", "a/b", "a/b/c"]（"" 或 "." 为空列表）"""
+    parts = [p for p in rel_dir.replace(os.sep, "/").split("/") if p and p != "."]
+    return ["/".join(parts[:i + 1]) for i in range(len(parts))]
+
+
+def _read_lines(path: str) -> list[str]:
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return f.readlines()
+    except OSError:
+        return []
@@ -1,10 +1,64 @@
-"""输出处理器 — 将 Claude Code 输出压缩为手机友好格式"""
+"""输出处理器 — 将 Claude Code 输出压缩为手机友好格式
+
+长输出按结构压缩，而不是按字符数掐头去尾：
+  1. 单遍扫描，去掉 ANSI 控制序列、合并连续重复行，把输出切分为
+     正文 / 代码块 / diff / 错误堆栈 / 文件列表 几类片段
+  2. 按类别优先级分配字符预算（错误 > 文件列表 > 正文 > diff > 代码），
+     用不完的预算再按优先级分给仍需要的类别
+  3. 每个片段按自身结构截断（代码块保留围栏、堆栈保留末尾错误信息、
+     diff 保留文件头和 @@ 行），放不下的片段折叠为一行提示，最后按原顺序输出
+"""
 
 import logging
 import re
+from dataclasses import dataclass, field
 
 logger = logging.getLogger(__name__)
 
+# 各类片段的保底预算比例，及剩余预算的分配顺序（越靠前越重要）
+CLASS_SHARES = {
+    "trace": 0.25,
+    "files": 0.15,
+    "prose": 0.35,
+    "diff": 0.15,
+    "code": 0.10,
+}
+CLASS_PRIORITY = ["trace", "files", "prose", "diff", "code"]
+CLASS_LABELS = {
+    "trace": "错误堆栈",
+    "files": "文件列表",
+    "prose": "正文",
+    "diff": "diff",
+    "code": "代码块",
+}
+
+# 片段预算低于此值时整段折叠为一行提示
+MIN_SEGMENT_CHARS = 60
+
+# 非连续重复的正文行，长度达到此值才去重（避免误删「- 无」之类的短行）
+DEDUPE_MIN_LEN = 20
+
+_ANSI_RE = re.compile(r"\x1b(?:\[[0-?]*[ -/]*[@-~]|\][^\x07\x1b]*(?:\x07|\x1b\\)|[@-Z\\-_])")
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+_DIFF_START_RE = re.compile(r"^(diff --git |@@ -\d|--- (a/|/dev/null)|\+\+\+ (b/|/dev/null))")
+_DIFF_LINE_RE = re.compile(r"^([ +\-\\]|@@ |diff --git |index |new file mode|deleted file mode|similarity index|rename (from|to) )")
+_TRACE_START_RE = re.compile(
+    r"^(Traceback \(most recent call last\)|panic: |thread '.*' panicked"
+    r"|\w*(Error|Exception)\b[^:]*:|\s+at \S.*\(.*:\d+(:\d+)?\)$)"
+)
+_TRACE_LINE_RE = re.compile(r"^(\s+\S|\w*(Error|Exception)\b[^:]*:|During handling|The above exception)")
+_FILE_ITEM_RE = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+.*?`?[\w.@-]*[\w-]/?[\w.@/-]*\.[A-Za-z0-9]{1,8}`?")
+
+
+@dataclass
+class _Segment:
+    kind: str
+    lines: list[str] = field(default_factory=list)
+
+    @property
+    def size(self) -> int:
+        return sum(len(line) + 1 for line in self.lines)
+
 
 def compress_output(
     text: str,
@@ -17,8 +71,8 @@ def compress_output(
     将 Claude Code 输出压缩为适合 Telegram 的格式。
 
     策略：
-    1. 短输出（< max_length）直接返回 + 状态栏
-    2. 长输出：保留开头结论 + 文件变更摘要 + 末尾结论，中间截断
+    1. 短输出（< max_length）去掉 ANSI 后直接返回 + 状态栏
+    2. 长输出：按片段类别分配预算，结构化截断，完整输出用 /detail 查看
     """
     lines = []
 
@@ -34,6 +88,8 @@ def compress_output(
     if not text:
         return "\n".join(lines)
 
+    text = strip_ansi(text)
+
     # 内容预算（减去状态栏）
     budget = max_length - len(lines[0]) - 50
 
@@ -42,26 +98,239 @@ def compress_output(
         lines.append(text)
         return "\n".join(lines)
 
-    # 长输出：头 + 尾 + 截断提示
-    head_budget = int(budget * 0.6)
-    tail_budget = int(budget * 0.3)
+    body = compress_text(text, budget - 40)
+    lines.append("")
+    lines.append(body)
+    lines.append(f"\n... 已压缩（原文 {len(text)} 字符），/detail 查看完整输出 ...")
+    return "\n".join(lines)
+
 
-    head = text[:head_budget]
-    tail = text[-tail_budget:]
+def strip_ansi(text: str) -> str:
+    """去掉 ANSI 颜色 / 光标控制序列和回车覆盖"""
+    text = _ANSI_RE.sub("", text)
+    if "\r" in text:
+        # 进度条类输出用 \r 覆盖同一行，只保留最后一次
+        text = "\n".join(line.rsplit("\r", 1)[-1] if line.rstrip("\r") else "" for line in text.split("\n"))
+    return text
 
-    # 在换行处切割，避免截断代码行
-    head_cut = head.rfind("\n")
-    if head_cut > head_budget * 0.5:
-        head = head[:head_cut]
 
-    tail_cut = tail.find("\n")
-    if tail_cut > 0 and tail_cut < tail_budget * 0.3:
-        tail = tail[tail_cut + 1:]
+def compress_text(text: str, budget: int) -> str:
+    """结构化压缩到 budget 字符以内（不含状态栏）"""
+    segments = segment_output(text)
+    target = budget
+    for _ in range(3):
+        allowed = _allocate(segments, target)
+        result = "\n".join(line for i, seg in enumerate(segments) for line in _fit(seg, allowed[i]))
+        if len(result) <= budget:
+            return result
+        # 折叠提示行占了额外字符：收紧预算重新分配
+        target -= len(result) - budget
+    # 仍超出时在行边界兜底截断
+    cut = result.rfind("\n", 0, budget)
+    return result[:cut if cut > 0 else budget]
 
-    omitted = len(text) - len(head) - len(tail)
-    lines.append("")
-    lines.append(head)
-    lines.append(f"\n... 省略 {omitted} 字符，/detail 查看完整输出 ...\n")
-    lines.append(tail)
 
-    return "\n".join(lines)
+def segment_output(text: str) -> list[_Segment]:
+    """单遍扫描切分片段，同时合并连续重复行与多余空行"""
+    segments: list[_Segment] = []
+    seen_prose: set[str] = set()
+    in_fence = ""
+    kind = ""
+    prev = None
+    repeat = 0
+
+    def emit(k: str, line: str):
+        if not segments or segments[-1].kind != k:
+            segments.append(_Segment(k))
+        segments[-1].lines.append(line)
+
+    def flush_repeat():
+        nonlocal repeat
+        if repeat:
+            segments[-1].lines[-1] += f"  (重复 {repeat + 1} 次)"
+            repeat = 0
+
+    for raw in text.split("\n"):
+        line = raw.rstrip()
+
+        # 代码块：围栏内原样保留
+        if in_fence:
+            emit("code", line)
+            if line.lstrip().startswith(in_fence):
+                in_fence = ""
+            prev = None
+            continue
+        fence = _FENCE_RE.match(line)
+        if fence:
+            flush_repeat()
+            in_fence = fence.group(1)
+            segments.append(_Segment("code", [line]))
+            prev = None
+            continue
+
+        # 连续重复行 / 空行合并
+        if line == prev and kind != "diff":
+            if line:
+                repeat += 1
+            continue
+        flush_repeat()
+        prev = line
+
+        if kind == "diff" and _DIFF_LINE_RE.match(line):
+            pass
+        elif kind == "trace" and line and _TRACE_LINE_RE.match(line):
+            pass
+        elif _DIFF_START_RE.match(line):
+            kind = "diff"
+        elif _TRACE_START_RE.match(line):
+            kind = "trace"
+        elif _FILE_ITEM_RE.match(line):
+            kind = "files"
+        elif kind == "files" and line.startswith(("  ", "\t")) and line.strip():
+            pass  # 文件列表项的续行
+        else:
+            kind = "prose"
+            if len(line) >= DEDUPE_MIN_LEN:
+                if line in seen_prose:
+                    prev = None
+                    continue
+                seen_prose.add(line)
+        emit(kind, line)
+
+    flush_repeat()
+    return segments
+
+
+def _allocate(segments: list[_Segment], budget: int) -> list[int]:
+    """两级预算分配：先在类别间，再在同类片段间（小片段优先完整保留）"""
+    need: dict[str, int] = {}
+    for seg in segments:
+        need[seg.kind] = need.get(seg.kind, 0) + seg.size
+
+    # 类别保底份额，剩余按优先级补给仍不够的类别
+    class_budget = {k: min(n, int(budget * CLASS_SHARES[k])) for k, n in need.items()}
+    spare = budget - sum(class_budget.values())
+    for k in CLASS_PRIORITY:
+        if spare <= 0:
+            break
+        if k in need:
+            extra = min(need[k] - class_budget[k], spare)
+            class_budget[k] += extra
+            spare -= extra
+
+    # 同类片段间注水分配：按需求从小到大，每段取 min(需求, 剩余平均)
+    allowed = [0] * len(segments)
+    for k, total in class_budget.items():
+        idx = sorted((i for i, s in enumerate(segments) if s.kind == k), key=lambda i: segments[i].size)
+        left = total
+        for n, i in enumerate(idx):
+            share = min(segments[i].size, left // (len(idx) - n))
+            allowed[i] = share
+            left -= share
+    return allowed
+
+
+def _fit(seg: _Segment, limit: int) -> list[str]:
+    """把片段截断到 limit 字符以内，按类别保留最关键的部分"""
+    if seg.size <= limit:
+        return seg.lines
+    if limit < MIN_SEGMENT_CHARS:
+        return [f"… 省略{CLASS_LABELS[seg.kind]} {len(seg.lines)} 行 …"]
+    if seg.kind == "code":
+        return _fit_code(seg.lines, limit)
+    if seg.kind == "trace":
+        return _fit_tail(seg.lines, limit, keep_head=1)
+    if seg.kind == "diff":
+        return _fit_diff(seg.lines, limit)
+    if seg.kind == "files":
+        return _fit_head(seg.lines, limit, "项")
+    return _fit_prose(seg.lines, limit)
+
+
+def _take(lines, limit: int) -> list[str]:
+    """按顺序取行，直到超出 limit"""
+    out, used = [], 0
+    for line in lines:
+        if used + len(line) + 1 > limit:
+            break
+        out.append(line)
+        used += len(line) + 1
+    return out
+
+
+def _fit_head(lines: list[str], limit: int, unit: str = "行") -> list[str]:
+    head = _take(lines, limit - 20)
+    return head + [f"… 另有 {len(lines) - len(head)} {unit}"]
+
+
+def _fit_tail(lines: list[str], limit: int, keep_head: int = 0) -> list[str]:
+    """保留开头 keep_head 行 + 尽可能多的末尾行（错误信息通常在最后）"""
+    head = lines[:keep_head]
+    rest = limit - sum(len(line) + 1 for line in head) - 20
+    tail = list(reversed(_take(reversed(lines[keep_head:]), rest)))
+    omitted = len(lines) - len(head) - len(tail)
+    return head + [f"  … 省略 {omitted} 行 …"] + tail
+
+
+def _fit_code(lines: list[str], limit: int) -> list[str]:
+    """保留开闭围栏，中间按头部优先截取"""
+    opening = lines[0]
+    closing = lines[-1] if len(lines) > 1 and _FENCE_RE.match(lines[-1]) else ""
+    body = lines[1:-1] if closing else lines[1:]
+    rest = limit - len(opening) - len(closing) - 30
+    head = _take(body, rest)
+    out = [opening] + head + [f"… 省略 {len(body) - len(head)} 行 …"]
+    if closing:
+        out.append(closing)
+    return out
+
+
+def _fit_diff(lines: list[str], limit: int) -> list[str]:
+    """按 hunk 顺序保留：放得下整个 hunk 就整段保留，否则只留 @@ 行和改动行；
+    预算用完后其余 hunk 省略，但每个文件的 diff --git 头仍保留"""
+    hunks: list[list[str]] = []
+    for line in lines:
+        if not hunks or line.startswith(("diff --git ", "@@ ")):
+            hunks.append([])
+        hunks[-1].append(line)
+
+    out, used, skipped = [], 30, 0
+    exhausted = False
+    for hunk in hunks:
+        candidates = () if exhausted else (hunk, [l for l in hunk if not l.startswith((" ", "\\"))])
+        for option in candidates:
+            cost = sum(len(l) + 1 for l in option)
+            if used + cost <= limit:
+                if skipped:
+                    out.append(f"  … 省略 {skipped} 行 …")
+                    skipped = 0
+                out.extend(option)
+                skipped += len(hunk) - len(option)
+                used += cost
+                break
+        else:
+            exhausted = True
+            head = hunk[0]
+            if head.startswith("diff --git ") and used + len(head) + 1 <= limit:
+                if skipped:
+                    out.append(f"  … 省略 {skipped} 行 …")
+                    skipped = 0
+                out.append(head)
+                used += len(head) + 1
+                skipped += len(hunk) - 1
+            else:
+                skipped += len(hunk)
+    if skipped:
+        out.append(f"  … 省略 {skipped} 行 …")
+    return out
+
+
+def _fit_prose(lines: list[str], limit: int) -> list[str]:
+    """正文保留开头和结尾（结论通常在两端）"""
+    head = _take(lines, int(limit * 0.6))
+    rest = limit - sum(len(line) + 1 for line in head) - 20
+    tail = list(reversed(_take(reversed(lines[len(head):]), rest)))
+    omitted = len(lines) - len(head) - len(tail)
+    if not omitted:
+        return head + tail
+    return head + [f"… 省略 {omitted} 行 …"] + tail
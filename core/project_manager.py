@@ -1,14 +1,105 @@
 """项目管理器 — 管理项目注册表（data/projects.yaml）"""
 
 import asyncio
+import codecs
 import logging
 import os
+import shutil
+import signal
+import time
+from dataclasses import asdict, dataclass, field
 from datetime import datetime
 
 import yaml
 
 logger = logging.getLogger(__name__)
 
+# 克隆进度回调的间隔（秒）；几秒内完成的克隆不推送进度，避免刷屏
+PROGRESS_INTERVAL = 10
+
+# 超时返回码（同 timeout(1) 和 GitOps）
+TIMEOUT_RETURNCODE = 124
+
+
+@dataclass
+class CloneOptions:
+    """克隆方式：浅克隆深度、部分克隆 filter、稀疏检出路径"""
+    depth: int = 0                                    # 0 为完整历史
+    filter: str = ""                                  # 如 blob:none（blobless）、tree:0
+    sparse: list[str] = field(default_factory=list)   # 稀疏检出的目录
+
+    def __bool__(self):
+        return bool(self.depth or self.filter or self.sparse)
+
+    def git_args(self) -> list[str]:
+        """git clone 的对应参数（稀疏检出在克隆后 sparse-checkout set）"""
+        args = []
+        if self.depth:
+            args += ["--depth", str(self.depth)]
+        if self.filter:
+            args.append(f"--filter={self.filter}")
+        if self.sparse:
+            args.append("--sparse")
+        return args
+
+    def fetch_args(self) -> list[str]:
+        """后续 fetch 沿用同样的深度，避免把完整历史拉回来
+
+        不传 --filter：克隆时 git 已记下 remote.<name>.partialclonefilter，之后的 fetch 自动沿用；
+        而 fetch --all 带 --filter 在有多个 remote（如 fork 加了 upstream）时直接报错。
+        """
+        return [f"--depth={self.depth}"] if self.depth else []
+
+    def to_dict(self) -> dict:
+        return {k: v for k, v in asdict(self).items() if v}
+
+    @classmethod
+    def from_dict(cls, data: dict | None) -> "CloneOptions":
+        data = data or {}
+        return cls(int(data.get("depth", 0) or 0), data.get("filter", ""), list(data.get("sparse", [])))
+
+    def describe(self) -> str:
+        parts = []
+        if self.depth:
+            parts.append(f"浅克隆 depth={self.depth}")
+        if self.filter:
+            parts.append("blobless" if self.filter == "blob:none" else f"filter={self.filter}")
+        if self.sparse:
+            parts.append(f"稀疏检出 {', '.join(self.sparse)}")
+        return "，".join(parts) or "完整克隆"
+
+    def apply_flags(self, tokens: list[str]) -> list[str]:
+        """解析 /clone 的参数，就地覆盖默认值，返回剩余的位置参数
+
+        支持 --depth N、--blobless、--filter=<spec>、--sparse a,b、--full（忽略配置默认值）。
+        参数错误时抛 ValueError。
+        """
+        positional = []
+        it = iter(tokens)
+        for token in it:
+            if token == "--full":
+                self.depth, self.filter, self.sparse = 0, "", []
+            elif token == "--depth" or token.startswith("--depth="):
+                value = token.split("=", 1)[1] if "=" in token else next(it, "")
+                if not value.isdigit() or int(value) < 1:
+                    raise ValueError(f"--depth 需要正整数: {value or '(缺失)'}")
+                self.depth = int(value)
+            elif token == "--blobless":
+                self.filter = "blob:none"
+            elif token.startswith("--filter="):
+                self.filter = token.split("=", 1)[1]
+            elif token == "--sparse" or token.startswith("--sparse="):
+                value = token.split("=", 1)[1] if "=" in token else next(it, "")
+                paths = [p.strip().strip("/") for p in value.split(",") if p.strip().strip("/")]
+                if not paths:
+                    raise ValueError("--sparse 需要目录列表，如 --sparse src,docs")
+                self.sparse = paths
+            elif token.startswith("--"):
+                raise ValueError(f"未知参数: {token}")
+            else:
+                positional.append(token)
+        return positional
+
 
 class ProjectManager:
     def __init__(self, config: dict):
@@ -17,6 +108,12 @@ class ProjectManager:
         self.init_git_on_create = config.get("init_git_on_create", True)
         self.create_github_repo = config.get("create_github_repo", True)
         self.github_private = config.get("github_private", True)
+        # /clone 不带参数时的默认克隆方式（0 / 空表示完整克隆）
+        self.clone_depth = config.get("clone_depth", 0)
+        self.clone_filter = config.get("clone_filter", "")
+        self.clone_sparse = config.get("clone_sparse", []) or []
+        # 整个克隆的超时（秒），远端卡住时终止，不让 /clone 永远挂着
+        self.clone_timeout = config.get("clone_timeout", 900)
         self.projects: dict[str, dict] = {}
         self._load()
 
@@ -124,15 +221,29 @@ class ProjectManager:
         repo_url = stdout.strip()
         return f"GitHub 仓库已创建: {repo_url}"
 
-    async def clone_project(self, repo: str, name: str = "") -> str:
-        """从 GitHub 克隆仓库到 workspace_root 并注册为项目"""
-        # 先检查 gh 是否可用
-        try:
-            _, stderr, code = await _run_cmd("gh", "auth", "status")
-            if code != 0:
-                return "❌ gh 未登录，请先运行: gh auth login"
-        except FileNotFoundError:
-            return "❌ gh CLI 未安装\n安装: https://cli.github.com/"
+    def clone_defaults(self) -> CloneOptions:
+        """配置里的默认克隆方式（projects.clone_depth / clone_filter / clone_sparse）"""
+        return CloneOptions(self.clone_depth, self.clone_filter, list(self.clone_sparse))
+
+    async def clone_project(self, repo: str, name: str = "", options: CloneOptions = None,
+                            progress=None) -> str:
+        """克隆仓库到 workspace_root 并注册为项目
+
+        owner/repo 简写走 gh repo clone；URL、本地路径直接用 git clone。
+        options 指定浅克隆 / 部分克隆 / 稀疏检出，注册时一并记录，后台 fetch 沿用同样的 filter。
+        progress 为 async 回调，收到 git 的进度行（如 "Receiving objects: 45% (…)"），已节流。
+        """
+        options = options or self.clone_defaults()
+        use_gh = not _is_url_or_path(repo)
+        repo = os.path.expanduser(repo)
+        if use_gh:
+            # 先检查 gh 是否可用
+            try:
+                _, stderr, code = await _run_cmd("gh", "auth", "status")
+                if code != 0:
+                    return "❌ gh 未登录，请先运行: gh auth login"
+            except FileNotFoundError:
+                return "❌ gh CLI 未安装\n安装: https://cli.github.com/"
 
         # 推断项目名：用户指定 > repo 最后一段
         if not name:
@@ -149,21 +260,36 @@ class ProjectManager:
             return (f"目录已存在: {target_path}\n"
                     f"用 /addproject {name} {target_path} 注册它")
 
-        # gh repo clone 支持 owner/repo 简写和完整 URL
-        stdout, stderr, code = await _run_cmd(
-            "gh", "repo", "clone", repo, target_path,
-        )
+        # --progress：stderr 不是终端时 git 默认不输出进度
+        git_args = ["--progress", *options.git_args()]
+        if use_gh:
+            # gh repo clone 把 -- 之后的参数原样交给 git clone
+            args = ["gh", "repo", "clone", repo, target_path, "--", *git_args]
+        else:
+            args = ["git", "clone", *git_args, repo, target_path]
+        stderr, code = await _run_streamed(*args, progress=progress, timeout=self.clone_timeout)
+        if code == TIMEOUT_RETURNCODE:
+            # 进程被 SIGKILL，git 来不及清理半成品目录
+            shutil.rmtree(target_path, ignore_errors=True)
         if code != 0:
             return f"❌ 克隆失败: {stderr.strip()}"
 
+        if options.sparse:
+            _, stderr, code = await _run_cmd("git", "-C", target_path, "sparse-checkout", "set", *options.sparse)
+            if code != 0:
+                return f"❌ 稀疏检出设置失败: {stderr.strip()}\n仓库已克隆到 {target_path}，未注册"
+
         self.projects[name] = {
             "path": target_path,
             "description": f"cloned from {repo}",
             "created_at": datetime.now().isoformat(),
         }
+        if options:
+            self.projects[name]["clone"] = options.to_dict()
         self._save()
 
-        return f"✅ 已克隆并注册: {name}\n路径: {target_path}"
+        mode = f"\n方式: {options.describe()}" if options else ""
+        return f"✅ 已克隆并注册: {name}\n路径: {target_path}{mode}"
 
     async def list_github_repos(self, limit: int = 20) -> str:
         """列出自己 GitHub 上的仓库（含 star 数和描述）"""
@@ -221,3 +347,70 @@ async def _run_cmd(*args) -> tuple[str, str, int]:
         stderr.decode("utf-8", errors="replace"),
         proc.returncode,
     )
+
+
+def _is_url_or_path(repo: str) -> bool:
+    """URL / scp 式地址 / 本地路径（不走 gh，直接 git clone）"""
+    return "://" in repo or repo.startswith(("git@", "/", "~", ".")) or os.path.isdir(repo)
+
+
+async def _run_streamed(*args, progress=None, timeout: float = None) -> tuple[str, int]:
+    """执行命令并逐段读取 stderr，把 git 的进度行节流后交给 progress 回调
+
+    git 用回车符刷新同一行进度，这里按回车 / 换行切分成行，
+    每 PROGRESS_INTERVAL 秒把最新的进度行（如 "Receiving objects: 45% (…)"）回调一次。
+    stderr 用增量解码器解码，跨块截断的多字节字符不会变成乱码。
+    超过 timeout 秒（远端卡住）时杀掉整个进程组，返回码为 TIMEOUT_RETURNCODE。
+    返回 (stderr 中的非进度输出, returncode)。
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+        stdin=asyncio.subprocess.DEVNULL,
+        env={**os.environ, "GIT_TERMINAL_PROMPT": "0"},
+        start_new_session=True,
+    )
+    messages: list[str] = []
+    last_sent = time.monotonic()
+
+    async def handle(line: str):
+        nonlocal last_sent
+        line = line.strip()
+        if not line:
+            return
+        if "%" not in line or ":" not in line:
+            messages.append(line)
+            return
+        now = time.monotonic()
+        if progress and now - last_sent >= PROGRESS_INTERVAL:
+            last_sent = now
+            try:
+                await progress(line)
+            except Exception as e:
+                logger.warning(f"克隆进度回调失败: {e}")
+
+    async def pump():
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        buffer = ""
+        while chunk := await proc.stderr.read(4096):
+            buffer += decoder.decode(chunk)
+            *lines, buffer = buffer.replace("\r", "\n").split("\n")
+            for line in lines:
+                await handle(line)
+        await handle(buffer + decoder.decode(b"", final=True))
+        await proc.wait()
+
+    try:
+        await asyncio.wait_for(pump(), timeout)
+    except asyncio.TimeoutError:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        await proc.wait()
+        logger.warning(f"{' '.join(args[:3])} 超时（{timeout}s），已终止")
+        messages.append(f"超时（{timeout}s），已终止")
+        return "\n".join(messages[-30:]), TIMEOUT_RETURNCODE
+    # 只保留最后几十行，失败信息在末尾
+    return "\n".join(messages[-30:]), proc.returncode
@@ -0,0 +1,65 @@
+"""仓库级读写锁 — 同一仓库的写操作互斥，只读操作可并发
+
+commit / pull / push / 切分支等会改 index 或引用的操作取独占锁，
+status / diff / log 等只读查询取共享锁。等待和持有时间写日志，
+等待过久时升为 info 级别，便于排查「/commit 卡住」之类的问题。
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+# 等待超过此秒数时用 info 级别记录
+SLOW_WAIT_SECONDS = 1.0
+
+
+class RepoLock:
+    """asyncio 读写锁（写优先：有写者排队时新的读者等待，避免写者饿死）"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._cond = asyncio.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @asynccontextmanager
+    async def shared(self, label: str = ""):
+        start = time.monotonic()
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self._writer and not self._waiting_writers)
+            self._readers += 1
+        acquired = time.monotonic()
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._readers -= 1
+                self._cond.notify_all()
+            self._log("共享", label, acquired - start, time.monotonic() - acquired)
+
+    @asynccontextmanager
+    async def exclusive(self, label: str = ""):
+        start = time.monotonic()
+        async with self._cond:
+            self._waiting_writers += 1
+            try:
+                await self._cond.wait_for(lambda: not self._writer and not self._readers)
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+        acquired = time.monotonic()
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+            self._log("独占", label, acquired - start, time.monotonic() - acquired)
+
+    def _log(self, mode: str, label: str, waited: float, held: float):
+        level = logging.INFO if waited >= SLOW_WAIT_SECONDS else logging.DEBUG
+        logger.log(level, f"git 锁[{mode}] {self.name} {label}: 等待 {waited * 1000:.0f}ms, 持有 {held * 1000:.0f}ms")
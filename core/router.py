@@ -1,6 +1,8 @@
 """命令路由 — 区分元命令和 Claude Code 指令"""
 
+import asyncio
 import logging
+import time
 
 from adapters.base import BotAdapter, IncomingMessage, OutgoingMessage
 from core.executor import ClaudeExecutor
@@ -10,9 +12,13 @@ from core.git_ops import GitOps
 from core.file_manager import FileManager
 from memory.store import ProjectMemoryManager
 from memory.injector import ContextInjector
+from memory.compactor import MemoryCompactor
 
 logger = logging.getLogger(__name__)
 
+# /detail 每页字符数（适配器再按平台长度分段发送）
+DETAIL_PAGE_CHARS = 8000
+
 
 class Router:
     def __init__(
@@ -30,9 +36,11 @@ class Router:
         self.project_mgr = project_mgr
         self.memory_mgr = memory_mgr
         self.injector = ContextInjector(injector_config)
+        self.compactor = MemoryCompactor(memory_mgr, project_mgr, injector_config)
         self.git = git_ops
         self.file_mgr = file_mgr
         self._last_full_output: dict[str, str] = {}  # chat_id -> 完整输出
+        self._limit_warned: dict[str, str] = {}  # chat_id → 已提醒过超限的 Claude 会话 ID
 
     async def handle(self, msg: IncomingMessage, adapter: BotAdapter):
         """路由入口：命令走元命令，普通文本先尝试语义匹配，最后走 Claude Code"""
@@ -57,6 +65,7 @@ class Router:
                 await adapter.send_message(OutgoingMessage(
                     chat_id=msg.chat_id,
                     text=f"处理出错: {e}",
+                    parse_mode="",
                 ))
             except Exception:
                 pass
@@ -181,6 +190,7 @@ class Router:
             # 会话管理
             "/status": self._cmd_status,
             "/new": self._cmd_new,
+            "/sessions": self._cmd_sessions,
             "/model": self._cmd_model,
             "/abort": self._cmd_abort,
             "/help": self._cmd_help,
@@ -195,9 +205,11 @@ class Router:
             "/branch": self._cmd_branch,
             "/log": self._cmd_log,
             "/gs": self._cmd_gs,
+            "/undo": self._cmd_undo,
             # 文件
             "/cat": self._cmd_cat,
             "/tree": self._cmd_tree,
+            "/grep": self._cmd_grep,
             # 记忆系统
             "/memory": self._cmd_memory,
             "/search": self._cmd_search,
@@ -238,19 +250,24 @@ class Router:
     async def _cmd_cd(self, msg: IncomingMessage, adapter: BotAdapter, arg: str):
         """切换项目"""
         if not arg:
-            await self._reply(adapter, msg.chat_id, "用法: /cd <项目名>")
+            await self._reply(adapter, msg.chat_id, "用法: /cd <项目名> [会话名]")
             return
 
-        proj = self.project_mgr.get_project(arg)
+        parts = arg.split(maxsplit=1)
+        name = parts[0]
+        slot_name = parts[1].strip() if len(parts) > 1 else ""
+        proj = self.project_mgr.get_project(name)
         if not proj:
             available = ", ".join(self.project_mgr.list_projects().keys())
             await self._reply(adapter, msg.chat_id,
-                f"项目 '{arg}' 不存在\n可用项目: {available or '无'}")
+                f"项目 '{name}' 不存在\n可用项目: {available or '无'}")
             return
 
-        self.session_mgr.set_project(msg.chat_id, arg, proj["path"])
+        resumed = self.session_mgr.set_project(msg.chat_id, name, proj["path"], slot_name)
+        label = f"{name} #{slot_name}" if slot_name else name
         await self._reply(adapter, msg.chat_id,
-            f"已切换到: {arg}\n路径: {proj['path']}")
+            f"已切换到: {label}\n路径: {proj['path']}\n"
+            f"{'续接上次会话' if resumed else '新会话'}")
 
     async def _cmd_addproject(self, msg: IncomingMessage, adapter: BotAdapter, arg: str):
         """注册已有目录为项目"""
@@ -285,19 +302,33 @@ class Router:
             self.session_mgr.set_project(msg.chat_id, name, proj["path"])
 
     async def _cmd_clone(self, msg: IncomingMessage, adapter: BotAdapter, arg: str):
-        """从 GitHub 克隆仓库"""
-        parts = arg.split(maxsplit=1)
-        if not parts:
+        """克隆仓库（可选浅克隆 / blobless / 稀疏检出），进度分阶段推送"""
+        options = self.project_mgr.clone_defaults()
+        try:
+            parts = options.apply_flags(arg.split())
+        except ValueError as e:
+            await self._reply(adapter, msg.chat_id, f"❌ {e}")
+            return
+        if not parts or len(parts) > 2:
             await self._reply(adapter, msg.chat_id,
-                "用法: /clone <owner/repo> [本地名称]\n"
-                "示例: /clone dapingzui/myapp\n"
+                "用法: /clone <owner/repo|URL> [本地名称] [选项]\n"
+                "选项: --depth N  浅克隆\n"
+                "      --blobless  只按需下载文件内容（--filter=blob:none）\n"
+                "      --sparse a,b  只检出指定目录\n"
+                "      --full  忽略配置的默认方式，完整克隆\n"
+                "示例: /clone dapingzui/myapp --depth 1 --blobless\n"
                 "查看你的仓库: /repos")
             return
 
         repo = parts[0]
         local_name = parts[1] if len(parts) > 1 else ""
-        await self._reply(adapter, msg.chat_id, f"⏳ 正在克隆 {repo}...")
-        result = await self.project_mgr.clone_project(repo, local_name)
+        mode = f"（{options.describe()}）" if options else ""
+        await self._reply(adapter, msg.chat_id, f"⏳ 正在克隆 {repo}{mode}...")
+
+        async def progress(line: str):
+            await self._reply(adapter, msg.chat_id, f"⏳ {line}")
+
+        result = await self.project_mgr.clone_project(repo, local_name, options, progress=progress)
         await self._reply(adapter, msg.chat_id, result)
 
         # 自动切换到克隆的项目
@@ -331,19 +362,54 @@ class Router:
         session = self.session_mgr.get_session(msg.chat_id)
         lines = [
             "当前状态:\n",
-            f"  项目: {session.current_project or '未选择'}",
+            f"  项目: {session.current_project or '未选择'}"
+            + (f" #{session.slot_name}" if session.slot_name else ""),
             f"  路径: {session.current_project_path or 'N/A'}",
             f"  会话: {'有历史' if session.has_history else '新会话'}",
             f"  模型: {session.model or '默认'}",
         ]
+        if session.current_project_path:
+            git_summary = await self.git.summary(session.current_project_path)
+            if git_summary:
+                lines.append(f"  Git: {git_summary}")
+            stats = self.git.cache_stats()
+            if stats["hits"] + stats["misses"]:
+                lines.append(f"  Git 缓存: 命中率 {stats['hit_rate']:.0%}（{stats['hits']}/{stats['hits'] + stats['misses']}）")
         if session.claude_session_id:
             lines.append(f"  会话ID: {session.claude_session_id[:16]}...")
+            trend = f"，最近一轮是之前平均的 {session.duration_trend:.1f} 倍" if session.duration_trend else ""
+            lines.append(
+                f"  会话长度: {session.turns} 轮，${session.total_cost:.4f}，"
+                f"{session.total_duration_ms / 1000:.0f}s{trend}"
+            )
         await self._reply(adapter, msg.chat_id, "\n".join(lines))
 
     async def _cmd_new(self, msg: IncomingMessage, adapter: BotAdapter, arg: str):
-        """新建 Claude Code 会话"""
-        self.session_mgr.new_session(msg.chat_id)
-        await self._reply(adapter, msg.chat_id, "已新建会话（项目不变）")
+        """新建 Claude Code 会话；/new <名称> 另开命名会话，原会话保留可切回"""
+        self.session_mgr.new_session(msg.chat_id, arg or None)
+        self._limit_warned.pop(msg.chat_id, None)
+        if arg:
+            await self._reply(adapter, msg.chat_id,
+                f"已新建会话 #{arg}（项目不变），原会话已保留，/sessions 查看")
+        else:
+            await self._reply(adapter, msg.chat_id, "已新建会话（项目不变）")
+
+    async def _cmd_sessions(self, msg: IncomingMessage, adapter: BotAdapter, arg: str):
+        """列出保存的会话槽（最近使用的在前）"""
+        session = self.session_mgr.get_session(msg.chat_id)
+        slots = self.session_mgr.list_slots(msg.chat_id)
+        if not slots:
+            await self._reply(adapter, msg.chat_id, "暂无保存的会话")
+            return
+        lines = [f"保存的会话（最多 {self.session_mgr.max_slots} 个）:\n"]
+        for project, slot_name, slot in slots:
+            current = (project, slot_name) == (session.current_project, session.slot_name)
+            marker = "→" if current else "  "
+            label = f"{project} #{slot_name}" if slot_name else project
+            when = time.strftime("%m-%d %H:%M", time.localtime(slot.last_used))
+            lines.append(f"{marker} {label}  ({when})")
+        lines.append("\n切换: /cd <项目> [会话名]")
+        await self._reply(adapter, msg.chat_id, "\n".join(lines))
 
     async def _cmd_model(self, msg: IncomingMessage, adapter: BotAdapter, arg: str):
         """切换模型"""
@@ -366,7 +432,7 @@ class Router:
             "haiku": "claude-haiku-4-5-20251001",
         }
         model_id = aliases.get(arg.lower(), arg)
-        session.model = model_id
+        self.session_mgr.set_model(msg.chat_id, model_id)
         await self._reply(adapter, msg.chat_id, f"模型已切换: {model_id}")
 
     async def _cmd_abort(self, msg: IncomingMessage, adapter: BotAdapter, arg: str):
@@ -391,14 +457,43 @@ class Router:
     # ========== 输出查看命令 ==========
 
     async def _cmd_detail(self, msg: IncomingMessage, adapter: BotAdapter, arg: str):
-        """查看上次完整输出"""
-        full = self._last_full_output.get(msg.chat_id, "")
+        """查看完整输出：无参数为上次运行，/detail <id> 为历史记录（0 为上次运行），可加页码"""
+        parts = arg.split()
+        if len(parts) > 2 or not all(p.lstrip("#").isdigit() for p in parts):
+            await self._reply(adapter, msg.chat_id,
+                "用法: /detail [记录ID] [页码]（ID 见 /memory、/search，0 为上次运行）")
+            return
+        entry_id = int(parts[0].lstrip("#")) if parts else 0
+        page = max(int(parts[1].lstrip("#")), 1) if len(parts) > 1 else 1
+        if entry_id:
+            cwd = await self._require_project(adapter, msg.chat_id)
+            if not cwd:
+                return
+            full = await asyncio.to_thread(self.memory_mgr.get_store(cwd).get_output, entry_id)
+            if full is None:
+                await self._reply(adapter, msg.chat_id, f"记录 #{entry_id} 不存在或没有归档的完整输出")
+                return
+        else:
+            full = self._last_full_output.get(msg.chat_id, "")
+            session = self.session_mgr.get_session(msg.chat_id)
+            if not full and session.current_project_path:
+                # 重启后内存里没有，取本项目最近一次归档的输出
+                store = self.memory_mgr.get_store(session.current_project_path)
+                full = await asyncio.to_thread(store.get_output, 0, session.current_project or "default")
         if not full:
             await self._reply(adapter, msg.chat_id, "没有可查看的输出")
             return
-        await self._reply(adapter, msg.chat_id, full[:4000])
-        if len(full) > 4000:
-            await self._reply(adapter, msg.chat_id, full[4000:8000])
+        pages = -(-len(full) // DETAIL_PAGE_CHARS)
+        if page > pages:
+            await self._reply(adapter, msg.chat_id, f"只有 {pages} 页")
+            return
+        text = full[(page - 1) * DETAIL_PAGE_CHARS:page * DETAIL_PAGE_CHARS]
+        if pages > 1:
+            text += f"\n\n— 第 {page}/{pages} 页"
+            if page < pages:
+                text += f"，下一页: /detail {entry_id} {page + 1}"
+        # 适配器按渲染后的长度自动分段
+        await self._reply(adapter, msg.chat_id, text, markdown=True)
 
     # ========== Claude Code 执行 ==========
 
@@ -425,10 +520,19 @@ class Router:
         store = self.memory_mgr.get_store(cwd)
 
         # 新会话第一条消息注入记忆上下文，续接会话不注入（避免浪费 token）
+        estimate = 0
         if session.has_history:
             prompt = text
         else:
-            prompt = self.injector.build_augmented_prompt(store, project_label, text)
+            info = self.project_mgr.get_project(project_label) or {}
+            # 检索与向量补齐会读库、算 embedding，放到线程里，不阻塞事件循环
+            prompt, estimate = await asyncio.to_thread(
+                self.injector.build_augmented_prompt,
+                store, project_label, text, description=info.get("description", ""),
+            )
+
+        # 执行前快照工作区，改坏了可 /undo 一步回滚
+        checkpoint = await self.git.checkpoint(cwd, label=text)
 
         # 调用 Claude Code
         result = await self.executor.run(
@@ -439,13 +543,24 @@ class Router:
             model=session.model,
         )
 
-        # 保存状态
+        if not session.has_history and result.input_tokens:
+            # 校准 token 估算：实际值还包含 Claude Code 自身的系统提示与工具定义
+            logger.debug(
+                f"prompt token 估算 {estimate}，"
+                f"实际输入 {result.input_tokens}（含系统提示）"
+            )
+
+        # 保存状态（Claude 可能改了工作区，git 状态缓存作废）
+        self.git.invalidate(cwd)
         self._last_full_output[msg.chat_id] = result.full_output
-        self.session_mgr.update_claude_session(msg.chat_id, result.session_id)
+        self.session_mgr.update_claude_session(
+            msg.chat_id, result.session_id, cost_usd=result.cost_usd, duration_ms=result.duration_ms,
+        )
 
         # 保存记忆（每次都存）
         try:
-            store.save_entry(
+            await asyncio.to_thread(
+                store.save_entry,
                 project=project_label,
                 user_msg=text,
                 summary=result.summary,
@@ -453,13 +568,45 @@ class Router:
                 session_id=result.session_id,
                 cost_usd=result.cost_usd,
                 model=session.model,
+                full_output=result.full_output,
             )
         except Exception as e:
             logger.warning(f"保存记忆失败: {e}")
 
         # 返回结果
         reply = result.formatted_output or "（无输出）"
-        await self._reply(adapter, msg.chat_id, reply)
+        if checkpoint and result.files_changed:
+            reply += f"\n\n↩️ 回滚本轮改动: /undo {checkpoint}"
+        await self._reply(adapter, msg.chat_id, reply, markdown=True)
+
+        await self._check_session_limits(msg.chat_id, adapter, store, project_label)
+
+    async def _check_session_limits(self, chat_id: str, adapter: BotAdapter, store, project: str):
+        """会话过长时汇总为记忆并开新会话（on_limit=digest），或提醒一次（on_limit=warn）"""
+        reason = self.session_mgr.check_limits(chat_id)
+        if not reason:
+            return
+        session = self.session_mgr.get_session(chat_id)
+        if self.session_mgr.on_limit != "digest":
+            if self._limit_warned.get(chat_id) != session.claude_session_id:
+                self._limit_warned[chat_id] = session.claude_session_id
+                await self._reply(adapter, chat_id,
+                    f"⚠️ 当前会话{reason}，每轮重放的上下文越来越长，建议 /new 开新会话")
+            return
+
+        try:
+            digest_id = await asyncio.to_thread(
+                store.save_session_digest, project, session.claude_session_id, session.turns)
+        except Exception as e:
+            logger.warning(f"会话汇总失败: {e}")
+            return
+        turns = session.turns
+        self.session_mgr.new_session(chat_id)
+        self._limit_warned.pop(chat_id, None)
+        logger.info(f"[{chat_id}] 会话{reason}，已汇总为 #{digest_id} 并开新会话")
+        await self._reply(adapter, chat_id,
+            f"♻️ 当前会话{reason}，已把这 {turns} 轮汇总为记忆 #{digest_id} 并开启新会话，"
+            "下条消息会自动带上项目背景")
 
     # ========== Git 命令 ==========
 
@@ -518,13 +665,62 @@ class Router:
         result = await self.git.log(cwd, count=arg)
         await self._reply(adapter, msg.chat_id, result)
 
+    async def _cmd_undo(self, msg: IncomingMessage, adapter: BotAdapter, arg: str):
+        """/undo [ID]：回滚到 Claude 执行前的检查点；/undo list：列出检查点"""
+        cwd = await self._require_project(adapter, msg.chat_id)
+        if not cwd:
+            return
+        if arg == "list":
+            result = await self.git.list_checkpoints(cwd)
+        else:
+            result = await self.git.undo(cwd, run=arg)
+        await self._reply(adapter, msg.chat_id, result)
+
     async def _cmd_gs(self, msg: IncomingMessage, adapter: BotAdapter, arg: str):
+        if arg == "all":
+            await self._gs_all(msg, adapter)
+            return
         cwd = await self._require_project(adapter, msg.chat_id)
         if not cwd:
             return
         result = await self.git.status(cwd)
         await self._reply(adapter, msg.chat_id, result)
 
+    async def _gs_all(self, msg: IncomingMessage, adapter: BotAdapter):
+        """/gs all：所有项目的分支、变更数、领先/落后，有变更的排在前面"""
+        projects = {name: info.get("path", "") for name, info in self.project_mgr.list_projects().items()}
+        if not projects:
+            await self._reply(adapter, msg.chat_id, "暂无项目")
+            return
+        start = time.monotonic()
+        results = await self.git.dashboard(projects)
+        elapsed = time.monotonic() - start
+
+        def order(item):
+            _, state, error = item
+            if error:
+                return 2
+            return 0 if state.dirty or state.ahead or state.behind else 1
+
+        width = min(max(len(name) for name in projects), 16)
+        rows = []
+        for name, state, error in sorted(results, key=lambda item: (order(item), item[0])):
+            label = name[:width].ljust(width)
+            if error:
+                rows.append(f"{label}  {error}")
+                continue
+            counts = " ".join(f"{mark}{n}" for mark, n in (
+                ("+", state.staged), ("~", state.modified), ("?", state.untracked)) if n) or "干净"
+            track = " ".join(f"{mark}{n}" for mark, n in (("↑", state.ahead), ("↓", state.behind)) if n)
+            rows.append(f"{label}  {state.branch[:14]:<14}  {counts}  {track}".rstrip())
+        dirty = sum(1 for _, state, _ in results if state and state.dirty)
+        text = (
+            f"项目 Git 状态（{len(results)} 个，{dirty} 个有未提交变更，{elapsed:.1f}s）\n"
+            "```\n" + "\n".join(rows) + "\n```\n"
+            "+ 已暂存  ~ 已修改  ? 未跟踪  ↑ 领先  ↓ 落后"
+        )
+        await self._reply(adapter, msg.chat_id, text, markdown=True)
+
     # ========== 文件命令 ==========
 
     async def _cmd_cat(self, msg: IncomingMessage, adapter: BotAdapter, arg: str):
@@ -541,6 +737,13 @@ class Router:
         result = await self.file_mgr.tree(cwd, arg)
         await self._reply(adapter, msg.chat_id, result)
 
+    async def _cmd_grep(self, msg: IncomingMessage, adapter: BotAdapter, arg: str):
+        cwd = await self._require_project(adapter, msg.chat_id)
+        if not cwd:
+            return
+        result = await self.file_mgr.grep(cwd, arg)
+        await self._reply(adapter, msg.chat_id, result)
+
     # ========== 记忆命令 ==========
 
     async def _cmd_memory(self, msg: IncomingMessage, adapter: BotAdapter, arg: str):
@@ -558,7 +761,21 @@ class Router:
             await self._reply(adapter, msg.chat_id,
                 f"记忆统计 [{project}]:\n"
                 f"  记录数: {stats['count']}\n"
-                f"  累计花费: ${stats['total_cost']}")
+                f"  累计花费: ${stats['total_cost']}\n"
+                f"  存储行数: {stats['rows']}（周汇总 {stats['digests']}，会话汇总 {stats['session_digests']}）\n"
+                f"  数据库大小: {stats['db_size'] / 1024:.1f}KB\n"
+                f"  完整输出: {stats['outputs']} 份，"
+                f"{stats['output_bytes'] / 1024:.1f}KB 压缩为 {stats['output_stored_bytes'] / 1024:.1f}KB\n"
+                f"  上次压缩: {stats['last_compaction'] or '从未'}")
+            return
+
+        if arg == "compact":
+            await self._reply(adapter, msg.chat_id, "⏳ 正在压缩记忆...")
+            # 手动压缩时允许旧库整库重写一次以开启增量 VACUUM（后台任务不做）
+            result = await self.compactor.compact(cwd, full_vacuum=True)
+            await self._reply(adapter, msg.chat_id,
+                f"压缩完成: 汇总 {result['rolled']} 条为 {result['digests']} 个周汇总，"
+                f"淘汰 {result['pruned']} 行")
             return
 
         # 默认：显示最近记录
@@ -572,17 +789,23 @@ class Router:
             time_str = e["time"][:16]
             task = e["task"][:60]
             summary = e["summary"][:80]
-            lines.append(f"[{time_str}] {task}")
+            lines.append(f"#{e['id']} [{time_str}] {task}")
             lines.append(f"  -> {summary}\n")
 
         lines.append("/memory stats — 查看统计")
+        lines.append("/memory compact — 压缩旧记录")
         lines.append("/search <关键词> — 搜索记忆")
+        lines.append("/detail <ID> [页码] — 查看某次运行的完整输出")
         await self._reply(adapter, msg.chat_id, "\n".join(lines))
 
     async def _cmd_search(self, msg: IncomingMessage, adapter: BotAdapter, arg: str):
-        """搜索记忆"""
+        """搜索记忆（-a 跨所有项目）"""
         if not arg:
-            await self._reply(adapter, msg.chat_id, "用法: /search <关键词>")
+            await self._reply(adapter, msg.chat_id, "用法: /search <关键词>\n跨项目: /search -a <关键词>")
+            return
+
+        if arg.startswith("-a ") or arg == "-a":
+            await self._search_all_projects(msg, adapter, arg[3:].strip())
             return
 
         cwd = await self._require_project(adapter, msg.chat_id)
@@ -593,57 +816,85 @@ class Router:
         project = session.current_project or ""
         store = self.memory_mgr.get_store(cwd)
 
-        results = store.search(arg, project=project, limit=10)
+        results = await asyncio.to_thread(store.search, arg, project=project, limit=10)
         if not results:
             await self._reply(adapter, msg.chat_id, f"未找到 '{arg}' 相关记录")
             return
 
         lines = [f"搜索 '{arg}' 结果:\n"]
         for r in results:
-            lines.append(f"[{r['time'][:16]}] {r['task'][:60]}")
-            lines.append(f"  -> {r['summary'][:80]}\n")
+            lines.append(f"#{r['id']} [{r['time'][:16]}] {r['task'][:60]}")
+            lines.append(f"  -> {r['snippet'][:120]}\n")
+
+        await self._reply(adapter, msg.chat_id, "\n".join(lines))
+
+    async def _search_all_projects(self, msg: IncomingMessage, adapter: BotAdapter, query: str):
+        """跨所有已注册项目搜索记忆"""
+        if not query:
+            await self._reply(adapter, msg.chat_id, "用法: /search -a <关键词>")
+            return
+
+        projects = {
+            name: info.get("path", "")
+            for name, info in self.project_mgr.list_projects().items()
+        }
+        results = await asyncio.to_thread(self.memory_mgr.search_all, projects, query, 10)
+        if not results:
+            await self._reply(adapter, msg.chat_id, f"所有项目中未找到 '{query}' 相关记录")
+            return
+
+        lines = [f"跨项目搜索 '{query}' 结果:\n"]
+        for r in results:
+            lines.append(f"[{r['project']}] [{r['time'][:16]}] {r['task'][:50]}")
+            lines.append(f"  -> {r['snippet'][:120]}\n")
 
         await self._reply(adapter, msg.chat_id, "\n".join(lines))
 
     # ========== 工具方法 ==========
 
-    async def _reply(self, adapter: BotAdapter, chat_id: str, text: str):
-        await adapter.send_message(OutgoingMessage(chat_id=chat_id, text=text))
+    async def _reply(self, adapter: BotAdapter, chat_id: str, text: str, markdown: bool = False):
+        """markdown=True 用于 Claude 的输出；命令结果（git、文件内容等）按纯文本发送"""
+        await adapter.send_message(OutgoingMessage(
+            chat_id=chat_id, text=text, parse_mode="Markdown" if markdown else "",
+        ))
 
 
 HELP_TEXT = """724code 命令列表:
 
 项目管理:
   /projects — 列出所有项目
-  /cd <名称> — 切换项目
+  /cd <名称> [会话名] — 切换项目（续接该项目上次的会话）
   /newproject <名称> — 新建项目（+GitHub）
-  /clone <owner/repo> — 从 GitHub 克隆
+  /clone <owner/repo> [--depth N] [--blobless] [--sparse a,b] — 克隆仓库
   /repos [数量] — 列出 GitHub 仓库
   /addproject <名称> <路径> — 注册已有目录
   /rmproject <名称> — 取消注册
 
 会话管理:
   /status — 当前状态
-  /new — 新建会话
+  /new [名称] — 新建会话（给名称则保留原会话）
+  /sessions — 保存的会话列表
   /model [sonnet|opus|haiku] — 切换模型
   /abort — 终止执行
 
 Git:
-  /diff [ref] — 查看变更
+  /diff [ref|文件|next] — 查看变更（按文件分页）
   /commit [消息] — 提交
   /push [分支] — 推送
   /pull — 拉取
   /branch [名称] — 分支管理
   /log [数量] — 提交记录
-  /gs — git status
+  /gs [all] — git status（all = 所有项目概览）
+  /undo [ID|list] — 回滚到 Claude 执行前的工作区
 
 文件:
-  /cat <文件> [行范围] — 查看文件
-  /tree [路径] [深度] — 目录结构
+  /cat <文件> [行范围|-N] — 查看文件（-N 为末尾 N 行）
+  /tree [路径] [深度] [-s] — 目录结构（-s 统计文件数和大小）
+  /grep [-i] <模式> [路径] — 搜索代码（正则）
 
 记忆:
-  /memory — 最近记录
-  /search <关键词> — 搜索记忆
-  /detail — 上次完整输出
+  /memory [stats|compact] — 最近记录 / 统计 / 压缩
+  /search [-a] <关键词> — 搜索记忆（-a 跨所有项目）
+  /detail [ID] [页码] — 上次 / 历史运行的完整输出
 
 直接发文本 = 发给 Claude Code 执行"""
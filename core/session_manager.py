@@ -1,13 +1,27 @@
-"""会话管理器 — 管理每个 chat 的项目、会话状态"""
+"""会话管理器 — 管理每个 chat 的项目、会话状态
+
+会话状态写穿（write-through）到一个小 SQLite 文件：每次变更立即落盘，
+服务重启后按 chat 懒加载（首次访问时才读库），--resume 可继续使用原 Claude 会话。
+db_path 为空时只保存在内存中（测试用）。
+
+每个 chat 另外保留最多 max_slots 个会话槽（按 项目 + 可选名称 区分，LRU 淘汰），
+/cd 切回某个项目时直接续接该项目上次的 Claude 会话，无需重新注入记忆。
+
+--resume 链越长，每轮要重放的上下文越多、越慢越贵。每个会话记录轮数、累计费用和耗时，
+超过配置的阈值后由 check_limits 给出原因，路由层据此汇总成记忆并开新会话，或只提醒。
+"""
 
 import logging
-from dataclasses import dataclass, field
-from typing import Optional
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, fields
 
 logger = logging.getLogger(__name__)
 
 
-@dataclass
+@dataclass(slots=True)
 class Session:
     """单个 chat 的会话状态"""
     chat_id: str
@@ -16,44 +30,273 @@ class Session:
     claude_session_id: str = ""         # Claude Code 会话 ID（用于 --resume）
     has_history: bool = False           # 是否有历史对话（用于 --continue）
     model: str = ""
+    slot_name: str = ""                 # 当前会话槽名称（空为项目默认槽）
+    turns: int = 0                      # 当前 Claude 会话已执行的轮数
+    total_cost: float = 0.0             # 当前 Claude 会话累计费用（美元）
+    total_duration_ms: int = 0          # 当前 Claude 会话累计耗时
+    last_duration_ms: int = 0           # 最近一轮耗时
 
     def reset_claude_session(self):
         """重置 Claude Code 会话（保留项目）"""
         self.claude_session_id = ""
         self.has_history = False
+        self.turns = 0
+        self.total_cost = 0.0
+        self.total_duration_ms = 0
+        self.last_duration_ms = 0
+
+    @property
+    def duration_trend(self) -> float:
+        """最近一轮耗时 / 之前各轮平均耗时（>1 表示在变慢），不足两轮时为 0"""
+        if self.turns < 2 or not self.last_duration_ms:
+            return 0.0
+        earlier = (self.total_duration_ms - self.last_duration_ms) / (self.turns - 1)
+        return self.last_duration_ms / earlier if earlier > 0 else 0.0
+
+
+@dataclass(slots=True)
+class SessionSlot:
+    """一个已保存的 Claude 会话（某项目下的某个命名槽）"""
+    claude_session_id: str = ""
+    has_history: bool = False
+    turns: int = 0
+    total_cost: float = 0.0
+    total_duration_ms: int = 0
+    last_duration_ms: int = 0
+    last_used: float = 0.0
+
+
+_COLUMNS = [f.name for f in fields(Session)]
+# 切换会话槽时随会话一起保存 / 恢复的字段
+_SLOT_STATE = [f.name for f in fields(SessionSlot) if f.name != "last_used"]
+_SQL_TYPES = {str: "TEXT DEFAULT ''", bool: "INTEGER DEFAULT 0", int: "INTEGER DEFAULT 0", float: "REAL DEFAULT 0"}
+
+# 每个 chat 默认保留的会话槽数
+DEFAULT_MAX_SLOTS = 8
+
+# 最近一轮耗时达到之前平均的多少倍才算「越来越慢」
+SLOW_TREND_RATIO = 1.5
 
 
 class SessionManager:
-    def __init__(self, default_model: str = ""):
+    def __init__(
+        self,
+        default_model: str = "",
+        db_path: str = "",
+        max_slots: int = DEFAULT_MAX_SLOTS,
+        max_turns: int = 0,
+        max_cost: float = 0,
+        slow_turn_seconds: float = 0,
+        on_limit: str = "digest",
+    ):
         self.sessions: dict[str, Session] = {}
         self.default_model = default_model
+        self.db_path = db_path
+        self.max_slots = max(1, max_slots)
+        # 会话长度阈值，0 表示不限制
+        self.max_turns = max_turns
+        self.max_cost = max_cost
+        self.slow_turn_seconds = slow_turn_seconds
+        # 超限后的处理："digest" 汇总成记忆并开新会话，"warn" 只提醒
+        self.on_limit = on_limit
+        # chat_id -> OrderedDict[(项目, 槽名), SessionSlot]，最近使用的在末尾
+        self._slots: dict[str, OrderedDict[tuple[str, str], SessionSlot]] = {}
+        self._conn = None  # 首次访问时打开
+
+    def _db(self):
+        if self._conn is None and self.db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS sessions (chat_id TEXT PRIMARY KEY)")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS session_slots (
+                    chat_id TEXT NOT NULL,
+                    project TEXT NOT NULL,
+                    name TEXT NOT NULL DEFAULT '',
+                    PRIMARY KEY (chat_id, project, name)
+                )
+            """)
+            # 其余列按 dataclass 字段补齐（旧库升级时自动加列）
+            self._add_columns("sessions", fields(Session))
+            self._add_columns("session_slots", fields(SessionSlot))
+            self._conn.commit()
+        return self._conn
+
+    def _add_columns(self, table: str, columns):
+        existing = {r[1] for r in self._conn.execute(f"PRAGMA table_info({table})")}
+        for f in columns:
+            if f.name not in existing:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {f.name} {_SQL_TYPES[f.type]}")
+
+    def _load(self, chat_id: str):
+        conn = self._db()
+        if conn is None:
+            return None
+        row = conn.execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM sessions WHERE chat_id = ?", (chat_id,)
+        ).fetchone()
+        if not row:
+            return None
+        session = Session(*row)
+        session.has_history = bool(session.has_history)
+        return session
+
+    def save(self, session: Session):
+        """写穿：把会话当前状态写入数据库"""
+        conn = self._db()
+        if conn is None:
+            return
+        try:
+            conn.execute(
+                f"INSERT OR REPLACE INTO sessions ({', '.join(_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(_COLUMNS))})",
+                [getattr(session, c) for c in _COLUMNS],
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"[{session.chat_id}] 保存会话失败: {e}")
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
 
     def get_session(self, chat_id: str) -> Session:
-        """获取或创建会话"""
-        if chat_id not in self.sessions:
-            self.sessions[chat_id] = Session(
+        """获取或创建会话（内存未命中时先从数据库加载）"""
+        session = self.sessions.get(chat_id)
+        if session is None:
+            session = self._load(chat_id) or Session(
                 chat_id=chat_id,
                 model=self.default_model,
             )
-        return self.sessions[chat_id]
+            self.sessions[chat_id] = session
+        return session
+
+    def set_project(self, chat_id: str, name: str, path: str, slot_name: str = "") -> bool:
+        """切换项目（及会话槽）：先保存当前会话，再续接目标槽上次的 Claude 会话
 
-    def set_project(self, chat_id: str, name: str, path: str):
-        """切换项目，同时重置 Claude 会话"""
+        返回是否续接了已有会话；目标槽不存在时为新会话。
+        """
         session = self.get_session(chat_id)
+        self._remember(session)
+        slot = self._get_slots(chat_id).get((name, slot_name))
         session.current_project = name
         session.current_project_path = path
-        session.reset_claude_session()
-        logger.info(f"[{chat_id}] 切换项目: {name} -> {path}")
+        session.slot_name = slot_name
+        if slot and slot.claude_session_id:
+            for field_name in _SLOT_STATE:
+                setattr(session, field_name, getattr(slot, field_name))
+            self._remember(session)
+        else:
+            session.reset_claude_session()
+        self.save(session)
+        resumed = bool(slot and slot.claude_session_id)
+        label = f"{name}#{slot_name}" if slot_name else name
+        logger.info(f"[{chat_id}] 切换项目: {label} -> {path}{'（续接会话）' if resumed else ''}")
+        return resumed
+
+    def list_slots(self, chat_id: str) -> list[tuple[str, str, SessionSlot]]:
+        """该 chat 保存的会话槽 [(项目, 槽名, 槽)]，最近使用的在前"""
+        self._remember(self.get_session(chat_id))
+        return [(p, n, slot) for (p, n), slot in reversed(self._get_slots(chat_id).items())]
+
+    def _get_slots(self, chat_id: str) -> OrderedDict:
+        """懒加载该 chat 的会话槽"""
+        slots = self._slots.get(chat_id)
+        if slots is None:
+            slots = OrderedDict()
+            conn = self._db()
+            if conn is not None:
+                rows = conn.execute(
+                    f"""SELECT project, name, {', '.join(f.name for f in fields(SessionSlot))}
+                        FROM session_slots WHERE chat_id = ? ORDER BY last_used""",
+                    (chat_id,)
+                ).fetchall()
+                for project, name, *values in rows:
+                    slot = SessionSlot(*values)
+                    slot.has_history = bool(slot.has_history)
+                    slots[(project, name)] = slot
+            self._slots[chat_id] = slots
+        return slots
+
+    def _remember(self, session: Session):
+        """把当前会话记入其项目槽（LRU，超出 max_slots 淘汰最久未用的）"""
+        if not session.current_project or not session.claude_session_id:
+            return
+        slots = self._get_slots(session.chat_id)
+        key = (session.current_project, session.slot_name)
+        slot = SessionSlot(**{name: getattr(session, name) for name in _SLOT_STATE}, last_used=time.time())
+        slots[key] = slot
+        slots.move_to_end(key)
+        evicted = []
+        while len(slots) > self.max_slots:
+            evicted.append(slots.popitem(last=False)[0])
+
+        conn = self._db()
+        if conn is None:
+            return
+        try:
+            slot_columns = [f.name for f in fields(SessionSlot)]
+            conn.execute(
+                f"INSERT OR REPLACE INTO session_slots (chat_id, project, name, {', '.join(slot_columns)}) "
+                f"VALUES ({', '.join('?' * (len(slot_columns) + 3))})",
+                (session.chat_id, *key, *(getattr(slot, c) for c in slot_columns))
+            )
+            conn.executemany(
+                "DELETE FROM session_slots WHERE chat_id = ? AND project = ? AND name = ?",
+                [(session.chat_id, *k) for k in evicted]
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"[{session.chat_id}] 保存会话槽失败: {e}")
+
+    def set_model(self, chat_id: str, model: str):
+        """切换模型"""
+        session = self.get_session(chat_id)
+        session.model = model
+        self.save(session)
 
-    def new_session(self, chat_id: str):
-        """新建 Claude Code 会话（同项目）"""
+    def new_session(self, chat_id: str, slot_name: str = None):
+        """新建 Claude Code 会话（同项目）；给出 slot_name 时旧会话保留在原槽，新会话放入该槽"""
         session = self.get_session(chat_id)
+        if slot_name is not None:
+            self._remember(session)
+            session.slot_name = slot_name
         session.reset_claude_session()
-        logger.info(f"[{chat_id}] 新建会话")
+        slots = self._get_slots(chat_id)
+        if slots.pop((session.current_project, session.slot_name), None) and self._db() is not None:
+            self._conn.execute(
+                "DELETE FROM session_slots WHERE chat_id = ? AND project = ? AND name = ?",
+                (chat_id, session.current_project, session.slot_name)
+            )
+            self._conn.commit()
+        self.save(session)
+        logger.info(f"[{chat_id}] 新建会话 {session.slot_name}")
 
-    def update_claude_session(self, chat_id: str, session_id: str):
-        """更新 Claude Code 会话 ID（执行成功后调用）"""
+    def update_claude_session(self, chat_id: str, session_id: str, cost_usd: float = 0, duration_ms: int = 0):
+        """更新 Claude Code 会话 ID 并累计本轮费用 / 耗时（执行成功后调用）"""
         session = self.get_session(chat_id)
         if session_id:
             session.claude_session_id = session_id
             session.has_history = True
+            session.turns += 1
+            session.total_cost += cost_usd or 0
+            session.total_duration_ms += duration_ms or 0
+            session.last_duration_ms = duration_ms or 0
+            self.save(session)
+            self._remember(session)
+
+    def check_limits(self, chat_id: str) -> str:
+        """会话超过长度阈值时返回原因（如「已 30 轮」），否则返回空字符串"""
+        session = self.get_session(chat_id)
+        if not session.has_history:
+            return ""
+        if self.max_turns and session.turns >= self.max_turns:
+            return f"已 {session.turns} 轮"
+        if self.max_cost and session.total_cost >= self.max_cost:
+            return f"累计费用 ${session.total_cost:.2f}"
+        if (self.slow_turn_seconds and session.last_duration_ms >= self.slow_turn_seconds * 1000
+                and session.duration_trend >= SLOW_TREND_RATIO):
+            return f"单轮耗时升至 {session.last_duration_ms / 1000:.0f}s（之前平均的 {session.duration_trend:.1f} 倍）"
+        return ""
@@ -17,6 +17,7 @@ from adapters.telegram_adapter import TelegramAdapter
 from core.executor import ClaudeExecutor
 from core.router import Router
 from core.session_manager import SessionManager
+from core.fetch_scheduler import FetchScheduler
 from core.project_manager import ProjectManager
 from core.git_ops import GitOps
 from core.file_manager import FileManager
@@ -139,6 +140,12 @@ async def main():
     )
     session_mgr = SessionManager(
         default_model=config.get("claude", {}).get("model", "claude-sonnet-4-20250514"),
+        db_path=resolve_path(config.get("sessions", {}).get("db_path", "./data/sessions.db")),
+        max_slots=config.get("sessions", {}).get("max_slots", 8),
+        max_turns=config.get("sessions", {}).get("max_turns", 30),
+        max_cost=config.get("sessions", {}).get("max_cost_usd", 3.0),
+        slow_turn_seconds=config.get("sessions", {}).get("slow_turn_seconds", 180),
+        on_limit=config.get("sessions", {}).get("on_limit", "digest"),
     )
 
     # 解析 projects_file 的相对路径
@@ -148,7 +155,9 @@ async def main():
     project_mgr = ProjectManager(projects_config)
 
     # 记忆系统（按项目独立存储）
-    memory_mgr = ProjectMemoryManager()
+    memory_mgr = ProjectMemoryManager(
+        capacity=config.get("memory", {}).get("max_open_stores", 16),
+    )
 
     # Git + 文件管理
     git_ops = GitOps(config.get("git", {}))
@@ -176,6 +185,13 @@ async def main():
         pass
 
     await adapter.start()
+    # 后台记忆压缩（按周汇总旧记录 + 保留上限）
+    compact_task = asyncio.create_task(router.compactor.run_forever())
+    # 后台 fetch（fetch_interval_minutes 为 0 时关闭）
+    fetch_task = None
+    if config.get("git", {}).get("fetch_interval_minutes", 15):
+        fetcher = FetchScheduler(git_ops, project_mgr, config.get("git", {}))
+        fetch_task = asyncio.create_task(fetcher.run_forever())
     logger.info("724code 已就绪，等待消息...")
 
     try:
@@ -183,7 +199,12 @@ async def main():
     except KeyboardInterrupt:
         logger.info("KeyboardInterrupt，正在关闭...")
     finally:
+        compact_task.cancel()
+        if fetch_task:
+            fetch_task.cancel()
         await adapter.stop()
+        memory_mgr.close_all()
+        session_mgr.close()
 
     logger.info("724code 已停止")
 
@@ -0,0 +1,63 @@
+"""记忆压缩调度 — 后台定期对所有已注册项目执行汇总与保留策略
+
+具体的汇总 / 淘汰 / VACUUM 逻辑在 MemoryStore.compact() 中，
+这里只负责定时调度，并把阻塞的 SQLite 操作放到线程里执行，不卡事件循环。
+"""
+
+import asyncio
+import logging
+import os
+import random
+
+from memory.store import ProjectMemoryManager
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryCompactor:
+    def __init__(self, memory_mgr: ProjectMemoryManager, project_mgr, config: dict):
+        self.memory_mgr = memory_mgr
+        self.project_mgr = project_mgr
+        self.older_than_days = config.get("compact_after_days", 30)
+        self.max_rows = config.get("max_rows", 5000)
+        self.max_db_mb = config.get("max_db_mb", 50)
+        self.interval = config.get("compact_interval_hours", 24) * 3600
+        self.startup_delay = config.get("compact_startup_delay_seconds", 60)
+        self._lock = asyncio.Lock()  # 定时任务与 /memory compact 不并发执行
+
+    async def run_forever(self):
+        """后台循环：启动后稍等片刻（加随机抖动，避开启动流程）先压缩一次，之后每个周期一次
+
+        服务经常在一个周期内重启，若先等满一个周期，压缩可能永远轮不到。
+        """
+        delay = self.startup_delay * random.uniform(1, 1.5)
+        while True:
+            await asyncio.sleep(delay)
+            delay = self.interval
+            try:
+                await self.compact_all()
+            except Exception as e:
+                logger.error(f"记忆压缩任务异常: {e}", exc_info=True)
+
+    async def compact_all(self) -> dict[str, dict]:
+        """压缩所有已有记忆库的项目，返回 {项目名: compact 结果}"""
+        results = {}
+        for name, info in self.project_mgr.list_projects().items():
+            path = info.get("path", "")
+            # 只处理已经产生过记忆的项目，不为其他项目创建空库
+            if not path or not os.path.exists(os.path.join(path, ".724code", "memories.db")):
+                continue
+            results[name] = await self.compact(path)
+        return results
+
+    async def compact(self, project_path: str, full_vacuum: bool = False) -> dict:
+        """压缩单个项目的记忆库（在线程中执行）；full_vacuum 见 MemoryStore.compact"""
+        store = self.memory_mgr.get_store(project_path)
+        async with self._lock:
+            return await asyncio.to_thread(
+                store.compact,
+                older_than_days=self.older_than_days,
+                max_rows=self.max_rows,
+                max_db_mb=self.max_db_mb,
+                full_vacuum=full_vacuum,
+            )
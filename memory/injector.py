@@ -1,42 +1,239 @@
-"""上下文注入 — 将记忆拼接到发给 Claude Code 的 prompt 中"""
+"""上下文注入 — 将记忆拼接到发给 Claude Code 的 prompt 中
+
+prompt 分三段，越稳定的越靠前，以便模型服务端的前缀缓存命中：
+  1. 项目背景（项目说明、周汇总、最近记录、关键文件）：按项目缓存，
+     只有记忆库有新写入 / 汇总 / 淘汰时才重建；新记录只追加在最近记录末尾，
+     易变的关键文件统计放在最后，重建前后的公共前缀尽量长
+  2. 与当前任务相关的记录：按相关性打分，随任务变化
+  3. 当前任务：用户消息永远在最后
+
+相关记录的打分：
+  score = 相关度（bm25 归一化与向量相似度取大）+ 时间衰减 + 文件重叠加分
+再按分数贪心装入剩余 token 预算（整条装入，不截断），最终按时间正序输出。
+token 数按字符类别估算（utils.tokens），每条记录的估算结果有缓存。
+"""
 
 import logging
+import math
+import os
+import re
+from datetime import datetime
+
 from memory.store import MemoryStore
+from utils.tokens import cached_tokens, estimate_tokens
 
 logger = logging.getLogger(__name__)
 
+# 打分权重
+RELEVANCE_WEIGHT = 1.0
+RECENCY_WEIGHT = 0.5
+FILE_OVERLAP_WEIGHT = 0.5
+
+# 项目背景中列出的关键文件数与周汇总数
+KEY_FILES = 10
+PREAMBLE_DIGESTS = 8
+# 关键文件段（带改动次数，每条新记录都可能变化），放在项目背景最后
+KEY_FILES_HEADER = "\n\n### 关键文件"
+
+_RELATED_HEADER = "## 与当前任务相关的记录"
+_TASK_SECTION = """---
+
+请基于上面的项目背景执行下面的任务。如果记录中有相关上下文，请参考。
+
+## 当前任务
+"""
+_TASK_TOKENS = estimate_tokens(_TASK_SECTION) + estimate_tokens(_RELATED_HEADER) + 2
+
+# prompt 中提到的文件（带扩展名的路径或文件名）
+_FILE_RE = re.compile(r"[\w./-]+\.[A-Za-z0-9]{1,8}\b")
+
 
 class ContextInjector:
     def __init__(self, config: dict):
         self.recent_n = config.get("recent_entries", 15)
         self.max_tokens = config.get("max_context_tokens", 4000)
+        self.preamble_tokens = config.get("preamble_tokens", self.max_tokens // 2)
+        self.candidates = config.get("relevance_candidates", 30)
+        self.half_life_days = config.get("recency_half_life_days", 7)
+        # (db_path, 项目) -> (记忆版本, 项目说明, 背景文本, 背景包含的记录 ID, 估算 tokens)
+        self._preambles: dict[tuple[str, str], tuple] = {}
+        # (db_path, 项目) -> 背景中最近记录的起始 ID（只在放不下时前移）
+        self._anchors: dict[tuple[str, str], int] = {}
 
-    def build_augmented_prompt(self, store: MemoryStore, project: str, user_message: str) -> str:
-        """将记忆上下文注入到用户 prompt 中（仅新会话第一条消息调用）"""
-        recent = store.get_recent(project, n=self.recent_n)
+    def build_augmented_prompt(self, store: MemoryStore, project: str, user_message: str,
+                               description: str = "") -> tuple[str, int]:
+        """将记忆上下文注入到用户 prompt 中（仅新会话第一条消息调用）
+
+        返回 (prompt, 整个 prompt 的估算 token 数)；估算值随调用返回，
+        注入器被多个 chat 共享，不保存在实例上。
+        """
+        preamble, preamble_ids, preamble_tokens = self.get_preamble(store, project, description)
+        if not preamble:
+            return user_message, estimate_tokens(user_message)
+
+        budget = self.max_tokens - preamble_tokens - _TASK_TOKENS
+        entries = self.select_entries(store, project, user_message, exclude=preamble_ids, budget=budget)
+
+        parts = [preamble]
+        related_tokens = 0
+        if entries:
+            lines = [_format_entry(e) for e in entries]
+            parts.append(_RELATED_HEADER + "\n" + "\n".join(lines))
+            related_tokens = sum(cached_tokens(line) + 1 for line in lines)
+        parts.append(_TASK_SECTION + user_message)
+        prompt = "\n\n".join(parts)
+
+        context_tokens = preamble_tokens + related_tokens + _TASK_TOKENS
+        logger.debug(
+            f"上下文注入 [{project}]: 背景 {len(preamble_ids)} 条 + 相关 {len(entries)} 条，"
+            f"{len(prompt)} 字符，估算 {context_tokens}/{self.max_tokens} tokens"
+            f"（原 len*2 算法 {len(prompt) * 2}）"
+        )
+        return prompt, context_tokens + estimate_tokens(user_message)
+
+    def get_preamble(self, store: MemoryStore, project: str, description: str = "") -> tuple[str, frozenset, int]:
+        """项目背景段（带缓存）：返回 (文本, 包含的记录 ID, 估算 tokens)；项目无记忆时文本为空"""
+        key = (store.db_path, project)
+        revision = store.revision(project)
+        cached = self._preambles.get(key)
+        if cached and cached[0] == revision and cached[1] == description:
+            return cached[2:]
 
+        text, ids, tokens = "", frozenset(), 0
+        if revision[1]:
+            text, ids, tokens = self._build_preamble(store, project, description)
+        self._preambles[key] = (revision, description, text, ids, tokens)
+        logger.debug(f"项目背景已重建 [{project}]: {len(ids)} 条记录，约 {tokens} tokens")
+        return text, ids, tokens
+
+    def _build_preamble(self, store: MemoryStore, project: str, description: str) -> tuple[str, frozenset, int]:
+        """按固定顺序拼装项目背景：说明 → 汇总 → 最近记录（只追加）→ 关键文件
+
+        越靠前越稳定：汇总只在压缩时变化；最近记录从锚点 ID 起按时间正序排列，
+        新记录只追加在末尾，超出条数或预算时才把锚点一次性前移（丢掉较旧的一半）；
+        带改动次数的关键文件每条新记录都可能变化，放在最后。
+        """
+        head = [f"## 项目背景：{project}"]
+        if description:
+            head.append(description)
+        head.append("\n### 历史记录")
+        text = "\n".join(head)
+        files = store.top_files(project, n=KEY_FILES)
+        tail = ""
+        if files:
+            tail = KEY_FILES_HEADER + "\n" + "\n".join(f"- {path}（改动 {count} 次）" for path, count in files)
+        budget = self.preamble_tokens - estimate_tokens(text) - estimate_tokens(tail)
+
+        # 汇总：从新到旧装入预算，按时间正序输出
+        digests = []
+        for e in reversed(store.get_digests(project, n=PREAMBLE_DIGESTS)):
+            cost = cached_tokens(_format_entry(e)) + 1
+            if cost > budget:
+                break
+            digests.append(e)
+            budget -= cost
+        digests.reverse()
+
+        recent = self._recent_window(store, project, budget)
+        budget -= sum(cached_tokens(_format_entry(e)) + 1 for e in recent)
+        chosen = digests + recent
+
+        text += "\n" + "\n".join(_format_entry(e) for e in chosen) + tail
+        return text, frozenset(e["id"] for e in chosen), self.preamble_tokens - budget
+
+    def _recent_window(self, store: MemoryStore, project: str, budget: int) -> list[dict]:
+        """从锚点起的最近记录（时间正序）；放不下时前移锚点，只保留能装入一半预算 / 一半条数的最新记录"""
+        key = (store.db_path, project)
+        window = store.get_recent(project, n=self.recent_n + 1, since_id=self._anchors.get(key, 0))
+        cost = sum(cached_tokens(_format_entry(e)) + 1 for e in window)
+        if not window or (len(window) <= self.recent_n and cost <= budget):
+            return window
+
+        kept, spent = [], 0
+        for e in reversed(window):
+            entry_cost = cached_tokens(_format_entry(e)) + 1
+            if len(kept) >= max(1, self.recent_n // 2) or spent + entry_cost > budget // 2:
+                break
+            kept.append(e)
+            spent += entry_cost
+        kept.reverse()
+        self._anchors[key] = kept[0]["id"] if kept else window[-1]["id"] + 1
+        logger.debug(f"项目背景最近记录锚点前移 [{project}]: 从 ID {self._anchors[key]} 开始")
+        return kept
+
+    def select_entries(self, store: MemoryStore, project: str, user_message: str,
+                       exclude: frozenset = frozenset(), budget: int = None) -> list[dict]:
+        """召回候选记忆并打分，按分数贪心装入 token 预算，返回按时间正序的记录
+
+        exclude: 已在项目背景中出现的记录 ID；budget 默认为 max_context_tokens
+        """
+        recent = store.get_recent(project, n=self.recent_n)
         if not recent:
-            return user_message
+            return []
+        related = store.related(project, user_message, limit=self.candidates)
+        similar = store.similar(project, user_message, limit=self.candidates)
 
-        # 构建上下文
-        recent_text = "\n".join([
-            f"- [{e['time'][:16]}] {e['task'][:80]} -> {e['summary'][:100]}"
-            for e in recent
-        ])
+        candidates = {e["id"]: e for e in recent}
+        candidates.update({e["id"]: e for e in related})
+        candidates.update({e["id"]: e for e in similar})
+        for entry_id in exclude:
+            candidates.pop(entry_id, None)
 
-        context = f"## 近期工作记录（最近 {len(recent)} 条）\n{recent_text}"
+        # bm25 分数为负数，越小越相关；用最佳分数归一化到 (0, 1]
+        ranks = {e["id"]: e["rank"] for e in related}
+        best_rank = min(ranks.values(), default=0)
+        similarities = {e["id"]: e["similarity"] for e in similar}
+        mentioned = _mentioned_files(user_message)
+        now = datetime.now()
 
-        # Token 预算检查（粗略：1 中文字 ≈ 2 tokens）
-        estimated_tokens = len(context) * 2
-        if estimated_tokens > self.max_tokens:
-            max_chars = self.max_tokens // 2
-            context = context[:max_chars] + "\n... (部分记录已截断)"
+        scored = []
+        for entry_id, e in candidates.items():
+            relevance = ranks[entry_id] / best_rank if entry_id in ranks and best_rank else 0.0
+            relevance = max(relevance, similarities.get(entry_id, 0.0))
+            score = (
+                RELEVANCE_WEIGHT * relevance
+                + RECENCY_WEIGHT * self._recency(e["time"], now)
+                + FILE_OVERLAP_WEIGHT * _file_overlap(e["files"], mentioned)
+            )
+            scored.append((score, entry_id, e))
+        scored.sort(key=lambda x: (x[0], x[1]), reverse=True)
 
-        return f"""{context}
+        # 贪心装箱：整条放入，放不下就跳过（+1 为换行）
+        budget = self.max_tokens if budget is None else budget
+        chosen = []
+        for _, _, e in scored:
+            cost = cached_tokens(_format_entry(e)) + 1
+            if cost <= budget:
+                chosen.append(e)
+                budget -= cost
 
----
+        logger.debug(
+            f"上下文注入 [{project}]: 候选 {len(candidates)} 条 "
+            f"(全文 {len(related)}, 向量 {len(similar)})，选中 {len(chosen)} 条"
+        )
+        return sorted(chosen, key=lambda e: e["id"])
+
+    def _recency(self, timestamp: str, now: datetime) -> float:
+        """指数时间衰减，half_life_days 天后权重减半"""
+        try:
+            age_days = (now - datetime.fromisoformat(timestamp)).total_seconds() / 86400
+        except ValueError:
+            return 0.0
+        return math.exp(-math.log(2) * max(age_days, 0) / self.half_life_days)
+
+
+def _format_entry(e: dict) -> str:
+    return f"- [{e['time'][:16]}] {e['task'][:80]} -> {e['summary'][:100]}"
+
+
+def _mentioned_files(text: str) -> set[str]:
+    """提取 prompt 中提到的文件名（只比较 basename）"""
+    return {os.path.basename(m).lower() for m in _FILE_RE.findall(text)}
 
-## 当前任务
-{user_message}
 
-请基于上面的项目背景执行当前任务。如果近期记录中有相关上下文，请参考。"""
+def _file_overlap(files: list[str], mentioned: set[str]) -> float:
+    """记录改动的文件与 prompt 提到文件的重叠比例"""
+    if not files or not mentioned:
+        return 0.0
+    hits = sum(1 for f in files if os.path.basename(f).lower() in mentioned)
+    return min(hits / len(mentioned), 1.0)
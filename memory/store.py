@@ -1,30 +1,127 @@
 """记忆存储引擎 — SQLite + FTS5 全文搜索
 
 每个项目独立存储在 <project_path>/.724code/memories.db
+
+全文索引使用 trigram 分词（任意 3 字符子串可检索，中文无需分词），
+另建一份 unicode61 索引处理不足 3 字符的短查询。
+
+每次运行的完整输出按内容哈希去重、zlib 压缩后存入 blobs 表，
+记忆行只保存哈希，/detail <id> 时才读取解压。原始记录被汇总进周报后，
+其输出引用转存到 archived_outputs（记在周汇总名下），/detail <原 id> 仍可查看，
+直到体积上限把它们淘汰。
 """
 
+import hashlib
 import json
 import logging
 import os
+import re
 import sqlite3
-from datetime import datetime
+import threading
+import weakref
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from memory.vector_index import VectorIndex
 
 logger = logging.getLogger(__name__)
 
+# 数据库 schema 版本（PRAGMA user_version），用于迁移已有数据库
+#   1: trigram + unicode61 双 FTS 索引
+#   2: memories.kind / entry_count（周汇总行）+ meta 表
+#   3: blobs 表 + memories.output_hash（完整输出归档）
+#   4: archived_outputs 表（已汇总记录的完整输出引用）
+#   5: 会话汇总改用 kind='session_digest'，与周汇总区分
+SCHEMA_VERSION = 5
+
+# trigram 分词最短可匹配长度，更短的词走 unicode61 索引
+TRIGRAM_MIN_LEN = 3
+
+# 搜索结果摘录的高亮标记
+HIGHLIGHT_OPEN = "【"
+HIGHLIGHT_CLOSE = "】"
+
+# bm25 只对最近 N 条命中打分，高频词在大库上也能保持毫秒级
+RANK_CANDIDATES = 1000
+
+# 向量相似检索的最低余弦相似度（低于此值视为不相关）
+MIN_SIMILARITY = 0.15
+
+# 相关性召回时从 prompt 中提取的最大词数
+MAX_RELATED_TERMS = 32
+
+# 周汇总行的摘要长度上限与合并文件数上限
+DIGEST_SUMMARY_CHARS = 800
+DIGEST_MAX_FILES = 50
+
+# 完整输出归档的 zlib 压缩级别（输出以文本为主，最高级别也只需毫秒）
+BLOB_COMPRESS_LEVEL = 9
+
+# 跨项目搜索的并发线程数
+SEARCH_WORKERS = 8
+
+# 同时保持打开的 MemoryStore 数（LRU 淘汰并关闭连接）
+DEFAULT_MAX_OPEN_STORES = 16
+
+# 本进程内已完成建表/迁移的数据库：db_path -> (fts_available, fts_tokenizer)
+# 打开连接时仍核对 user_version，库文件被删除重建后会重新建表
+_schema_ready: dict[str, tuple[bool, str]] = {}
+_schema_lock = threading.Lock()
+
+_ASCII_WORD_RE = re.compile(r"[A-Za-z0-9_][A-Za-z0-9_./-]*")
+_CJK_RUN_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]+")
+
 
 class MemoryStore:
     def __init__(self, db_path: str):
         self.db_path = db_path
         self.fts_available = False
+        self.fts_tokenizer = ""
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        self._init_db()
+        self.vectors = VectorIndex(os.path.dirname(db_path))
+        self._vectors_synced = False
+        self._db = None                 # 持久连接，首次使用时打开
+        self._lock = threading.RLock()  # 同一 store 的数据库操作串行执行
 
-    def _get_conn(self) -> sqlite3.Connection:
-        return sqlite3.connect(self.db_path)
+    def _open(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
 
-    def _init_db(self):
+    @contextmanager
+    def _get_conn(self):
+        """获取持久连接（懒加载；本进程内每个库只建表/迁移一次）"""
+        with self._lock:
+            if self._db is None:
+                self._db = self._open()
+                self._ensure_schema(self._db)
+            yield self._db
+
+    def close(self):
+        """关闭持久连接并释放向量矩阵映射（再次使用时自动重连）"""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+        self.vectors.close()
+
+    def _ensure_schema(self, conn: sqlite3.Connection):
+        with _schema_lock:
+            state = _schema_ready.get(self.db_path)
+            if state is None or conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                self._init_db(conn)
+                _schema_ready[self.db_path] = (self.fts_available, self.fts_tokenizer)
+            else:
+                self.fts_available, self.fts_tokenizer = state
+
+    def _init_db(self, conn: sqlite3.Connection):
         """创建表和索引"""
-        conn = self._get_conn()
+        # 新库在建表前开启增量 VACUUM（已有表的旧库需整库重写才能切换，见 _incremental_vacuum）
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # WAL：后台压缩写入时不阻塞前台读取
+        conn.execute("PRAGMA journal_mode=WAL")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
         conn.execute("""
             CREATE TABLE IF NOT EXISTS memories (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -35,22 +132,114 @@ class MemoryStore:
                 files_changed TEXT DEFAULT '[]',
                 session_id TEXT DEFAULT '',
                 cost_usd REAL DEFAULT 0,
-                model TEXT DEFAULT ''
+                model TEXT DEFAULT '',
+                kind TEXT DEFAULT 'entry',
+                entry_count INTEGER DEFAULT 1,
+                output_hash TEXT DEFAULT ''
+            )
+        """)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_memories_project ON memories(project, kind, id)"
+        )
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                codec TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                data BLOB NOT NULL
             )
         """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS archived_outputs (
+                entry_id INTEGER PRIMARY KEY,
+                digest_id INTEGER NOT NULL,
+                hash TEXT NOT NULL
+            )
+        """)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_archived_digest ON archived_outputs(digest_id)"
+        )
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        """)
+        if version < 2:
+            columns = {r[1] for r in conn.execute("PRAGMA table_info(memories)")}
+            if "kind" not in columns:
+                conn.execute("ALTER TABLE memories ADD COLUMN kind TEXT DEFAULT 'entry'")
+            if "entry_count" not in columns:
+                conn.execute("ALTER TABLE memories ADD COLUMN entry_count INTEGER DEFAULT 1")
+        if version < 3:
+            columns = {r[1] for r in conn.execute("PRAGMA table_info(memories)")}
+            if "output_hash" not in columns:
+                conn.execute("ALTER TABLE memories ADD COLUMN output_hash TEXT DEFAULT ''")
+        if version < 5:
+            # 旧版会话汇总与周汇总同为 'digest'，按标题和 entry_count = 0 识别后改标
+            conn.execute(
+                """UPDATE memories SET kind = 'session_digest'
+                   WHERE kind = 'digest' AND entry_count = 0 AND user_msg LIKE '会话汇总%'"""
+            )
         # FTS5 全文搜索索引（可选，部分 SQLite 编译版不含 FTS5）
         try:
-            conn.execute("""
-                CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts
-                USING fts5(user_msg, summary, content=memories, content_rowid=id)
-            """)
+            self._init_fts(conn, version)
             self.fts_available = True
         except sqlite3.OperationalError:
             logger.warning("SQLite FTS5 不可用，搜索将使用 LIKE 模糊匹配")
             self.fts_available = False
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
         conn.commit()
-        conn.close()
-        logger.info(f"记忆数据库就绪: {self.db_path} (FTS5: {self.fts_available})")
+        logger.info(
+            f"记忆数据库就绪: {self.db_path} "
+            f"(FTS5: {self.fts_available}, 分词: {self.fts_tokenizer or '无'})"
+        )
+
+    def _init_fts(self, conn: sqlite3.Connection, version: int):
+        """创建 FTS 索引，旧库（unicode61 单索引）自动迁移并回填"""
+        # trigram 需要 SQLite >= 3.34，不支持时主索引退回 unicode61
+        tokenizer = "trigram"
+        try:
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS temp.fts_probe USING fts5(x, tokenize='trigram')")
+            conn.execute("DROP TABLE temp.fts_probe")
+        except sqlite3.OperationalError:
+            logger.warning("SQLite 不支持 trigram 分词，中文搜索效果受限")
+            tokenizer = "unicode61"
+
+        existing = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE name = 'memories_fts'"
+        ).fetchone()
+        needs_rebuild = existing is not None and (
+            version < 1 or tokenizer not in existing[0]
+        )
+        if needs_rebuild:
+            conn.execute("DROP TABLE IF EXISTS memories_fts")
+            conn.execute("DROP TABLE IF EXISTS memories_fts_word")
+
+        conn.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts
+            USING fts5(user_msg, summary, content=memories, content_rowid=id,
+                       tokenize='{tokenizer}')
+        """)
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts_word
+            USING fts5(user_msg, summary, content=memories, content_rowid=id,
+                       tokenize='unicode61 remove_diacritics 2')
+        """)
+        self.fts_tokenizer = tokenizer
+
+        if needs_rebuild or existing is None:
+            self._backfill_fts(conn)
+
+    def _backfill_fts(self, conn: sqlite3.Connection):
+        """从 memories 表重建 FTS 索引（迁移旧数据库）"""
+        count = conn.execute("SELECT COUNT(*) FROM memories").fetchone()[0]
+        if not count:
+            return
+        for table in ("memories_fts", "memories_fts_word"):
+            conn.execute(f"INSERT INTO {table}({table}) VALUES('rebuild')")
+            conn.execute(f"INSERT INTO {table}({table}) VALUES('optimize')")
+        logger.info(f"FTS 索引已回填: {count} 条 ({self.db_path})")
 
     def save_entry(
         self,
@@ -61,14 +250,11 @@ class MemoryStore:
         session_id: str = "",
         cost_usd: float = 0,
         model: str = "",
-    ):
-        """保存一条记忆"""
-        conn = self._get_conn()
-        cursor = conn.execute(
-            """INSERT INTO memories
-               (project, timestamp, user_msg, summary, files_changed, session_id, cost_usd, model)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-            (
+        full_output: str = "",
+    ) -> int:
+        """保存一条记忆，返回记录 ID（full_output 压缩归档，可用 get_output 取回）"""
+        with self._get_conn() as conn:
+            entry_id = self._insert(conn, (
                 project,
                 datetime.now().isoformat(),
                 user_msg,
@@ -77,83 +263,380 @@ class MemoryStore:
                 session_id,
                 cost_usd,
                 model,
-            )
+            ), output_hash=self._put_blob(conn, full_output))
+            conn.commit()
+
+        # 增量追加向量索引（失败不影响主库）
+        try:
+            self._sync_vectors()
+        except Exception as e:
+            logger.warning(f"向量索引更新失败: {e}")
+        return entry_id
+
+    def _insert(self, conn, values: tuple, kind: str = "entry", entry_count: int = 1,
+                output_hash: str = "") -> int:
+        """插入一行并同步 FTS 索引，返回 rowid
+
+        values: (project, timestamp, user_msg, summary, files_changed, session_id, cost_usd, model)
+        """
+        cursor = conn.execute(
+            """INSERT INTO memories
+               (project, timestamp, user_msg, summary, files_changed, session_id, cost_usd, model,
+                kind, entry_count, output_hash)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (*values, kind, entry_count, output_hash)
         )
-        # 同步 FTS 索引
-        if self.fts_available:
-            conn.execute(
-                """INSERT INTO memories_fts(rowid, user_msg, summary)
-                   VALUES (?, ?, ?)""",
-                (cursor.lastrowid, user_msg, summary)
-            )
-        conn.commit()
-        conn.close()
+        self._fts_index(conn, cursor.lastrowid, values[2], values[3])
+        return cursor.lastrowid
 
-    def get_recent(self, project: str, n: int = 15) -> list[dict]:
-        """获取项目最近 N 条记忆"""
-        conn = self._get_conn()
-        rows = conn.execute(
-            """SELECT timestamp, user_msg, summary, files_changed, cost_usd, model
-               FROM memories WHERE project = ?
-               ORDER BY id DESC LIMIT ?""",
-            (project, n)
-        ).fetchall()
-        conn.close()
-        return [
-            {
-                "time": r[0],
-                "task": r[1],
-                "summary": r[2],
-                "files": json.loads(r[3]),
-                "cost": r[4],
-                "model": r[5],
-            }
-            for r in reversed(rows)  # 按时间正序返回
-        ]
+    @staticmethod
+    def _put_blob(conn, text: str) -> str:
+        """按 SHA-256 去重存储完整输出，返回哈希（空输出不存储，返回空串）"""
+        if not text:
+            return ""
+        raw = text.encode("utf-8")
+        digest = hashlib.sha256(raw).hexdigest()
+        if conn.execute("SELECT 1 FROM blobs WHERE hash = ?", (digest,)).fetchone():
+            return digest
+        packed = zlib.compress(raw, BLOB_COMPRESS_LEVEL)
+        codec = "zlib"
+        if len(packed) >= len(raw):
+            packed, codec = raw, "raw"
+        conn.execute(
+            "INSERT INTO blobs (hash, codec, size, data) VALUES (?, ?, ?, ?)",
+            (digest, codec, len(raw), packed)
+        )
+        return digest
+
+    def get_output(self, entry_id: int = 0, project: str = "") -> str | None:
+        """读取某次运行的完整输出；entry_id 为 0 时取该项目最近一次有输出的运行
+
+        已汇总进周报的记录从 archived_outputs 查找。
+        记录不存在、没有归档输出或输出已被体积上限淘汰时返回 None。
+        """
+        with self._get_conn() as conn:
+            if entry_id:
+                row = conn.execute(
+                    """SELECT b.codec, b.data FROM memories m JOIN blobs b ON b.hash = m.output_hash
+                       WHERE m.id = ?""",
+                    (entry_id,)
+                ).fetchone() or conn.execute(
+                    """SELECT b.codec, b.data FROM archived_outputs a JOIN blobs b ON b.hash = a.hash
+                       WHERE a.entry_id = ?""",
+                    (entry_id,)
+                ).fetchone()
+            else:
+                row = conn.execute(
+                    """SELECT b.codec, b.data FROM memories m JOIN blobs b ON b.hash = m.output_hash
+                       WHERE m.project = ? AND m.output_hash != ''
+                       ORDER BY m.id DESC LIMIT 1""",
+                    (project,)
+                ).fetchone()
+        if not row:
+            return None
+        codec, data = row
+        return (zlib.decompress(data) if codec == "zlib" else bytes(data)).decode("utf-8")
+
+    def _fts_index(self, conn, rowid: int, user_msg: str, summary: str, delete: bool = False):
+        """同步外部内容 FTS 索引（删除时必须提供原始内容）"""
+        if not self.fts_available:
+            return
+        for table in ("memories_fts", "memories_fts_word"):
+            if delete:
+                conn.execute(
+                    f"""INSERT INTO {table}({table}, rowid, user_msg, summary)
+                       VALUES ('delete', ?, ?, ?)""",
+                    (rowid, user_msg, summary)
+                )
+            else:
+                conn.execute(
+                    f"""INSERT INTO {table}(rowid, user_msg, summary)
+                       VALUES (?, ?, ?)""",
+                    (rowid, user_msg, summary)
+                )
+
+    def get_recent(self, project: str, n: int = 15, since_id: int = 0) -> list[dict]:
+        """获取项目最近 N 条记忆（不含周汇总行），since_id 限定只取 ID 不小于它的记录"""
+        with self._get_conn() as conn:
+            rows = conn.execute(
+                """SELECT id, timestamp, user_msg, summary, files_changed, cost_usd, model
+                   FROM memories WHERE project = ? AND kind = 'entry' AND id >= ?
+                   ORDER BY id DESC LIMIT ?""",
+                (project, since_id, n)
+            ).fetchall()
+        return [_entry_from_row(r) for r in reversed(rows)]  # 按时间正序返回
+
+    def get_digests(self, project: str, n: int = 8) -> list[dict]:
+        """获取项目最近 N 个汇总（周汇总 / 会话汇总），按时间正序"""
+        with self._get_conn() as conn:
+            rows = conn.execute(
+                """SELECT id, timestamp, user_msg, summary, files_changed, cost_usd, model
+                   FROM memories WHERE project = ? AND kind IN ('digest', 'session_digest')
+                   ORDER BY timestamp DESC, id DESC LIMIT ?""",
+                (project, n)
+            ).fetchall()
+        return [_entry_from_row(r) for r in reversed(rows)]
+
+    def save_session_digest(self, project: str, session_id: str, n: int) -> int | None:
+        """把 Claude 会话 session_id 最近 n 轮的记录汇总为一条会话汇总，返回其 ID；无记录时返回 None
+
+        只取该会话自己的记录（同项目里其他 chat 的并发会话不混进来）。
+        原始记录保留不动（仍可 /detail、/search），会话汇总进入下一个新会话的稳定前缀。
+        kind 记为 'session_digest'：不计入周汇总统计，也不会被周压缩当作周汇总合并。
+        """
+        if not session_id:
+            return None
+        with self._get_conn() as conn:
+            rows = conn.execute(
+                """SELECT user_msg, summary, files_changed, cost_usd
+                   FROM memories WHERE project = ? AND kind = 'entry' AND session_id = ?
+                   ORDER BY id DESC LIMIT ?""",
+                (project, session_id, n)
+            ).fetchall()[::-1]
+            if not rows:
+                return None
+            files = list(dict.fromkeys(f for r in rows for f in json.loads(r[2])))
+            summary = _digest_summary([r[0] for r in rows])
+            if rows[-1][1]:
+                summary += f"\n最后结论: {rows[-1][1].strip()[:300]}"
+            # 原始记录仍在库中：entry_count / cost 记 0，避免统计重复计数
+            cost = sum(r[3] or 0 for r in rows)
+            digest_id = self._insert(conn, (
+                project,
+                datetime.now().isoformat(),
+                f"会话汇总 {datetime.now():%Y-%m-%d}（{len(rows)} 轮，${cost:.2f}）",
+                summary,
+                json.dumps(files[:DIGEST_MAX_FILES]),
+                "",
+                0,
+                "",
+            ), kind="session_digest", entry_count=0)
+            conn.commit()
+
+        try:
+            self._sync_vectors()
+        except Exception as e:
+            logger.warning(f"向量索引更新失败: {e}")
+        return digest_id
+
+    def top_files(self, project: str, n: int = 10) -> list[tuple[str, int]]:
+        """项目记忆中改动次数最多的文件 [(路径, 次数)]，次数相同按路径排序（结果稳定）"""
+        with self._get_conn() as conn:
+            try:
+                return conn.execute(
+                    """SELECT f.value, COUNT(*) AS c
+                       FROM memories m, json_each(m.files_changed) f
+                       WHERE m.project = ?
+                       GROUP BY f.value ORDER BY c DESC, f.value LIMIT ?""",
+                    (project, n)
+                ).fetchall()
+            except sqlite3.OperationalError:
+                # 不含 JSON1 扩展的 SQLite
+                return []
+
+    def revision(self, project: str) -> tuple[int, int]:
+        """项目记忆的版本标识 (最大 ID, 行数)：新增、汇总、淘汰都会使其变化"""
+        with self._get_conn() as conn:
+            row = conn.execute(
+                "SELECT MAX(id), COUNT(*) FROM memories WHERE project = ?", (project,)
+            ).fetchone()
+        return row[0] or 0, row[1]
+
+    def related(self, project: str, text: str, limit: int = 30) -> list[dict]:
+        """按与 text 的相关性召回记忆（bm25 over FTS，任一词命中即可）
+
+        返回的每条记录带 rank 字段（bm25 分数，越小越相关）。FTS 不可用时返回空列表。
+        """
+        with self._get_conn() as conn:
+            if not self.fts_available:
+                return []
+            trigram = self.fts_tokenizer == "trigram"
+            terms = _related_terms(text, trigram)
+            if not terms:
+                return []
+            table = "memories_fts" if trigram else "memories_fts_word"
+            match = " OR ".join(_match_expr([t]) for t in terms)
+
+            try:
+                bound = self._rank_bound(conn, table, match)
+                sql = f"""SELECT m.id, m.timestamp, m.user_msg, m.summary, m.files_changed,
+                                 m.cost_usd, m.model, bm25({table}, 2.0, 1.0) AS score
+                          FROM {table}
+                          JOIN memories m ON {table}.rowid = m.id
+                          WHERE {table} MATCH ? AND m.project = ?"""
+                params = [match, project]
+                if bound:
+                    sql += f" AND {table}.rowid >= ?"
+                    params.append(bound)
+                sql += " ORDER BY score LIMIT ?"
+                params.append(limit)
+                rows = conn.execute(sql, params).fetchall()
+            except sqlite3.OperationalError as e:
+                logger.debug(f"相关记忆召回失败: {e}")
+                rows = []
+
+        results = []
+        for r in rows:
+            entry = _entry_from_row(r[:7])
+            entry["rank"] = r[7]
+            results.append(entry)
+        return results
+
+    def _rank_bound(self, conn, table: str, match: str) -> int:
+        """命中数超过 RANK_CANDIDATES 时，返回参与打分的最小 rowid（否则 0）"""
+        row = conn.execute(
+            f"""SELECT rowid FROM {table} WHERE {table} MATCH ?
+                ORDER BY rowid DESC LIMIT 1 OFFSET ?""",
+            (match, RANK_CANDIDATES - 1)
+        ).fetchone()
+        return row[0] if row else 0
 
     def search(self, query: str, project: str = "", limit: int = 10) -> list[dict]:
-        """全文搜索记忆（FTS5 优先，中文回退 LIKE）"""
-        conn = self._get_conn()
-        rows = self._fts_search(conn, query, project, limit)
-        # FTS5 对中文分词不佳，无结果时回退 LIKE
-        if not rows:
-            rows = self._like_search(conn, query, project, limit)
-        conn.close()
-        return [
-            {"time": r[0], "task": r[1], "summary": r[2], "project": r[3]}
+        """全文搜索记忆（trigram 索引优先，短查询走 unicode61，bm25 排序）"""
+        terms = query.split()
+        if not terms:
+            return []
+        short = min(len(t) for t in terms) < TRIGRAM_MIN_LEN
+
+        with self._get_conn() as conn:
+            rows = []
+            if self.fts_available:
+                if short or self.fts_tokenizer != "trigram":
+                    rows = self._fts_search(conn, "memories_fts_word", _match_expr(terms, prefix=True), project, limit)
+                else:
+                    rows = self._fts_search(conn, "memories_fts", _match_expr(terms), project, limit)
+            # trigram 对 >=3 字符的子串是完备的；仅 FTS 不可用或短查询无结果时回退 LIKE
+            if not rows and (short or not self.fts_available):
+                rows = self._like_search(conn, query, project, limit)
+        results = [
+            {
+                "id": r[0],
+                "time": r[1],
+                "task": r[2],
+                "summary": r[3],
+                "project": r[4],
+                "snippet": r[5],
+                "rank": r[6],
+            }
             for r in rows
         ]
 
-    def _fts_search(self, conn, query: str, project: str, limit: int) -> list:
-        """FTS5 全文搜索"""
+        # 字面命中不足时，用向量相似度补充（无共同关键词也能找到）
+        if len(results) < limit:
+            seen = {r["id"] for r in results}
+            for e in self.similar(project, query, limit=limit):
+                if len(results) >= limit:
+                    break
+                if e["id"] not in seen:
+                    results.append({
+                        "id": e["id"],
+                        "time": e["time"],
+                        "task": e["task"],
+                        "summary": e["summary"],
+                        "project": e["project"],
+                        "snippet": f"≈ {e['summary']}",
+                        "rank": 0,
+                    })
+        return results
+
+    def similar(self, project: str, text: str, limit: int = 10) -> list[dict]:
+        """向量相似检索，返回带 similarity 字段的记忆（相似度降序）"""
+        return self.similar_many(project, [text], limit=limit)[0]
+
+    def similar_many(self, project: str, texts: list[str], limit: int = 10) -> list[list[dict]]:
+        """批量向量相似检索（一次矩阵扫描处理多个查询）"""
+        if not self.vectors.available:
+            return [[] for _ in texts]
         try:
-            if project:
-                return conn.execute(
-                    """SELECT m.timestamp, m.user_msg, m.summary, m.project
-                       FROM memories_fts fts
-                       JOIN memories m ON fts.rowid = m.id
-                       WHERE memories_fts MATCH ? AND m.project = ?
-                       ORDER BY rank LIMIT ?""",
-                    (query, project, limit)
-                ).fetchall()
-            else:
-                return conn.execute(
-                    """SELECT m.timestamp, m.user_msg, m.summary, m.project
-                       FROM memories_fts fts
-                       JOIN memories m ON fts.rowid = m.id
-                       WHERE memories_fts MATCH ?
-                       ORDER BY rank LIMIT ?""",
-                    (query, limit)
-                ).fetchall()
-        except Exception:
+            self._sync_vectors()
+            # 多取一些，过滤掉其他项目的记录后仍够 limit 条
+            hits = self.vectors.search(texts, k=limit * 3, min_score=MIN_SIMILARITY)
+        except Exception as e:
+            logger.warning(f"向量检索失败: {e}")
+            return [[] for _ in texts]
+
+        ids = {entry_id for per_query in hits for entry_id, _ in per_query}
+        if not ids:
+            return [[] for _ in texts]
+        placeholders = ",".join("?" * len(ids))
+        sql = f"""SELECT id, timestamp, user_msg, summary, files_changed, cost_usd, model, project
+                  FROM memories WHERE id IN ({placeholders})"""
+        params = list(ids)
+        if project:
+            sql += " AND project = ?"
+            params.append(project)
+        with self._get_conn() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        by_id = {r[0]: {**_entry_from_row(r[:7]), "project": r[7]} for r in rows}
+
+        results = []
+        for per_query in hits:
+            entries = []
+            for entry_id, score in per_query:
+                if entry_id in by_id and len(entries) < limit:
+                    entries.append({**by_id[entry_id], "similarity": score})
+            results.append(entries)
+        return results
+
+    def _sync_vectors(self):
+        """把尚未进入向量索引的记录追加进去（首次使用时回填旧数据）"""
+        if not self.vectors.available:
+            return
+        # 持锁完成「读取增量 + 追加」，避免并发线程重复追加同一批记录
+        with self._get_conn() as conn:
+            if not self._vectors_synced and self.vectors.last_id() > self._max_id():
+                # 数据库被替换或回滚过，索引作废
+                self.vectors.rebuild([])
+            rows = conn.execute(
+                "SELECT id, user_msg, summary FROM memories WHERE id > ? ORDER BY id",
+                (self.vectors.last_id(),)
+            ).fetchall()
+            if rows:
+                self.vectors.add_many([(r[0], f"{r[1]} {r[2]}") for r in rows])
+            self._vectors_synced = True
+
+    def _max_id(self) -> int:
+        with self._get_conn() as conn:
+            row = conn.execute("SELECT MAX(id) FROM memories").fetchone()
+        return row[0] or 0
+
+    def _fts_search(self, conn, table: str, match: str, project: str, limit: int) -> list:
+        """FTS5 全文搜索，bm25 排序（user_msg 权重高于 summary）并返回高亮摘录"""
+        try:
+            bound = self._rank_bound(conn, table, match)
+        except sqlite3.OperationalError as e:
+            logger.debug(f"FTS 查询失败 ({match}): {e}")
+            return []
+
+        sql = f"""SELECT m.id, m.timestamp, m.user_msg, m.summary, m.project,
+                         snippet({table}, -1, ?, ?, '…', ?),
+                         bm25({table}, 2.0, 1.0) AS score
+                  FROM {table}
+                  JOIN memories m ON {table}.rowid = m.id
+                  WHERE {table} MATCH ?"""
+        # trigram 的 token 是 3 字符滑窗，摘录需要更多 token 才能覆盖同样长度
+        snippet_tokens = 48 if table == "memories_fts" and self.fts_tokenizer == "trigram" else 16
+        params = [HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE, snippet_tokens, match]
+        if bound:
+            sql += f" AND {table}.rowid >= ?"
+            params.append(bound)
+        if project:
+            sql += " AND m.project = ?"
+            params.append(project)
+        sql += " ORDER BY score LIMIT ?"
+        params.append(limit)
+        try:
+            return conn.execute(sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            logger.debug(f"FTS 查询失败 ({match}): {e}")
             return []
 
     def _like_search(self, conn, query: str, project: str, limit: int) -> list:
-        """LIKE 模糊搜索（中文回退）"""
+        """LIKE 模糊搜索（FTS5 不可用或短查询回退）"""
         pattern = f"%{query}%"
         if project:
             return conn.execute(
-                """SELECT timestamp, user_msg, summary, project
+                """SELECT id, timestamp, user_msg, summary, project, summary, 0
                    FROM memories
                    WHERE (user_msg LIKE ? OR summary LIKE ?) AND project = ?
                    ORDER BY id DESC LIMIT ?""",
@@ -161,7 +644,7 @@ class MemoryStore:
             ).fetchall()
         else:
             return conn.execute(
-                """SELECT timestamp, user_msg, summary, project
+                """SELECT id, timestamp, user_msg, summary, project, summary, 0
                    FROM memories
                    WHERE user_msg LIKE ? OR summary LIKE ?
                    ORDER BY id DESC LIMIT ?""",
@@ -169,33 +652,349 @@ class MemoryStore:
             ).fetchall()
 
     def get_stats(self, project: str = "") -> dict:
-        """获取记忆统计"""
-        conn = self._get_conn()
-        if project:
-            row = conn.execute(
-                "SELECT COUNT(*), SUM(cost_usd) FROM memories WHERE project = ?",
-                (project,)
-            ).fetchone()
-        else:
-            row = conn.execute(
-                "SELECT COUNT(*), SUM(cost_usd) FROM memories"
-            ).fetchone()
-        conn.close()
+        """获取记忆统计（count 含已汇总进周报的原始条数）"""
+        sql = """SELECT SUM(entry_count), SUM(cost_usd), COUNT(*),
+                        SUM(CASE WHEN kind = 'digest' THEN 1 ELSE 0 END),
+                        SUM(CASE WHEN kind = 'session_digest' THEN 1 ELSE 0 END)
+                 FROM memories"""
+        with self._get_conn() as conn:
+            if project:
+                row = conn.execute(sql + " WHERE project = ?", (project,)).fetchone()
+            else:
+                row = conn.execute(sql).fetchone()
+            last = conn.execute("SELECT value FROM meta WHERE key = 'last_compaction'").fetchone()
+            blobs = conn.execute("SELECT COUNT(*), SUM(size), SUM(LENGTH(data)) FROM blobs").fetchone()
         return {
             "count": row[0] or 0,
             "total_cost": round(row[1] or 0, 4),
+            "rows": row[2] or 0,
+            "digests": row[3] or 0,
+            "session_digests": row[4] or 0,
+            "db_size": self._db_size(),
+            "last_compaction": last[0] if last else "",
+            "outputs": blobs[0] or 0,
+            "output_bytes": blobs[1] or 0,
+            "output_stored_bytes": blobs[2] or 0,
         }
 
+    def _db_size(self) -> int:
+        """数据库文件（含 WAL）字节数"""
+        return sum(
+            os.path.getsize(p) for p in (self.db_path, self.db_path + "-wal")
+            if os.path.exists(p)
+        )
+
+    # ========== 压缩 / 保留策略 ==========
+
+    def compact(self, older_than_days: int = 30, max_rows: int = 5000, max_db_mb: float = 50,
+                full_vacuum: bool = False) -> dict:
+        """把超过 older_than_days 天的记录按周汇总为 digest 行，并执行行数/体积上限
+
+        每周一个事务，可在 Bot 服务期间于后台线程运行（WAL 模式下不阻塞读取）。
+        full_vacuum：旧库尚未开启增量 VACUUM 时整库重写一次以切换（持排他锁，只在 /memory compact 时做）。
+        返回 {"rolled": 汇总的原始行数, "digests": 新增/更新的周汇总数, "pruned": 淘汰行数}
+        """
+        cutoff = (datetime.now() - timedelta(days=older_than_days)).isoformat()
+        with self._get_conn():
+            pass  # 确保已建表
+        # 独立连接：压缩期间不占用持久连接的锁，前台读写照常进行
+        conn = self._open()
+        try:
+            rolled, digests = self._rollup_weeks(conn, cutoff)
+            pruned = self._enforce_caps(conn, max_rows, int(max_db_mb * 1024 * 1024), full_vacuum)
+            self._incremental_vacuum(conn, full_vacuum)
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('last_compaction', ?)",
+                (datetime.now().isoformat(timespec="seconds"),)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+        if rolled or pruned:
+            self._reindex_vectors()
+        logger.info(f"记忆压缩完成 {self.db_path}: 汇总 {rolled} 条 -> {digests} 周, 淘汰 {pruned} 行")
+        return {"rolled": rolled, "digests": digests, "pruned": pruned}
+
+    def _rollup_weeks(self, conn, cutoff: str) -> tuple[int, int]:
+        """按 (项目, ISO 周) 汇总 cutoff 之前的原始记录"""
+        rows = conn.execute(
+            """SELECT id, project, timestamp, user_msg, summary, files_changed, cost_usd, output_hash
+               FROM memories WHERE kind = 'entry' AND timestamp < ?
+               ORDER BY id""",
+            (cutoff,)
+        ).fetchall()
+
+        weeks: dict[tuple[str, str], list] = {}
+        for r in rows:
+            weeks.setdefault((r[1], _week_start(r[2])), []).append(r)
+
+        for (project, week), week_rows in weeks.items():
+            tasks = [r[3] for r in week_rows]
+            files = list(dict.fromkeys(f for r in week_rows for f in json.loads(r[5])))
+            cost = sum(r[6] or 0 for r in week_rows)
+
+            existing = conn.execute(
+                """SELECT id, user_msg, summary, files_changed, cost_usd, entry_count
+                   FROM memories WHERE project = ? AND kind = 'digest' AND timestamp = ?""",
+                (project, week)
+            ).fetchone()
+            count = len(week_rows)
+            if existing:
+                # 同一周此前已部分汇总：合并
+                self._fts_index(conn, existing[0], existing[1], existing[2], delete=True)
+                conn.execute("DELETE FROM memories WHERE id = ?", (existing[0],))
+                files = list(dict.fromkeys(json.loads(existing[3]) + files))
+                cost += existing[4] or 0
+                count += existing[5]
+
+            digest_id = self._insert(conn, (
+                project,
+                week,
+                f"周汇总 {week[:10]}（{count} 条）",
+                _digest_summary(tasks, previous=existing[2] if existing else ""),
+                json.dumps(files[:DIGEST_MAX_FILES]),
+                "",
+                cost,
+                "",
+            ), kind="digest", entry_count=count)
+            # 完整输出的引用转到周汇总名下，/detail <原 id> 仍可查看
+            if existing:
+                conn.execute("UPDATE archived_outputs SET digest_id = ? WHERE digest_id = ?",
+                             (digest_id, existing[0]))
+            conn.executemany(
+                "INSERT OR REPLACE INTO archived_outputs (entry_id, digest_id, hash) VALUES (?, ?, ?)",
+                [(r[0], digest_id, r[7]) for r in week_rows if r[7]]
+            )
+            self._delete_rows(conn, [(r[0], r[3], r[4]) for r in week_rows])
+            conn.commit()
+
+        return len(rows), len(weeks)
+
+    def _enforce_caps(self, conn, max_rows: int, max_bytes: int, full_vacuum: bool = False) -> int:
+        """超过行数或体积上限时，从最旧的行开始淘汰
+
+        超过体积上限时先淘汰已汇总记录的完整输出（记忆行保留），仍超限再淘汰行。
+        未开启增量 VACUUM 的旧库删行也不会缩小文件，此时跳过体积上限。
+        """
+        pruned = 0
+        while True:
+            total = conn.execute("SELECT COUNT(*) FROM memories").fetchone()[0]
+            if not total:
+                break
+            if total > max_rows:
+                excess = total - max_rows
+            elif self._db_size() > max_bytes:
+                if not self._incremental_vacuum(conn, full_vacuum):
+                    logger.warning(f"记忆库超过体积上限但未开启增量 VACUUM，"
+                                   f"/memory compact 可整库重写一次以启用: {self.db_path}")
+                    break
+                if self._db_size() <= max_bytes:
+                    break
+                if self._drop_archived_outputs(conn):
+                    continue
+                excess = max(total // 10, 1)
+            else:
+                break
+            rows = conn.execute(
+                "SELECT id, user_msg, summary FROM memories ORDER BY timestamp, id LIMIT ?",
+                (excess,)
+            ).fetchall()
+            self._delete_rows(conn, rows)
+            conn.commit()
+            pruned += len(rows)
+        return pruned
+
+    def _drop_archived_outputs(self, conn) -> int:
+        """淘汰最旧的一成已汇总记录的完整输出，返回淘汰数（没有可淘汰的返回 0）"""
+        total = conn.execute("SELECT COUNT(*) FROM archived_outputs").fetchone()[0]
+        if not total:
+            return 0
+        excess = max(total // 10, 1)
+        conn.execute(
+            """DELETE FROM archived_outputs WHERE entry_id IN
+               (SELECT entry_id FROM archived_outputs ORDER BY entry_id LIMIT ?)""",
+            (excess,)
+        )
+        self._drop_unreferenced_blobs(conn)
+        conn.commit()
+        return excess
+
+    def _delete_rows(self, conn, rows: list):
+        """删除 (id, user_msg, summary) 行并从 FTS 索引中移除，清理不再被引用的完整输出
+
+        被删的周汇总名下的已汇总输出一并删除。
+        """
+        for entry_id, user_msg, summary in rows:
+            self._fts_index(conn, entry_id, user_msg, summary, delete=True)
+        ids = [(r[0],) for r in rows]
+        conn.executemany("DELETE FROM memories WHERE id = ?", ids)
+        conn.executemany("DELETE FROM archived_outputs WHERE digest_id = ?", ids)
+        self._drop_unreferenced_blobs(conn)
+
+    @staticmethod
+    def _drop_unreferenced_blobs(conn):
+        conn.execute(
+            """DELETE FROM blobs WHERE hash NOT IN (SELECT output_hash FROM memories)
+               AND hash NOT IN (SELECT hash FROM archived_outputs)"""
+        )
+
+    def _incremental_vacuum(self, conn, full_vacuum: bool = False) -> bool:
+        """归还空闲页，返回是否处于增量模式
+
+        旧库需整库 VACUUM 才能切换到增量模式：重写整个文件并持排他锁，前台读写会卡住，
+        所以只在 full_vacuum（/memory compact）时做；后台压缩遇到旧库只做 WAL checkpoint。
+        """
+        conn.commit()
+        incremental = conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        if not incremental and full_vacuum:
+            logger.info(f"记忆库切换到增量 VACUUM，整库重写（{self._db_size() / 1024:.0f}KB）: {self.db_path}")
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            incremental = True
+        if incremental:
+            conn.execute("PRAGMA incremental_vacuum")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return incremental
+
+    def _reindex_vectors(self):
+        """压缩删除了行，重建向量索引（新文件写完后原子替换）"""
+        if not self.vectors.available:
+            return
+        with self._get_conn() as conn:
+            rows = conn.execute("SELECT id, user_msg, summary FROM memories ORDER BY id").fetchall()
+        self.vectors.rebuild([(r[0], f"{r[1]} {r[2]}") for r in rows])
+
 
 class ProjectMemoryManager:
-    """按项目路径管理 MemoryStore 实例"""
+    """按项目路径管理 MemoryStore 实例
 
-    def __init__(self):
-        self._stores = {}
+    最多保持 capacity 个 store 打开（LRU），被淘汰的 store 关闭连接；
+    仍持有其引用的调用方继续使用时会自动重连，不会出错。
+    """
+
+    def __init__(self, capacity: int = DEFAULT_MAX_OPEN_STORES):
+        self.capacity = max(1, capacity)
+        self._stores: OrderedDict[str, MemoryStore] = OrderedDict()
+        # 已淘汰但仍被调用方引用的 store：再次获取时复用，保证每个路径只有一个实例
+        self._live: weakref.WeakValueDictionary[str, MemoryStore] = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
 
     def get_store(self, project_path: str):
         """获取项目对应的 MemoryStore（自动创建）"""
-        if project_path not in self._stores:
-            db_path = os.path.join(project_path, ".724code", "memories.db")
-            self._stores[project_path] = MemoryStore(db_path)
-        return self._stores[project_path]
+        with self._lock:
+            store = self._stores.get(project_path)
+            if store is not None:
+                self._stores.move_to_end(project_path)
+                return store
+            store = self._live.get(project_path)
+            if store is None:
+                store = MemoryStore(os.path.join(project_path, ".724code", "memories.db"))
+                self._live[project_path] = store
+            self._stores[project_path] = store
+            evicted = []
+            while len(self._stores) > self.capacity:
+                evicted.append(self._stores.popitem(last=False)[1])
+        for old in evicted:
+            old.close()
+        return store
+
+    def close_all(self):
+        """关闭所有打开的 store（退出时调用）"""
+        with self._lock:
+            stores = list(self._stores.values())
+            self._stores.clear()
+        for store in stores:
+            store.close()
+
+    def search_all(self, projects: dict[str, str], query: str, limit: int = 10) -> list[dict]:
+        """跨项目搜索：线程池并发查询各项目记忆库，按 bm25 合并取前 limit 条
+
+        projects: {项目名: 项目路径}，只查询已产生过记忆的项目。
+        结果的 project 字段为项目名；LIKE / 向量补充结果（rank 为 0）排在 bm25 命中之后。
+        """
+        targets = {
+            name: path for name, path in projects.items()
+            if os.path.exists(os.path.join(path, ".724code", "memories.db"))
+        }
+        if not targets:
+            return []
+
+        def _search_one(item):
+            name, path = item
+            try:
+                hits = self.get_store(path).search(query, limit=limit)
+            except Exception as e:
+                logger.warning(f"搜索项目 {name} 失败: {e}")
+                return []
+            return [{**h, "project": name} for h in hits]
+
+        with ThreadPoolExecutor(max_workers=min(SEARCH_WORKERS, len(targets))) as pool:
+            merged = [h for hits in pool.map(_search_one, targets.items()) for h in hits]
+
+        # bm25 越小越相关；非 bm25 结果（rank 0）按时间倒序排在后面
+        merged.sort(key=lambda h: (h["rank"] >= 0, h["rank"], _neg_time(h["time"])))
+        return merged[:limit]
+
+
+def _neg_time(timestamp: str) -> float:
+    """排序键：时间越新越靠前"""
+    try:
+        return -datetime.fromisoformat(timestamp).timestamp()
+    except ValueError:
+        return 0.0
+
+
+def _entry_from_row(r) -> dict:
+    """(id, timestamp, user_msg, summary, files_changed, cost_usd, model) -> 记忆 dict"""
+    return {
+        "id": r[0],
+        "time": r[1],
+        "task": r[2],
+        "summary": r[3],
+        "files": json.loads(r[4]),
+        "cost": r[5],
+        "model": r[6],
+    }
+
+
+def _week_start(timestamp: str) -> str:
+    """时间戳所在 ISO 周的周一 00:00（周汇总行的 timestamp）"""
+    day = datetime.fromisoformat(timestamp).date()
+    monday = day - timedelta(days=day.weekday())
+    return datetime(monday.year, monday.month, monday.day).isoformat()
+
+
+def _digest_summary(tasks: list[str], previous: str = "") -> str:
+    """把一周的任务拼成汇总摘要（previous 为同周已有摘要），超长时截断并注明剩余条数"""
+    parts = [previous] if previous else []
+    length = len(previous)
+    for i, task in enumerate(tasks):
+        item = task.strip().replace("\n", " ")[:60]
+        if length + len(item) > DIGEST_SUMMARY_CHARS:
+            parts.append(f"… 等 {len(tasks) - i} 项")
+            break
+        parts.append(item)
+        length += len(item) + 2
+    return "; ".join(parts)
+
+
+def _related_terms(text: str, trigram: bool) -> list[str]:
+    """从自然语言 prompt 中提取召回用的词
+
+    英文/路径按词切分；中文连续片段在 trigram 索引下切成 3 字滑窗，
+    使"修复登录验证"这类无空格文本也能按字面重叠度召回。
+    """
+    terms = [w.lower() for w in _ASCII_WORD_RE.findall(text) if len(w) >= TRIGRAM_MIN_LEN]
+    for run in _CJK_RUN_RE.findall(text):
+        if not trigram:
+            terms.append(run)
+        elif len(run) >= TRIGRAM_MIN_LEN:
+            terms.extend(run[i:i + TRIGRAM_MIN_LEN] for i in range(len(run) - TRIGRAM_MIN_LEN + 1))
+    return list(dict.fromkeys(terms))[:MAX_RELATED_TERMS]
+
+
+def _match_expr(terms: list[str], prefix: bool = False) -> str:
+    """将用户输入转为安全的 FTS5 MATCH 表达式（每个词作为短语，隐式 AND）"""
+    suffix = "*" if prefix else ""
+    return " ".join('"' + t.replace('"', '""') + '"' + suffix for t in terms)
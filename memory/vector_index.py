@@ -0,0 +1,219 @@
+"""本地向量索引 — 字符 n-gram 哈希 TF-IDF + NumPy 内存映射矩阵
+
+不依赖任何模型或网络，给记忆提供"模糊相似"检索：
+字面不完全相同（auth / authentication、登录 / 登陆验证）也能召回。
+
+每个项目一份，与 memories.db 放在同一目录：
+  vectors.f32     N × DIM float32 矩阵（对数词频，按行追加，np.memmap 读取）
+  vectors.ids     N 个 int64 记忆 ID
+  vectors.df      int64[DIM]，各哈希桶的文档频率（计算 IDF）
+
+IDF 在查询时才施加，因此追加新记录无需重写已有向量。行向量在 IDF 加权下的
+范数缓存在内存里，记录数翻倍（IDF 明显漂移）时才整体重算。
+"""
+
+import logging
+import os
+import re
+import threading
+import zlib
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 可选：缺失时向量索引不可用，其余功能不受影响
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# 向量维度（哈希桶数）；10 万条记录约占 400MB 磁盘，按需分页读取
+DIM = 1024
+
+# 字符 n-gram 长度；中文单字本身有语义，额外计入 unigram
+NGRAM_SIZES = (2, 3)
+
+# 计算行范数时每批处理的行数，控制临时内存
+CHUNK_ROWS = 8192
+
+_WS_RE = re.compile(r"\s+")
+_CJK_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]")
+
+
+class VectorIndex:
+    def __init__(self, dir_path: str):
+        self.available = np is not None
+        self.vec_path = os.path.join(dir_path, "vectors.f32")
+        self.ids_path = os.path.join(dir_path, "vectors.ids")
+        self.df_path = os.path.join(dir_path, "vectors.df")
+        self._df = None          # np.ndarray[DIM] 文档频率
+        self._ids = None         # np.ndarray[N] 记忆 ID
+        self._matrix = None      # np.memmap[N, DIM]
+        self._norms = None       # np.ndarray[N] IDF 加权后的行范数
+        self._norms_idf = None   # 计算范数时使用的 IDF
+        self._norms_base = 0     # 上次整体重算范数时的记录数
+        self._lock = threading.Lock()  # 后台压缩线程重建索引时与前台读写互斥
+        if not self.available:
+            logger.warning("NumPy 未安装，向量相似检索不可用（pip install numpy）")
+
+    def __len__(self) -> int:
+        if not self.available:
+            return 0
+        with self._lock:
+            self._load()
+            return len(self._ids)
+
+    def last_id(self) -> int:
+        """已索引的最大记忆 ID（用于增量补齐）"""
+        if not self.available:
+            return 0
+        with self._lock:
+            self._load()
+            return int(self._ids[-1]) if len(self._ids) else 0
+
+    def add(self, entry_id: int, text: str):
+        """追加一条记录"""
+        self.add_many([(entry_id, text)])
+
+    def add_many(self, items: list[tuple[int, str]]):
+        """批量追加记录（ID 需递增）"""
+        if not self.available or not items:
+            return
+        vecs = np.stack([_tf_vector(text) for _, text in items])
+        ids = np.array([entry_id for entry_id, _ in items], dtype=np.int64)
+        with self._lock:
+            self._load()
+            self._append(self.vec_path, self.ids_path, self.df_path, vecs, ids, self._df)
+            self._df = self._df + (vecs > 0).sum(axis=0)
+            self._ids = np.concatenate([self._ids, ids])
+            self._matrix = None  # 文件已增长，下次查询重新映射
+
+    def rebuild(self, items: list[tuple[int, str]]):
+        """丢弃现有索引并从头重建（先写临时文件，再原子替换）"""
+        if not self.available:
+            return
+        tmp = [p + ".tmp" for p in (self.vec_path, self.ids_path, self.df_path)]
+        for path in tmp:
+            if os.path.exists(path):
+                os.remove(path)
+        df = np.zeros(DIM, dtype=np.int64)
+        for start in range(0, len(items), CHUNK_ROWS):
+            batch = items[start:start + CHUNK_ROWS]
+            vecs = np.stack([_tf_vector(text) for _, text in batch])
+            ids = np.array([entry_id for entry_id, _ in batch], dtype=np.int64)
+            self._append(*tmp, vecs, ids, df)
+            df = df + (vecs > 0).sum(axis=0)
+        _save_df(tmp[2], df)
+
+        with self._lock:
+            for src, dst in zip(tmp, (self.vec_path, self.ids_path, self.df_path)):
+                if os.path.exists(src):
+                    os.replace(src, dst)
+                elif os.path.exists(dst):
+                    os.remove(dst)
+            self._df = self._ids = self._matrix = self._norms = None
+
+    def close(self):
+        """释放内存映射与缓存（下次使用时重新加载）"""
+        with self._lock:
+            self._df = self._ids = self._matrix = self._norms = None
+
+    @staticmethod
+    def _append(vec_path: str, ids_path: str, df_path: str, vecs, ids, df):
+        with open(vec_path, "ab") as f:
+            f.write(vecs.tobytes())
+        with open(ids_path, "ab") as f:
+            f.write(ids.tobytes())
+        _save_df(df_path, df + (vecs > 0).sum(axis=0))
+
+    def search(self, queries: list[str], k: int = 10, min_score: float = 0.0) -> list[list[tuple[int, float]]]:
+        """批量余弦 top-k，返回每个查询的 [(记忆 ID, 相似度), ...]（相似度降序）"""
+        if not self.available or not queries:
+            return [[] for _ in queries]
+        with self._lock:
+            self._load()
+            n = len(self._ids)
+            if not n:
+                return [[] for _ in queries]
+            ids = self._ids
+            matrix = self._mapped(n)
+            norms, idf = self._row_norms(matrix, n)
+
+        # cos(q·idf, d·idf) = (d · (q̂·idf)) / |d·idf|，q̂ 为 IDF 加权后归一化的查询
+        q = np.stack([_tf_vector(text) for text in queries]) * idf
+        q_norm = np.linalg.norm(q, axis=1, keepdims=True)
+        q = np.divide(q, q_norm, out=np.zeros_like(q), where=q_norm > 0) * idf
+        scores = (q @ matrix.T) / norms
+
+        results = []
+        kk = min(k, n)
+        for row in scores:
+            top = np.argpartition(-row, kk - 1)[:kk]
+            top = top[np.argsort(-row[top])]
+            results.append([
+                (int(ids[i]), float(row[i])) for i in top if row[i] > min_score
+            ])
+        return results
+
+    def _row_norms(self, matrix, n: int):
+        """IDF 加权后的行范数（增量补齐新行，记录数翻倍时整体重算）"""
+        if self._norms is None or n >= 2 * max(self._norms_base, 1) or len(self._norms) > n:
+            self._norms_idf = np.log((1 + n) / (1 + self._df)).astype(np.float32) + 1.0
+            self._norms = np.empty(0, dtype=np.float32)
+            self._norms_base = n
+        idf = self._norms_idf
+        parts = [self._norms]
+        for start in range(len(self._norms), n, CHUNK_ROWS):
+            parts.append(np.linalg.norm(matrix[start:min(start + CHUNK_ROWS, n)] * idf, axis=1))
+        self._norms = np.concatenate(parts)
+        self._norms[self._norms == 0] = 1.0
+        return self._norms, idf
+
+    def _load(self):
+        """加载 ID 与文档频率；两个文件长度不一致（写入中断）时截到一致"""
+        if self._ids is not None:
+            return
+        ids = np.fromfile(self.ids_path, dtype=np.int64) if os.path.exists(self.ids_path) else np.zeros(0, np.int64)
+        rows = os.path.getsize(self.vec_path) // (DIM * 4) if os.path.exists(self.vec_path) else 0
+        n = min(len(ids), rows)
+        if n != len(ids) or n != rows:
+            logger.warning(f"向量索引不一致，截断到 {n} 行: {self.vec_path}")
+            for path, size in ((self.ids_path, n * 8), (self.vec_path, n * DIM * 4)):
+                if os.path.exists(path):
+                    with open(path, "r+b") as f:
+                        f.truncate(size)
+            if os.path.exists(self.df_path):
+                os.remove(self.df_path)
+        df = np.fromfile(self.df_path, dtype=np.int64) if os.path.exists(self.df_path) else None
+        if df is None or len(df) != DIM:
+            df = np.zeros(DIM, dtype=np.int64)
+            if n:
+                # 文档频率丢失或损坏时从矩阵重算
+                df = (self._mapped(n) > 0).sum(axis=0).astype(np.int64)
+                _save_df(self.df_path, df)
+        # 全部加载成功后再赋值，中途失败下次会重新加载
+        self._df = df
+        self._ids = ids[:n]
+
+    def _mapped(self, n: int):
+        if self._matrix is None or len(self._matrix) != n:
+            self._matrix = np.memmap(self.vec_path, dtype=np.float32, mode="r", shape=(n, DIM))
+        return self._matrix
+
+
+def _save_df(path: str, df):
+    # 原始 int64 写入：np.save 会给非 .npy 结尾的路径追加后缀，且 np.load 解析头部在多线程下不安全
+    df.astype(np.int64).tofile(path)
+
+
+def _tf_vector(text: str):
+    """字符 n-gram 哈希到 DIM 个桶，对数词频 log(1 + tf)"""
+    vec = np.zeros(DIM, dtype=np.float32)
+    norm = _WS_RE.sub(" ", text.lower()).strip()
+    for ch in _CJK_RE.findall(norm):
+        vec[zlib.crc32(ch.encode("utf-8")) % DIM] += 1.0
+    for n in NGRAM_SIZES:
+        for i in range(len(norm) - n + 1):
+            gram = norm[i:i + n]
+            if gram.strip():
+                vec[zlib.crc32(gram.encode("utf-8")) % DIM] += 1.0
+    np.log1p(vec, out=vec, where=vec > 0)
+    return vec
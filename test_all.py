@@ -3,9 +3,14 @@
 import asyncio
 import os
 import shutil
+import sqlite3
 import stat
+import subprocess
 import sys
 import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
 
 # 修复 Windows 控制台编码
 if sys.platform == "win32":
@@ -14,14 +19,21 @@ if sys.platform == "win32":
     sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding="utf-8", errors="replace")
 
 from adapters.base import BotAdapter, IncomingMessage, OutgoingMessage
+from adapters.telegram_render import render_markdown
 from main import check_prerequisites
 from core.router import Router
 from core.executor import ClaudeExecutor
 from core.session_manager import SessionManager
-from core.project_manager import ProjectManager
+from core.project_manager import CloneOptions, ProjectManager, _run_streamed
 from core.git_ops import GitOps
 from core.file_manager import FileManager
-from memory.store import ProjectMemoryManager
+from core.output_processor import compress_output
+from core.git_reader import GitReader
+from core.fetch_scheduler import FetchScheduler
+from memory.compactor import MemoryCompactor
+from memory.injector import KEY_FILES_HEADER, ContextInjector
+from memory.store import MemoryStore, ProjectMemoryManager
+from utils.tokens import estimate_tokens
 
 
 class MockAdapter(BotAdapter):
@@ -142,7 +154,7 @@ async def run_all():
 
     # ========== 2. 冷启动（无项目） ==========
     print("[2] 冷启动流程（无项目）")
-    await t("/help", "/help", expect_in=["/clone", "/repos", "/newproject", "/commit", "/cat", "/tree"])
+    await t("/help", "/help", expect_in=["/clone", "/repos", "/newproject", "/commit", "/cat", "/tree", "/undo", "/grep"])
     await t("/start", "/start", expect_in="724code")
     await t("/projects 空", "/projects", expect_in="暂无项目")
     await t("/status 空", "/status", expect_in="未选择")
@@ -205,6 +217,335 @@ async def run_all():
     await t("/branch 列表", "/branch", expect_in="main")
     await t("/branch 新建", "/branch dev", expect_in="dev")
     await t("/push 保护分支", "/push main", expect_in="保护分支")
+
+    # git 状态缓存：仓库未变时不启动 git 进程（log 走进程内读取器），HEAD 变化后立即失效
+    total += 1
+    go.invalidate(prj_path)
+    real_run_git, spawned = go._run_git, []
+
+    async def counting_run_git(cwd, *args):
+        spawned.append(args)
+        return await real_run_git(cwd, *args)
+
+    go._run_git = counting_run_git
+    first_log = await go.log(prj_path, "5")
+    await go.log(prj_path, "5")
+    await go.status(prj_path)
+    await go.status(prj_path)
+    cached_spawns = len(spawned)
+    await go.branch(prj_path, "main")
+    after_switch = await go.summary(prj_path)
+    go._run_git = real_run_git
+    if cached_spawns == 1 and "Initial file" in first_log and after_switch.startswith("main") \
+            and go.cache_stats()["hits"] >= 2:
+        passed += 1
+        print(f"  [PASS] git 状态缓存 (命中率 {go.cache_stats()['hit_rate']:.0%})")
+    else:
+        failed += 1
+        print(f"  [FAIL] git 状态缓存: spawns={cached_spawns} summary={after_switch!r} {go.cache_stats()}")
+
+    # 超时按子命令选取：跳过 -c <配置> / -C <目录> 全局选项
+    total += 1
+    saved_timeouts = go.timeouts
+    go.timeouts = {**saved_timeouts, "diff": 7}
+    chosen = (go._timeout(["-c", "core.quotePath=false", "diff", "--stat"]),
+              go._timeout(["-C", "/tmp", "-c", "http.lowSpeedLimit=1", "push", "origin"]),
+              go._timeout(["--no-pager", "clone", "url"]))
+    go.timeouts = saved_timeouts
+    if chosen == (7, go.timeouts["push"], go.timeouts["clone"]):
+        passed += 1
+        print("  [PASS] git 超时按子命令选取")
+    else:
+        failed += 1
+        print(f"  [FAIL] git 超时按子命令选取: {chosen}")
+
+    # /diff 分页：一次 git 调用，/diff next 与 /diff <文件> 在快照中翻页，超过字节上限截断
+    total += 1
+    diff_repo = os.path.join(test_dir, "diff_repo")
+    os.makedirs(diff_repo)
+    await go._run_git(diff_repo, "init", "-q")
+    for i in range(12):
+        with open(os.path.join(diff_repo, f"mod_{i:02d}.py"), "w") as f:
+            f.write("".join(f"value_{j} = {j}\n" for j in range(120)))
+    await go._run_git(diff_repo, "add", "-A")
+    await go._run_git(diff_repo, "commit", "-qm", "base")
+    for i in range(12):
+        with open(os.path.join(diff_repo, f"mod_{i:02d}.py"), "w") as f:
+            f.write("".join(f"value_{j} = {j * 2}\n" for j in range(120)))
+    paged = GitOps({"diff_page_chars": 1500, "diff_max_bytes": 20000})
+    first = await paged.diff(diff_repo)
+    spool = paged._diffs[diff_repo]
+    second = await paged.diff(diff_repo, "next")
+    in_snapshot = await paged.diff(diff_repo, "mod_02.py")
+    # mod_09 在截断之后，不在快照里：只对该文件重新生成
+    jumped = await paged.diff(diff_repo, "mod_09.py")
+    if "变更统计" in first and "/diff next" in first and "mod_00.py" in first \
+            and "（续）mod_00.py" in second and in_snapshot.startswith("diff --git a/mod_02.py") \
+            and jumped.startswith("diff --git a/mod_09.py") \
+            and spool.truncated and spool.size <= 20000 and len(first) < 2000:
+        passed += 1
+        print("  [PASS] /diff 分页 + 字节上限")
+    else:
+        failed += 1
+        print(f"  [FAIL] /diff 分页: {first[:200]!r} | {second[:80]!r} | {in_snapshot[:60]!r} | {jumped[:60]!r} | {spool.truncated}")
+
+    # /diff 文件路径：含 " b/"、非 ASCII、改名、删除、二进制文件时都取对
+    total += 1
+    odd_repo = os.path.join(test_dir, "odd_paths_repo")
+    os.makedirs(os.path.join(odd_repo, "docs b"))
+    odd_files = {"docs b/notes.md": "a\n", "中文.py": "a\n", "old_name.py": "x = 1\n" * 20,
+                 "gone.txt": "bye\n", "img b/x.bin": None}
+    for name, content in odd_files.items():
+        os.makedirs(os.path.dirname(os.path.join(odd_repo, name)), exist_ok=True)
+        with open(os.path.join(odd_repo, name), "wb") as f:
+            f.write(content.encode() if content else b"\0\1\2")
+    await go._run_git(odd_repo, "init", "-q")
+    await go._run_git(odd_repo, "add", "-A")
+    await go._run_git(odd_repo, "commit", "-qm", "base")
+    for name in ("docs b/notes.md", "中文.py"):
+        with open(os.path.join(odd_repo, name), "a") as f:
+            f.write("b\n")
+    with open(os.path.join(odd_repo, "img b/x.bin"), "wb") as f:
+        f.write(b"\0\3")
+    os.rename(os.path.join(odd_repo, "old_name.py"), os.path.join(odd_repo, "new name.py"))
+    os.remove(os.path.join(odd_repo, "gone.txt"))
+    await go._run_git(odd_repo, "add", "-A")
+    await go.diff(odd_repo, "HEAD")
+    odd_paths = sorted(path for path, _ in go._diffs[odd_repo].files)
+    expected_paths = sorted(["docs b/notes.md", "中文.py", "new name.py", "gone.txt", "img b/x.bin"])
+    if odd_paths == expected_paths:
+        passed += 1
+        print("  [PASS] /diff 特殊文件路径解析")
+    else:
+        failed += 1
+        print(f"  [FAIL] /diff 特殊路径: {odd_paths}")
+
+    await t("/gs all", "/gs all", expect_in=["testprj", "项目 Git 状态"])
+
+    # 后台 fetch：远端有新提交后 fetch 一轮，落后数立即可见；失败的项目进入退避
+    total += 1
+    remote = os.path.join(test_dir, "fetch_remote.git")
+    await go._run_git(test_dir, "clone", "-q", "--bare", diff_repo, remote)
+    local, other = os.path.join(test_dir, "fetch_local"), os.path.join(test_dir, "fetch_other")
+    for path in (local, other):
+        await go._run_git(test_dir, "clone", "-q", remote, path)
+    with open(os.path.join(other, "remote_new.txt"), "w") as f:
+        f.write("from remote\n")
+    await go.commit(other, "remote change")
+    await go._run_git(other, "push", "-q", "origin", "HEAD")
+    broken = os.path.join(test_dir, "fetch_broken")
+    await go._run_git(test_dir, "clone", "-q", remote, broken)
+    await go._run_git(broken, "remote", "set-url", "origin", os.path.join(test_dir, "missing.git"))
+    pm.add_project("fetch_local", local)
+    pm.add_project("fetch_broken", broken)
+    fetcher = FetchScheduler(go, pm, {"fetch_interval_minutes": 15})
+    fetched = await fetcher.fetch_due()
+    behind = (await go.branch_state(local)).behind
+    second_round = await fetcher.fetch_due()  # broken 在退避中，不会再试
+    pm.remove_project("fetch_local")
+    pm.remove_project("fetch_broken")
+    if fetched.get("fetch_local") == "" and fetched.get("fetch_broken") and behind == 1 \
+            and "fetch_broken" not in second_round and "testprj" not in fetched:
+        passed += 1
+        print("  [PASS] 后台 fetch + 失败退避")
+    else:
+        failed += 1
+        print(f"  [FAIL] 后台 fetch: {fetched} behind={behind} second={second_round}")
+
+    # /clone 浅克隆 + blobless：克隆方式写入注册表，后台 fetch 沿用 --depth / --filter
+    total += 1
+    await go._run_git(remote, "config", "uploadpack.allowFilter", "true")
+    clone_opts = CloneOptions()
+    positional = clone_opts.apply_flags(["file://" + remote, "shallow_prj", "--depth", "1", "--blobless"])
+    clone_result = await pm.clone_project(*positional, clone_opts)
+    shallow_info = pm.get_project("shallow_prj") or {}
+    shallow_path = shallow_info.get("path", "")
+    promisor, _, _ = await go._run_git(shallow_path or test_dir, "config", "remote.origin.partialclonefilter")
+    # fork 常见的第二个 remote：fetch --all 不能带 --filter，否则每轮都失败
+    await go._run_git(shallow_path or test_dir, "remote", "add", "upstream", "file://" + remote)
+    fetch_args = CloneOptions.from_dict(shallow_info.get("clone")).fetch_args()
+    fetch_error = await go.fetch(shallow_path, fetch_args)
+    try:
+        CloneOptions().apply_flags(["x", "--depth", "abc"])
+        bad_flag = False
+    except ValueError:
+        bad_flag = True
+    pm.remove_project("shallow_prj")
+    if "已克隆" in clone_result and shallow_info.get("clone") == {"depth": 1, "filter": "blob:none"} \
+            and os.path.exists(os.path.join(shallow_path, ".git", "shallow")) \
+            and promisor.strip() == "blob:none" and fetch_args == ["--depth=1"] and fetch_error == "" and bad_flag:
+        passed += 1
+        print("  [PASS] /clone 浅克隆 + blobless")
+    else:
+        failed += 1
+        print(f"  [FAIL] /clone 浅克隆: {clone_result!r} {shallow_info} {promisor!r} {fetch_error!r}")
+
+    # 克隆输出流：跨块截断的多字节字符正确解码；远端卡住时超时终止
+    total += 1
+    split_writer = ("import sys, time; b = '错误: 远端拒绝连接\\n'.encode(); "
+                    "sys.stderr.buffer.write(b[:1]); sys.stderr.flush(); time.sleep(0.2); "
+                    "sys.stderr.buffer.write(b[1:]); sys.stderr.flush()")
+    streamed, streamed_code = await _run_streamed(sys.executable, "-c", split_writer, timeout=10)
+    start = time.monotonic()
+    _, stalled_code = await _run_streamed("sh", "-c", "sleep 30", timeout=0.5)
+    stalled_elapsed = time.monotonic() - start
+    if streamed == "错误: 远端拒绝连接" and streamed_code == 0 and stalled_code == 124 and stalled_elapsed < 3:
+        passed += 1
+        print("  [PASS] 克隆输出增量解码 + 超时终止")
+    else:
+        failed += 1
+        print(f"  [FAIL] 克隆输出流: {streamed!r} {streamed_code} {stalled_code} {stalled_elapsed:.1f}s")
+
+    # git 超时杀进程组 + 残留 index.lock 自动清理
+    total += 1
+    start = time.monotonic()
+    _, hang_err, hang_code = await go._run_git(diff_repo, "-c", "alias.hang=!sleep 30", "hang", timeout=0.5)
+    hang_elapsed = time.monotonic() - start
+    stale_lock = os.path.join(diff_repo, ".git", "index.lock")
+    open(stale_lock, "w").close()
+    os.utime(stale_lock, (time.time() - 3600, time.time() - 3600))
+    commit_result = await go.commit(diff_repo, "after stale lock")
+    if hang_code == 124 and "超时" in hang_err and hang_elapsed < 3 \
+            and "已提交" in commit_result and not os.path.exists(stale_lock):
+        passed += 1
+        print("  [PASS] git 超时终止 + 残留 index.lock 重试")
+    else:
+        failed += 1
+        print(f"  [FAIL] git 超时/锁: code={hang_code} {hang_elapsed:.1f}s {commit_result[:100]!r}")
+
+    # 另有 git 进程在用该仓库时不删除过旧的 index.lock，而是把锁报告给用户
+    total += 1
+    other_git = subprocess.Popen(["git", "-c", "alias.hang=!sleep 30", "hang"], cwd=diff_repo,
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    open(stale_lock, "w").close()
+    os.utime(stale_lock, (time.time() - 3600, time.time() - 3600))
+    with open(os.path.join(diff_repo, "busy.txt"), "w") as f:
+        f.write("busy\n")
+    busy_result = await go.commit(diff_repo, "while busy")
+    lock_kept = os.path.exists(stale_lock)
+    other_git.kill()
+    other_git.wait()
+    freed_result = await go.commit(diff_repo, "after other git exited")
+    if lock_kept and "index.lock 未释放" in busy_result and f"pid {other_git.pid}" in busy_result \
+            and "已提交" in freed_result:
+        passed += 1
+        print("  [PASS] 有 git 进程在用时保留 index.lock 并报告")
+    else:
+        failed += 1
+        print(f"  [FAIL] index.lock 占用: kept={lock_kept} {busy_result[-200:]!r} {freed_result[:80]!r}")
+
+    # 检查点：快照不动 index / HEAD，/undo 恢复改动、删除新增文件，旧检查点按数量清理
+    total += 1
+    with open(os.path.join(diff_repo, "staged.txt"), "w") as f:
+        f.write("staged\n")
+    await go._run_git(diff_repo, "add", "staged.txt")
+    index_before, _, _ = await go._run_git(diff_repo, "diff", "--cached", "--name-only")
+    head_before, _, _ = await go._run_git(diff_repo, "rev-parse", "HEAD")
+    run = await go.checkpoint(diff_repo, "重构 mod_00")
+    index_after, _, _ = await go._run_git(diff_repo, "diff", "--cached", "--name-only")
+    head_after, _, _ = await go._run_git(diff_repo, "rev-parse", "HEAD")
+    with open(os.path.join(diff_repo, "mod_00.py"), "w") as f:
+        f.write("mangled\n")
+    os.remove(os.path.join(diff_repo, "mod_01.py"))
+    with open(os.path.join(diff_repo, "junk.py"), "w") as f:
+        f.write("junk\n")
+    undo_result = await go.undo(diff_repo, run)
+    with open(os.path.join(diff_repo, "mod_00.py")) as f:
+        restored = "mangled" not in f.read()
+    go.checkpoint_keep = 2
+    for i in range(3):
+        await go.checkpoint(diff_repo, f"run {i}")
+    remaining = await go._list_checkpoints(diff_repo)
+    go.checkpoint_keep = 20
+    if run and index_before == index_after == "staged.txt\n" and head_before == head_after \
+            and "已回滚" in undo_result and restored and os.path.exists(os.path.join(diff_repo, "mod_01.py")) \
+            and not os.path.exists(os.path.join(diff_repo, "junk.py")) \
+            and os.path.exists(os.path.join(diff_repo, "staged.txt")) and len(remaining) == 2:
+        passed += 1
+        print("  [PASS] 检查点 + /undo + 清理")
+    else:
+        failed += 1
+        print(f"  [FAIL] 检查点: run={run!r} {index_before!r}/{index_after!r} {undo_result!r} "
+              f"restored={restored} remaining={len(remaining)}")
+    await t("/undo list", "/undo list", expect_in="检查点")
+
+    # 同一秒内并发创建检查点：ID 各不相同，引用不互相覆盖；/undo 改完工作区后缓存作废
+    total += 1
+    concurrent_runs = await asyncio.gather(*(go.checkpoint(diff_repo, f"并发 {i}") for i in range(4)))
+    listed = {c.run: c.label for c in await go._list_checkpoints(diff_repo)}
+    release = asyncio.Event()
+
+    async def hold_lock():
+        async with go.repo_lock(diff_repo).exclusive("test"):
+            await release.wait()
+
+    holder = asyncio.create_task(hold_lock())
+    await asyncio.sleep(0)
+    undo_task = asyncio.create_task(go.undo(diff_repo, concurrent_runs[0]))
+    await asyncio.sleep(0.05)
+    go._cache[diff_repo] = {"status": "stale"}  # 等锁期间有读取重新填了缓存
+    release.set()
+    await holder
+    undo_concurrent = await undo_task
+    if len(set(concurrent_runs)) == 4 and all(listed.get(r) == f"并发 {i}" for i, r in enumerate(concurrent_runs)) \
+            and "已回滚" in undo_concurrent and diff_repo not in go._cache:
+        passed += 1
+        print("  [PASS] 并发检查点 ID 不冲突 + /undo 后缓存作废")
+    else:
+        failed += 1
+        print(f"  [FAIL] 并发检查点: {concurrent_runs} {listed} {undo_concurrent[:60]!r} {go._cache.get(diff_repo)}")
+
+    # 检查点不快照 .724code；/undo 不还原记忆库（含旧版本把 .724code 快照进去的检查点）
+    total += 1
+    live_store = MemoryStore(os.path.join(diff_repo, ".724code", "memories.db"))
+    live_store.save_entry("testprj", "撤销前的记忆", "完成")
+    legacy_index = os.path.join(test_dir, "legacy_index")
+    legacy_env = {"GIT_INDEX_FILE": legacy_index}
+    await go._run_git(diff_repo, "add", "-A", env=legacy_env)
+    legacy_tree, _, _ = await go._run_git(diff_repo, "write-tree", env=legacy_env)
+    legacy_commit, _, _ = await go._run_git(diff_repo, "commit-tree", legacy_tree.strip(), "-m", "legacy")
+    await go._run_git(diff_repo, "update-ref", "refs/724code/checkpoints/00000000-legacy", legacy_commit.strip())
+    legacy_paths, _, _ = await go._run_git(diff_repo, "ls-tree", "-r", "--name-only", legacy_commit.strip())
+    data_run = await go.checkpoint(diff_repo, "含记忆库的项目")
+    data_paths, _, _ = await go._run_git(
+        diff_repo, "ls-tree", "-r", "--name-only", f"refs/724code/checkpoints/{data_run}")
+    live_store.save_entry("testprj", "撤销后仍在的记忆", "完成")
+    undo_data = await go.undo(diff_repo, data_run)
+    undo_legacy = await go.undo(diff_repo, "00000000-legacy")
+    kept_tasks = {e["task"] for e in live_store.get_recent("testprj")}
+    with live_store._get_conn() as conn:
+        integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    live_store.close()
+    if ".724code/memories.db" in legacy_paths and data_run and ".724code" not in data_paths \
+            and "已回滚" in undo_data and "已回滚" in undo_legacy \
+            and {"撤销前的记忆", "撤销后仍在的记忆"} <= kept_tasks and integrity == "ok":
+        passed += 1
+        print("  [PASS] 检查点 / /undo 不碰 .724code 记忆库")
+    else:
+        failed += 1
+        print(f"  [FAIL] 检查点与记忆库: {data_paths!r} {undo_data[:40]!r} {undo_legacy[:40]!r} {kept_tasks} {integrity}")
+
+    # 进程内 git 读取器与 git 命令行输出一致（松散对象和 gc 打包后各比一次）
+    total += 1
+    mismatches = []
+    for stage in ("loose", "packed"):
+        if stage == "packed":
+            await go._run_git(prj_path, "gc", "-q")
+        reader = GitReader(os.path.join(prj_path, ".git"))
+        for args, produced in (
+            (("log", "-10", "--oneline", "--graph", "--decorate"), reader.log_oneline(10)),
+            (("branch", "-a"), reader.branch_list()),
+        ):
+            expected, _, _ = await go._run_git(prj_path, *args)
+            if expected != produced:
+                mismatches.append((stage, args[0], expected, produced))
+        reader.close()
+    if not mismatches:
+        passed += 1
+        print("  [PASS] git 读取器输出与 git 一致")
+    else:
+        failed += 1
+        print(f"  [FAIL] git 读取器输出不一致: {mismatches}")
     print()
 
     # ========== 6. 文件查看 ==========
@@ -212,16 +553,340 @@ async def run_all():
     await t("/cat hello.txt", "/cat hello.txt", expect_in="hello 724code")
     await t("/cat 行范围", "/cat hello.txt 1", expect_in="hello")
     await t("/cat 不存在", "/cat ghost.txt", expect_in="不存在")
+    # 行偏移索引：范围 / 末尾读取，文件不变时复用索引，改动后重建
+    total += 1
+    cat_dir = os.path.join(test_dir, "cat_test")
+    os.makedirs(cat_dir)
+    big = os.path.join(cat_dir, "big.txt")
+    with open(big, "w") as f:
+        f.write("".join(f"line {i}\r\n" for i in range(1, 1001)) + "last")
+    middle = await fm.cat_file(cat_dir, "big.txt 500-502")
+    tail = await fm.cat_file(cat_dir, "big.txt -2")
+    capped = await fm.cat_file(cat_dir, "big.txt 1-5000")
+    offsets = fm._line_offsets(big)
+    same_index = fm._line_offsets(big) is offsets
+    with open(big, "a") as f:
+        f.write(" appended\nnew tail\n")
+    after = await fm.cat_file(cat_dir, "big.txt -1")
+    if "1001 行, 显示 500-502" in middle and " 500 | line 500\n 501 | line 501\n 502 | line 502" in middle \
+            and "还有 499 行" in middle and "1000 | line 1000\n1001 | last" in tail and "显示 1-200" in capped \
+            and same_index and "1002 | new tail" in after and "1002 行" in after:
+        passed += 1
+        print("  [PASS] /cat 行索引 + 末尾读取")
+    else:
+        failed += 1
+        print(f"  [FAIL] /cat 行索引: {middle!r} {tail!r} {after!r} same_index={same_index}")
+    await t("/cat 末尾", "/cat hello.txt -1", expect_in="hello 724code")
+    # /grep：跳过 .gitignore 忽略的文件和二进制文件，带上下文，达到上限即停止
+    total += 1
+    grep_dir = os.path.join(test_dir, "grep_test")
+    os.makedirs(os.path.join(grep_dir, "src"))
+    os.makedirs(os.path.join(grep_dir, "build"))
+    with open(os.path.join(grep_dir, ".gitignore"), "w") as f:
+        f.write("build/\n")
+    with open(os.path.join(grep_dir, "src", "app.py"), "w") as f:
+        f.write("import os\n\ndef handle_request(req):\n    return req\n")
+    with open(os.path.join(grep_dir, "build", "app.py"), "w") as f:
+        f.write("def handle_request(): pass\n")
+    with open(os.path.join(grep_dir, "src", "blob.bin"), "wb") as f:
+        f.write(b"\0\0handle_request")
+    with open(os.path.join(grep_dir, "src", "many.py"), "w") as f:
+        f.write("".join(f"x_{i} = 'todo'\n" for i in range(300)))
+    found = await fm.grep(grep_dir, r"def handle_\w+")
+    ignore_case = await fm.grep(grep_dir, "-i HANDLE_REQUEST src")
+    limited = await fm.grep(grep_dir, "todo")
+    missing = await fm.grep(grep_dir, "nothing_here_xyz")
+    # 恰好 grep_max_results 处：不算截断（分在两个文件里，其中一个正好用满上限）
+    with open(os.path.join(grep_dir, "src", "exact_a.py"), "w") as f:
+        f.write("".join(f"y_{i} = 'exactmark'\n" for i in range(fm.grep_max_results - 1)))
+    with open(os.path.join(grep_dir, "src", "exact_b.py"), "w") as f:
+        f.write("z = 'exactmark'\n")
+    exact = await fm.grep(grep_dir, "exactmark")
+    with open(os.path.join(grep_dir, "src", "exact_c.py"), "w") as f:
+        f.write("w = 'exactmark'\n")
+    over = await fm.grep(grep_dir, "exactmark")
+    if f"{fm.grep_max_results} 处匹配" in exact and "已达上限" not in exact and "已达上限" in over \
+            and "1 处匹配，1 个文件" in found and "src/app.py" in found and "   3: def handle_request(req):" in found \
+            and "   2- " in found and "   4-     return req" in found and "build" not in found \
+            and "blob.bin" not in found and "1 处匹配" in ignore_case \
+            and "50 处匹配" in limited and "已达上限" in limited and "未找到" in missing:
+        passed += 1
+        print("  [PASS] /grep 忽略规则 + 上下文 + 上限")
+    else:
+        failed += 1
+        print(f"  [FAIL] /grep: {found!r} {ignore_case!r} {limited[:200]!r} {exact[:80]!r} {over[:120]!r}")
+
+    # /grep -i 对非 ASCII 字符同样忽略大小写（字面量预筛和正则两条路径）
+    total += 1
+    intl_dir = os.path.join(test_dir, "grep_intl")
+    os.makedirs(intl_dir)
+    with open(os.path.join(intl_dir, "msg.py"), "w", encoding="utf-8") as f:
+        f.write("# 说明\nGREETING = 'Привет, мир'\nSIZE = 'Größe'\n")
+    cyrillic = await fm.grep(intl_dir, "-i ПРИВЕТ")
+    accented = await fm.grep(intl_dir, r"-i GRÖ\w+")
+    case_kept = await fm.grep(intl_dir, "ПРИВЕТ")
+    if "   2: GREETING = 'Привет, мир'" in cyrillic and "   1- # 说明" in cyrillic \
+            and "   3: SIZE = 'Größe'" in accented and "未找到" in case_kept:
+        passed += 1
+        print("  [PASS] /grep -i 非 ASCII 忽略大小写")
+    else:
+        failed += 1
+        print(f"  [FAIL] /grep -i 非 ASCII: {cyrillic!r} {accented!r} {case_kept!r}")
+
+    await t("/grep", "/grep hello", expect_in="hello.txt")
+    await t("/grep 无参数", "/grep", expect_in="用法")
     await t("/tree", "/tree", expect_in="hello.txt")
     await t("/tree 深度", "/tree . 1", expect_in="hello.txt")
+    # /tree：遵守 .gitignore（含子目录规则与 ! 取反），统计模式，快照随目录 mtime 失效
+    total += 1
+    tree_dir = os.path.join(test_dir, "tree_test")
+    for d in ("src/gen", "build", "logs"):
+        os.makedirs(os.path.join(tree_dir, d))
+    for name, content in {".gitignore": "build/\n*.log\n!keep.log\n", "src/.gitignore": "gen/\n",
+                          "src/app.py": "x" * 2048, "build/out.bin": "b", "logs/a.log": "a",
+                          "logs/keep.log": "k", "src/gen/g.py": "g"}.items():
+        with open(os.path.join(tree_dir, name), "w") as f:
+            f.write(content)
+    plain = await fm.tree(tree_dir, ". 3")
+    stats_out = await fm.tree(tree_dir, "src -s")
+    hits_before = fm.tree_cache_hits
+    cached = await fm.tree(tree_dir, ". 3")
+    hits_after = fm.tree_cache_hits
+    open(os.path.join(tree_dir, "src", "new.py"), "w").close()
+    refreshed = await fm.tree(tree_dir, ". 3")
+    # 文件变大不改目录 mtime，统计模式仍要给出新大小
+    with open(os.path.join(tree_dir, "src", "app.py"), "a") as f:
+        f.write("x" * 2048)
+    grown = await fm.tree(tree_dir, "src -s")
+    if "app.py  (4.0KB)" in grown and "app.py" in plain and "keep.log" in plain and "build" not in plain and "a.log" not in plain \
+            and "gen" not in plain and "src/  (2 个文件, 2.0KB)" in stats_out and "app.py  (2.0KB)" in stats_out \
+            and cached == plain and hits_after == hits_before + 1 and "new.py" in refreshed:
+        passed += 1
+        print("  [PASS] /tree .gitignore + 统计 + 快照缓存")
+    else:
+        failed += 1
+        print(f"  [FAIL] /tree: {plain!r} {stats_out!r} {grown!r} hits={hits_before}->{hits_after}")
     print()
 
     # ========== 7. 记忆系统 ==========
     print("[7] 记忆系统")
     await t("/memory 空", "/memory", expect_in="暂无")
     await t("/memory stats", "/memory stats", expect_in="记录数")
+    await t("/memory compact", "/memory compact", expect_in="压缩完成")
     await t("/search 无参数", "/search", expect_in="用法")
     await t("/search 无结果", "/search xyznothing123", expect_in="未找到")
+    mm.get_store(prj_path).save_entry(
+        project="testprj", user_msg="修复用户登录验证问题", summary="修改 auth.py 中的 token 校验",
+        full_output="完整输出：已修改 auth.py\n" * 50,
+    )
+    await t("/search 中文子串", "/search 登录验证", expect_in=["修复用户", "【登录验证】"])
+    await t("/search 短查询", "/search 登录", expect_in="修复用户")
+    # /search 的检索（含向量补齐）在线程里执行，不阻塞事件循环
+    total += 1
+    search_store = mm.get_store(prj_path)
+    search_threads = []
+
+    def recording_search(*args, **kwargs):
+        search_threads.append(threading.get_ident())
+        return MemoryStore.search(search_store, *args, **kwargs)
+
+    search_store.search = recording_search
+    await router.handle(msg("/search 登录验证"), MockAdapter())
+    del search_store.search
+    if search_threads and threading.get_ident() not in search_threads:
+        passed += 1
+        print("  [PASS] /search 不在事件循环线程检索")
+    else:
+        failed += 1
+        print(f"  [FAIL] /search 不在事件循环线程检索: {search_threads}")
+    await t("/detail 历史记录", "/detail 1", expect_in="已修改 auth.py")
+    await t("/detail 记录不存在", "/detail 999", expect_in="不存在")
+    await t("/detail 用法", "/detail abc", expect_in="用法")
+    # 长输出分页，不再静默截断
+    long_id = mm.get_store(prj_path).save_entry(
+        project="longprj", user_msg="生成长输出", summary="长输出",
+        full_output="".join(f"第 {i} 行\n" for i in range(2000)) + "最后一行",
+    )
+    await t("/detail 分页", f"/detail {long_id}", expect_in=["第 1/", f"/detail {long_id} 2"])
+    await t("/detail 末页", f"/detail {long_id} 3", expect_in=["最后一行", "第 3/3 页"])
+    await t("/detail 页码越界", f"/detail {long_id} 9", expect_in="只有 3 页")
+
+    # 周汇总后完整输出仍可 /detail <原 id> 查看；体积上限先淘汰已汇总的输出，汇总被删时一并删除
+    total += 1
+    archive_dir = os.path.join(test_dir, "archive_store")
+    archive = MemoryStore(os.path.join(archive_dir, "memories.db"))
+    old_ids = [archive.save_entry("p", f"旧任务 {i}", "完成", full_output=f"旧输出 {i}\n" * 100)
+               for i in range(3)]
+    with archive._get_conn() as conn:
+        conn.execute("UPDATE memories SET timestamp = ?",
+                     ((datetime.now() - timedelta(days=60)).isoformat(),))
+        conn.commit()
+    archive.compact(older_than_days=30)
+    kept = [archive.get_output(i) for i in old_ids]
+    archive.compact(older_than_days=30, max_db_mb=0)
+    with archive._get_conn() as conn:
+        leftover = conn.execute("SELECT COUNT(*) FROM archived_outputs").fetchone()[0] + \
+            conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0]
+    archive.close()
+    if all(k and k.startswith(f"旧输出 {i}") for i, k in enumerate(kept)) and leftover == 0:
+        passed += 1
+        print("  [PASS] 周汇总后保留完整输出 + 体积上限淘汰")
+    else:
+        failed += 1
+        print(f"  [FAIL] 周汇总后完整输出: {[k and k[:8] for k in kept]} leftover={leftover}")
+
+    # 压缩：按 (项目, 周) 汇总旧记录，FTS 行随原始记录删除，向量索引重建；
+    # 行数上限按项目各自的库执行；后台任务启动后先压缩一次，不等满一个周期
+    total += 1
+    rollup = MemoryStore(os.path.join(test_dir, "rollup_store", "memories.db"))
+    for i in range(6):
+        rollup.save_entry("a", f"旧任务甲 {i}", f"zqxsum{i} 完成")
+    rollup.save_entry("b", "旧任务乙", "zqxsumb 完成")
+    rollup.save_entry("a", "新任务", "刚完成")
+    with rollup._get_conn() as conn:
+        for entry_id, days in ((1, 60), (2, 60), (3, 60), (4, 75), (5, 75), (6, 75), (7, 60)):
+            conn.execute("UPDATE memories SET timestamp = ? WHERE id = ?",
+                         ((datetime.now() - timedelta(days=days)).isoformat(), entry_id))
+        conn.commit()
+    rolled = rollup.compact(older_than_days=30)
+    with rollup._get_conn() as conn:
+        kinds = conn.execute("SELECT project, kind, entry_count FROM memories ORDER BY project, kind").fetchall()
+        fts_left = conn.execute("SELECT COUNT(*) FROM memories_fts WHERE memories_fts MATCH 'zqxsum'").fetchone()[0]
+        row_count = conn.execute("SELECT COUNT(*) FROM memories").fetchone()[0]
+    digest_hits = rollup.similar("a", "旧任务甲", limit=5)
+    vectors_ok = len(rollup.vectors) == row_count and digest_hits and digest_hits[0]["task"].startswith("周汇总")
+    rollup.close()
+
+    class _Projects:
+        def __init__(self, paths):
+            self.paths = paths
+
+        def list_projects(self):
+            return {name: {"path": path} for name, path in self.paths.items()}
+
+    cap_paths = {name: os.path.join(test_dir, f"cap_{name}") for name in ("x", "y")}
+    cap_mgr = ProjectMemoryManager()
+    for name, path in cap_paths.items():
+        for i in range(5):
+            cap_mgr.get_store(path).save_entry(name, f"{name} 任务 {i}", "完成")
+    compactor = MemoryCompactor(cap_mgr, _Projects(cap_paths),
+                                {"max_rows": 3, "compact_startup_delay_seconds": 0})
+    startup_task = asyncio.create_task(compactor.run_forever())
+    for _ in range(50):
+        await asyncio.sleep(0.1)
+        if all(cap_mgr.get_store(p).get_stats()["last_compaction"] for p in cap_paths.values()):
+            break
+    startup_task.cancel()
+    capped = {name: [e["task"] for e in cap_mgr.get_store(path).get_recent(name)]
+              for name, path in cap_paths.items()}
+    cap_mgr.close_all()
+    if rolled == {"rolled": 7, "digests": 3, "pruned": 0} \
+            and kinds == [("a", "digest", 3), ("a", "digest", 3), ("a", "entry", 1), ("b", "digest", 1)] \
+            and fts_left == 0 and vectors_ok \
+            and capped == {n: [f"{n} 任务 {i}" for i in (2, 3, 4)] for n in cap_paths}:
+        passed += 1
+        print("  [PASS] 周汇总 + FTS 清理 + 向量重建 + 按项目上限 + 启动即压缩")
+    else:
+        failed += 1
+        print(f"  [FAIL] 压缩: {rolled} {kinds} fts={fts_left} vectors={vectors_ok} {capped}")
+
+    # 增量 VACUUM：新库建表时即开启；旧库只在手动压缩（full_vacuum）时整库重写切换，
+    # 后台压缩不重写，也不会因为文件缩不下来而把行删光
+    total += 1
+    fresh_vac = MemoryStore(os.path.join(test_dir, "vac_new", "memories.db"))
+    with fresh_vac._get_conn() as conn:
+        fresh_mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    fresh_vac.close()
+    legacy_db = os.path.join(test_dir, "vac_legacy", "memories.db")
+    os.makedirs(os.path.dirname(legacy_db))
+    raw = sqlite3.connect(legacy_db)
+    raw.execute("CREATE TABLE legacy_marker (x)")  # 已有表：auto_vacuum 固定为 NONE
+    raw.commit()
+    raw.close()
+    legacy_vac = MemoryStore(legacy_db)
+    for i in range(5):
+        legacy_vac.save_entry("p", f"旧库任务 {i}", "完成")
+    legacy_vac.compact(max_db_mb=0.001)
+    with legacy_vac._get_conn() as conn:
+        background_mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        background_rows = conn.execute("SELECT COUNT(*) FROM memories").fetchone()[0]
+    legacy_vac.compact(full_vacuum=True)
+    legacy_vac.close()
+    raw = sqlite3.connect(legacy_db)
+    manual_mode = raw.execute("PRAGMA auto_vacuum").fetchone()[0]
+    raw.close()
+    if (fresh_mode, background_mode, background_rows, manual_mode) == (2, 0, 5, 2):
+        passed += 1
+        print("  [PASS] 增量 VACUUM 只在建库 / 手动压缩时切换")
+    else:
+        failed += 1
+        print(f"  [FAIL] 增量 VACUUM: {(fresh_mode, background_mode, background_rows, manual_mode)}")
+
+    # 库文件被删除后重建：同一进程内不能沿用旧的建表缓存
+    total += 1
+    for name in os.listdir(archive_dir):
+        os.remove(os.path.join(archive_dir, name))
+    recreated = MemoryStore(os.path.join(archive_dir, "memories.db"))
+    try:
+        recreated_id = recreated.save_entry("p", "重建后的任务", "完成")
+        recreated_ok = recreated.get_recent("p")[0]["id"] == recreated_id
+    except Exception as e:
+        recreated_ok = e
+    recreated.close()
+    if recreated_ok is True:
+        passed += 1
+        print("  [PASS] 记忆库删除重建后重新建表")
+    else:
+        failed += 1
+        print(f"  [FAIL] 记忆库删除重建: {recreated_ok!r}")
+    await t("/search -a 跨项目", "/search -a 登录验证", expect_in=["[testprj]", "修复用户"])
+
+    # LRU 淘汰后连接关闭，旧引用仍可自动重连
+    total += 1
+    lru = ProjectMemoryManager(capacity=1)
+    first = lru.get_store(prj_path)
+    first.get_recent("testprj")
+    lru.get_store(os.path.join(test_dir, "lru_other"))
+    if first._db is None and first.get_recent("testprj"):
+        passed += 1
+        print("  [PASS] 记忆库 LRU 淘汰")
+    else:
+        failed += 1
+        print("  [FAIL] 记忆库 LRU 淘汰")
+    lru.close_all()
+
+    # 记忆注入整条装入 token 预算，不截断
+    total += 1
+    injector = ContextInjector({"max_context_tokens": 120})
+    prompt, estimate = injector.build_augmented_prompt(mm.get_store(prj_path), "testprj", "修复 auth.py 登录")
+    if "修改 auth.py 中的 token 校验" in prompt and estimate_tokens(prompt) <= 120 + estimate_tokens("修复 auth.py 登录") \
+            and estimate >= estimate_tokens("修复 auth.py 登录"):
+        passed += 1
+        print("  [PASS] 记忆注入 token 预算")
+    else:
+        failed += 1
+        print(f"  [FAIL] 记忆注入 token 预算: {prompt[:200]!r}")
+
+    # 项目背景前缀稳定，有新记忆才变化；用户消息在最后
+    total += 1
+    store = mm.get_store(prj_path)
+    injector = ContextInjector({"max_context_tokens": 4000})
+    p1, _ = injector.build_augmented_prompt(store, "testprj", "任务甲")
+    p2, _ = injector.build_augmented_prompt(store, "testprj", "另一个任务乙")
+    before = injector.get_preamble(store, "testprj")[0]
+    store.save_entry(project="testprj", user_msg="新增注册接口", summary="新增 register.py",
+                     files_changed=["register.py", "auth.py"])
+    after = injector.get_preamble(store, "testprj")[0]
+    # 新记录只追加：除末尾的关键文件段外，旧背景是新背景的前缀
+    stable = before.split(KEY_FILES_HEADER)[0]
+    if p1.startswith(before) and p2.startswith(before) and p2.endswith("另一个任务乙") \
+            and after.startswith(stable) and "新增注册接口" in after[len(stable):] \
+            and after.split(KEY_FILES_HEADER)[0].startswith(stable):
+        passed += 1
+        print("  [PASS] 项目背景前缀缓存")
+    else:
+        failed += 1
+        print(f"  [FAIL] 项目背景前缀缓存: {p2[:200]!r}")
     print()
 
     # ========== 8. 会话管理 ==========
@@ -229,9 +894,99 @@ async def run_all():
     await t("/model 查看", "/model", expect_in=["sonnet", "opus", "haiku"])
     await t("/model 切换", "/model haiku", expect_in="haiku")
     await t("/status 验证模型", "/status", expect_in="haiku")
+    await t("/status 显示 git 缓存命中率", "/status", expect_in="Git 缓存: 命中率")
     await t("/new 新会话", "/new", expect_in="新建会话")
     await t("/abort", "/abort", expect_in="没有")
-    await t("/detail 空", "/detail", expect_in="没有")
+    await t("/detail 最近归档", "/detail", expect_in="已修改 auth.py")
+    await t("/detail 空", "/detail", expect_in="没有", chat_id="chat_B")
+
+    # 会话持久化：重启（新建 SessionManager）后恢复项目、模型和 Claude 会话 ID
+    total += 1
+    sessions_db = os.path.join(test_dir, "sessions.db")
+    sm1 = SessionManager(default_model="m0", db_path=sessions_db)
+    sm1.set_project("chat_P", "testprj", prj_path)
+    sm1.set_model("chat_P", "haiku-x")
+    sm1.update_claude_session("chat_P", "sess-123")
+    sm1.close()
+    restored = SessionManager(default_model="m0", db_path=sessions_db).get_session("chat_P")
+    if (restored.current_project, restored.model, restored.claude_session_id, restored.has_history) == \
+            ("testprj", "haiku-x", "sess-123", True):
+        passed += 1
+        print("  [PASS] 会话重启后恢复")
+    else:
+        failed += 1
+        print(f"  [FAIL] 会话重启后恢复: {restored}")
+
+    # 会话槽：/cd 到别的项目再切回，续接原 Claude 会话（重启后同样有效）
+    total += 1
+    sm2 = SessionManager(default_model="m0", db_path=sessions_db, max_slots=2)
+    sm2.set_project("chat_P", "other", prj_path)
+    sm2.update_claude_session("chat_P", "sess-other")
+    resumed = sm2.set_project("chat_P", "testprj", prj_path)
+    back = (sm2.get_session("chat_P").claude_session_id, sm2.get_session("chat_P").has_history)
+    sm2.new_session("chat_P", "feature")
+    sm2.update_claude_session("chat_P", "sess-feature")
+    slots = [(p, n) for p, n, _ in sm2.list_slots("chat_P")]
+    if resumed and back == ("sess-123", True) and \
+            slots == [("testprj", "feature"), ("testprj", "")]:
+        passed += 1
+        print("  [PASS] 会话槽切回续接 + LRU 淘汰")
+    else:
+        failed += 1
+        print(f"  [FAIL] 会话槽切回续接: resumed={resumed} {back} {slots}")
+    sm2.close()
+    await t("/sessions", "/sessions", expect_in="会话")
+
+    # 会话长度阈值：超过轮数后汇总为记忆 digest 并开新会话
+    total += 1
+    sm.set_project("chat_L", "testprj", prj_path)
+    sm.max_turns = 2
+    for i in range(2):
+        mm.get_store(prj_path).save_entry("testprj", f"长会话任务 {i}", f"完成 {i}", ["long.py"],
+                                          session_id="sess-long")
+        # 同项目另一个 chat 的并发会话，不应混进本会话的汇总
+        mm.get_store(prj_path).save_entry("testprj", f"别的会话任务 {i}", "完成", session_id="sess-other-chat")
+        sm.update_claude_session("chat_L", "sess-long", cost_usd=0.5, duration_ms=1000)
+    reason = sm.check_limits("chat_L")
+    stats_before = mm.get_store(prj_path).get_stats("testprj")
+    adapter = MockAdapter()
+    await router._check_session_limits("chat_L", adapter, mm.get_store(prj_path), "testprj")
+    digests = mm.get_store(prj_path).get_digests("testprj")
+    fresh = sm.get_session("chat_L")
+    digest_text = digests[-1]["summary"] if digests else ""
+    # 会话汇总单独计数，不算作周汇总
+    stats_after = mm.get_store(prj_path).get_stats("testprj")
+    if reason == "已 2 轮" and "汇总为记忆" in adapter.all_text() and not fresh.has_history \
+            and fresh.turns == 0 and "长会话任务 0" in digest_text and "长会话任务 1" in digest_text \
+            and "别的会话任务" not in digest_text \
+            and stats_after["digests"] == stats_before["digests"] \
+            and stats_after["session_digests"] == stats_before["session_digests"] + 1:
+        passed += 1
+        print("  [PASS] 会话超长自动汇总并开新会话")
+    else:
+        failed += 1
+        print(f"  [FAIL] 会话超长自动汇总: {reason!r} {adapter.all_text()!r} {fresh} {digests} "
+              f"{stats_before} {stats_after}")
+
+    # on_limit=warn：同一会话只提醒一次，/new 后清掉该 chat 的提醒记录
+    total += 1
+    sm.on_limit = "warn"
+    warn_counts = []
+    for _ in range(2):
+        adapter = MockAdapter()
+        for _ in range(2):
+            sm.update_claude_session("chat_L", "sess-warn", duration_ms=1000)
+            await router._check_session_limits("chat_L", adapter, mm.get_store(prj_path), "testprj")
+        warn_counts.append(adapter.all_text().count("建议 /new"))
+        await router._cmd_new(msg("/new", chat_id="chat_L"), MockAdapter(), "")
+    sm.on_limit = "digest"
+    sm.max_turns = 0
+    if warn_counts == [1, 1] and "chat_L" not in router._limit_warned:
+        passed += 1
+        print("  [PASS] 超限只提醒一次，/new 清理提醒记录")
+    else:
+        failed += 1
+        print(f"  [FAIL] 超限提醒: {warn_counts} {router._limit_warned}")
     print()
 
     # ========== 9. 边界情况 ==========
@@ -248,6 +1003,36 @@ async def run_all():
     else:
         failed += 1
         print(f"  [FAIL] 空白消息意外回复: {adapter.sent}")
+
+    # 长输出结构化压缩：代码块不被截半，中间的错误信息和结尾结论都保留
+    total += 1
+    long_output = (
+        "\x1b[32m开始修复\x1b[0m\n```python\n" + "x = 1\n" * 800 + "```\n"
+        + "Traceback (most recent call last):\n  File \"app.py\", line 3\nKeyError: 'token'\n"
+        + "y = 2\n" * 800 + "结论：已修复 app.py"
+    )
+    compressed = compress_output(long_output)
+    if (len(compressed) <= 3500 and compressed.count("```") % 2 == 0 and "KeyError: 'token'" in compressed
+            and "结论：已修复 app.py" in compressed and "\x1b[" not in compressed):
+        passed += 1
+        print("  [PASS] 长输出结构化压缩")
+    else:
+        failed += 1
+        print(f"  [FAIL] 长输出结构化压缩: {compressed[:300]!r}")
+
+    # Telegram HTML 渲染：转义安全、代码块跨段时每段标签成对、结果缓存
+    total += 1
+    md = "**改动** <auth>\n```python\n" + "if a < b and c & d:\n    pass\n" * 200 + "```\n完成"
+    chunks = render_markdown(md, 1000)
+    if (len(chunks) > 1 and all(len(c.html) <= 1000 for c in chunks)
+            and all(c.html.count("<pre>") == c.html.count("</pre>") for c in chunks)
+            and chunks[0].html.startswith("<b>改动</b> &lt;auth&gt;")
+            and render_markdown(md, 1000) is chunks):
+        passed += 1
+        print("  [PASS] Telegram HTML 渲染")
+    else:
+        failed += 1
+        print(f"  [FAIL] Telegram HTML 渲染: {chunks[0].html[:200]!r}")
     print()
 
     # ========== 10. GitHub 集成（真调 gh） ==========
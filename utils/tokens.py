@@ -0,0 +1,61 @@
+"""token 估算 — 不依赖分词器，按字符类别分别计价
+
+各类别的经验系数（Claude 分词器下的大致值）：
+  中日韩字符      每字约 1 token
+  英文单词        约 4 个字母 1 token，至少 1
+  数字            约 3 位 1 token
+  符号（代码）    连续符号约 2 个 1 token
+  换行            每个 1 token；单个空格并入后一个词不计，连续缩进约 4 个 1 token
+系数偏差可通过 DEBUG 日志中的「估算 / 实际」对比校准。
+"""
+
+import math
+import re
+from functools import lru_cache
+
+CJK_TOKENS_PER_CHAR = 1.0
+CHARS_PER_WORD_TOKEN = 4
+DIGITS_PER_TOKEN = 3
+SYMBOLS_PER_TOKEN = 2
+SPACES_PER_TOKEN = 4
+
+_SEGMENT_RE = re.compile(
+    r"(?P<cjk>[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff"
+    r"\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]+)"
+    r"|(?P<word>[A-Za-z]+)"
+    r"|(?P<num>[0-9]+)"
+    r"|(?P<newline>\n+)"
+    r"|(?P<space>[ \t\r\f\v]+)"
+    r"|(?P<symbol>[!-/:-@\[-`{-~]+)"
+    r"|(?P<other>.)",
+    re.S,
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的 token 数"""
+    total = 0.0
+    for m in _SEGMENT_RE.finditer(text):
+        kind = m.lastgroup
+        n = m.end() - m.start()
+        if kind == "cjk":
+            total += n * CJK_TOKENS_PER_CHAR
+        elif kind == "word":
+            total += math.ceil(n / CHARS_PER_WORD_TOKEN)
+        elif kind == "num":
+            total += math.ceil(n / DIGITS_PER_TOKEN)
+        elif kind == "newline":
+            total += n
+        elif kind == "space":
+            total += (n - 1) / SPACES_PER_TOKEN
+        elif kind == "symbol":
+            total += math.ceil(n / SYMBOLS_PER_TOKEN)
+        else:
+            total += 1
+    return math.ceil(total)
+
+
+@lru_cache(maxsize=4096)
+def cached_tokens(text: str) -> int:
+    """带缓存的 estimate_tokens，用于反复估算的短文本（如每条记忆的格式化行）"""
+    return estimate_tokens(text)